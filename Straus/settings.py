@@ -26,7 +26,11 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 SECRET_KEY = os.getenv("KEY")
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = os.getenv("DEBUG")
+DEBUG = os.getenv("DEBUG", '').lower() in ('1', 'true', 'yes')
+
+# django-debug-toolbar adds a sync-only middleware and its own overhead to
+# every request; it is only ever installed with DEBUG on.
+DEBUG_TOOLBAR = DEBUG and os.getenv('DEBUG_TOOLBAR', 'true').lower() in ('1', 'true', 'yes')
 
 ALLOWED_HOSTS = ['*']
 
@@ -41,20 +45,25 @@ INSTALLED_APPS = [
     'django.contrib.staticfiles',
     'rest_framework',
     'shop.apps.ShopConfig',
-    'debug_toolbar',
 ]
 
 MIDDLEWARE = [
+    'shop.instrumentation.RequestMetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'shop.routers.ReadYourWritesMiddleware',
 ]
 
+if DEBUG_TOOLBAR:
+    INSTALLED_APPS.append('debug_toolbar')
+    MIDDLEWARE.insert(MIDDLEWARE.index('django.middleware.security.SecurityMiddleware') + 1,
+                      'debug_toolbar.middleware.DebugToolbarMiddleware')
+
 ROOT_URLCONF = 'Straus.urls'
 
 TEMPLATES = [
@@ -87,6 +96,34 @@ DATABASES = {
         'PASSWORD': os.getenv('DB_PASSWORD'),
         'HOST': os.getenv('DB_HOST'),
         'PORT': os.getenv('DB_PORT'),
+        # Keep connections open across requests instead of connecting for
+        # every one; 0 closes them after each request, as under ASGI, where
+        # every request runs in a new thread (see gunicorn.conf.py).
+        'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': os.getenv('DB_CONN_HEALTH_CHECKS', 'true').lower() in ('1', 'true', 'yes'),
+        # PgBouncer in transaction mode (the `pooling` compose profile) cannot
+        # keep the server-side cursors of iterator() open across transactions.
+        'DISABLE_SERVER_SIDE_CURSORS': os.getenv('DB_TRANSACTION_POOLING', '').lower() in ('1', 'true', 'yes'),
+    }
+}
+
+# Read replicas: a comma-separated list of hosts reached with the primary's
+# credentials. GET requests to the order list and detail endpoints read from
+# a random one, except for clients that wrote within the last
+# DB_REPLICA_PIN_SECONDS (see shop/routers.py).
+for number, host in enumerate(filter(None, os.getenv('DB_REPLICA_HOSTS', '').replace(' ', '').split(',')), 1):
+    DATABASES[f'replica{number}'] = {**DATABASES['default'], 'HOST': host, 'TEST': {'MIRROR': 'default'}}
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+DATABASE_ROUTERS = ['shop.routers.ReplicaRouter']
+DB_REPLICA_PIN_SECONDS = int(os.getenv('DB_REPLICA_PIN_SECONDS', 10))
+
+# Cache
+# https://docs.djangoproject.com/en/4.2/topics/cache/
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
     }
 }
 
@@ -129,6 +166,90 @@ STATIC_URL = 'static/'
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
+# Django REST framework
+# https://www.django-rest-framework.org/api-guide/settings/
+
+REST_FRAMEWORK = {
+    'DEFAULT_RENDERER_CLASSES': [
+        'shop.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'shop.parsers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+}
+
+# 'auto' uses orjson when installed, 'stdlib' forces the json module.
+JSON_ENGINE = os.getenv('JSON_ENGINE', 'auto')
+
+# Orders API
+ORDERS_PAGE_SIZE = int(os.getenv('ORDERS_PAGE_SIZE', 50))
+ORDERS_MAX_PAGE_SIZE = int(os.getenv('ORDERS_MAX_PAGE_SIZE', 500))
+ORDERS_BULK_MAX_ITEMS = int(os.getenv('ORDERS_BULK_MAX_ITEMS', 1000))
+ORDERS_MAX_QUANTITY = int(os.getenv('ORDERS_MAX_QUANTITY', 10000))
+ORDERS_EXPORT_CHUNK_SIZE = int(os.getenv('ORDERS_EXPORT_CHUNK_SIZE', 2000))
+# Orders deleted per transaction by POST /api/v1/orders/purge/ and
+# `manage.py purge_orders`.
+ORDERS_PURGE_CHUNK_SIZE = int(os.getenv('ORDERS_PURGE_CHUNK_SIZE', 1000))
+# `manage.py archive_orders` moves orders older than ARCHIVE_AFTER_DAYS to the
+# archive tables, BATCH_SIZE per transaction (see shop/archive.py). With
+# PARTITIONED on, migration 0010 creates the archive tables on Postgres
+# range-partitioned by order_date; it only takes effect when that migration runs.
+ORDERS_ARCHIVE_AFTER_DAYS = int(os.getenv('ORDERS_ARCHIVE_AFTER_DAYS', 365))
+ORDERS_ARCHIVE_BATCH_SIZE = int(os.getenv('ORDERS_ARCHIVE_BATCH_SIZE', 1000))
+ORDERS_ARCHIVE_PARTITIONED = os.getenv('ORDERS_ARCHIVE_PARTITIONED', '').lower() in ('1', 'true', 'yes')
+# Build order list/detail GET payloads from values() rows instead of DRF
+# serializers (see shop/projections.py).
+ORDERS_FAST_READS = os.getenv('ORDERS_FAST_READS', 'true').lower() in ('1', 'true', 'yes')
+# Serve the order list and detail endpoints with the async views of
+# shop/async_views.py; only worth it under ASGI (Straus/asgi.py).
+ORDERS_ASYNC_VIEWS = os.getenv('ORDERS_ASYNC_VIEWS', '').lower() in ('1', 'true', 'yes')
+
+# Queue Product.sold_items_count changes in the SoldItemsDelta outbox instead
+# of updating hot product rows inside every order transaction; run
+# `manage.py flush_sold_items` to apply them at most MAX_STALENESS seconds late.
+SOLD_ITEMS_DEFERRED = os.getenv('SOLD_ITEMS_DEFERRED', '').lower() in ('1', 'true', 'yes')
+SOLD_ITEMS_MAX_STALENESS = float(os.getenv('SOLD_ITEMS_MAX_STALENESS', 5))
+SOLD_ITEMS_FLUSH_BATCH = int(os.getenv('SOLD_ITEMS_FLUSH_BATCH', 5000))
+
+# Seconds a POST /api/v1/orders/ Idempotency-Key is remembered; expired keys
+# are removed by `manage.py purge_idempotency_keys`.
+IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', 24 * 60 * 60))
+
+# Product name -> id cache used by order writes; SHARED also keeps workers
+# in sync through the default cache backend.
+PRODUCT_NAME_CACHE_SIZE = int(os.getenv('PRODUCT_NAME_CACHE_SIZE', 10000))
+PRODUCT_NAME_CACHE_TTL = int(os.getenv('PRODUCT_NAME_CACHE_TTL', 300))
+PRODUCT_NAME_CACHE_SHARED = os.getenv('PRODUCT_NAME_CACHE_SHARED', '').lower() in ('1', 'true', 'yes')
+
+# Serialized order detail and list payloads; bump ORDERS_CACHE_VERSION when
+# the payload shape changes.
+ORDERS_CACHE_ENABLED = os.getenv('ORDERS_CACHE_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+ORDERS_CACHE_TTL = int(os.getenv('ORDERS_CACHE_TTL', 300))
+ORDERS_CACHE_VERSION = 3
+
+# Query count and timings of every request, per URL name (see
+# shop/instrumentation.py): sent in a Server-Timing header and aggregated
+# in /api/v1/metrics/. A request running more queries than the budget of its
+# 'url_name:METHOD' (or 'url_name') is logged, or fails with QUERY_BUDGET_RAISE.
+REQUEST_METRICS_ENABLED = os.getenv('REQUEST_METRICS_ENABLED', 'true').lower() in ('1', 'true', 'yes')
+REQUEST_METRICS_SERVER_TIMING = os.getenv('REQUEST_METRICS_SERVER_TIMING', 'true').lower() in ('1', 'true', 'yes')
+# The GET budgets fit the serializer read path (ORDERS_FAST_READS off) of a
+# session user: session and user, ETag freshness, then the payload queries.
+QUERY_BUDGETS = {
+    'order_list:GET': 5,
+    'order_list:POST': 16,
+    'order_bulk': 20,
+    'order_edit:GET': 6,
+    'order_edit': 20,
+    'stats_top_products': 2,
+    'stats_daily': 2,
+}
+# Off by default, so a blown budget is only logged; shop/tests.py turns it on for its tests.
+QUERY_BUDGET_RAISE = os.getenv('QUERY_BUDGET_RAISE', '').lower() in ('1', 'true', 'yes')
+
 INTERNAL_IPS = [
     '127.0.0.1,',
     'localhost',
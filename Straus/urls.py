@@ -1,12 +1,10 @@
-import debug_toolbar
+from django.conf import settings
 from django.contrib import admin
 from django.urls import path, include
-from .settings import DEBUG
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/v1/', include('shop.urls')),
 ]
-if DEBUG:
-    urlpatterns += [path('__debug__/', include(debug_toolbar.urls))]
-
+if getattr(settings, 'DEBUG_TOOLBAR', False):
+    urlpatterns += [path('__debug__/', include('debug_toolbar.urls'))]
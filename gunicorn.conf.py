@@ -0,0 +1,38 @@
+"""
+Production server profile: ``gunicorn -c gunicorn.conf.py``.
+
+Runs Straus/wsgi.py in pre-forked threaded workers by default; with
+SERVER_INTERFACE=asgi it runs Straus/asgi.py in uvicorn workers instead
+(what ORDERS_ASYNC_VIEWS is for). Every value can be overridden from the
+environment or the command line.
+"""
+import multiprocessing
+import os
+
+interface = os.getenv('SERVER_INTERFACE', 'wsgi')
+
+bind = os.getenv('SERVER_BIND', '0.0.0.0:8000')
+workers = int(os.getenv('WEB_CONCURRENCY', multiprocessing.cpu_count() * 2 + 1))
+timeout = int(os.getenv('SERVER_TIMEOUT', 30))
+graceful_timeout = int(os.getenv('SERVER_GRACEFUL_TIMEOUT', 30))
+keepalive = int(os.getenv('SERVER_KEEPALIVE', 5))
+# Recycle workers now and then so that a slow leak cannot grow without bound;
+# the jitter keeps them from restarting all at once.
+max_requests = int(os.getenv('SERVER_MAX_REQUESTS', 10000))
+max_requests_jitter = int(os.getenv('SERVER_MAX_REQUESTS_JITTER', 1000))
+accesslog = os.getenv('SERVER_ACCESS_LOG', '-') or None
+errorlog = '-'
+
+if interface == 'asgi':
+    wsgi_app = 'Straus.asgi:application'
+    worker_class = 'uvicorn.workers.UvicornWorker'
+    # Django runs every ASGI request in a new thread, and connections are per
+    # thread, so persistent connections would only pile up; pool them with
+    # PgBouncer instead.
+    os.environ.setdefault('DB_CONN_MAX_AGE', '0')
+else:
+    wsgi_app = 'Straus.wsgi:application'
+    worker_class = 'gthread'
+    # Each thread keeps its own persistent database connection, so workers *
+    # threads is the number of connections the server holds open.
+    threads = int(os.getenv('SERVER_THREADS', 4))
@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import Category, Product, Order
+from . import counters
+from .models import ArchivedOrder, ArchivedOrderItem, Category, Product, Order, OrderItem
 
 
 @admin.register(Category)
@@ -14,7 +15,50 @@ class ProductAdmin(admin.ModelAdmin):
     readonly_fields = ['sold_items_count']
 
 
+class OrderItemInline(admin.TabularInline):
+    model = OrderItem
+    extra = 1
+    readonly_fields = ['unit_price']
+
+
 @admin.register(Order)
 class OrderAdmin(admin.ModelAdmin):
     list_display = ['customer_name', 'total_amount', 'order_date']
     readonly_fields = ['total_amount']
+    inlines = [OrderItemInline]
+
+    def save_related(self, request, form, formsets, change):
+        # Inline rows are saved one by one, past the m2m signals, so the
+        # counters are brought up to date from the before/after quantities.
+        before = counters.order_sales([form.instance.pk])
+        super().save_related(request, form, formsets, change)
+        counters.resync_orders([form.instance.pk], before)
+
+
+class ArchivedOrderItemInline(admin.TabularInline):
+    model = ArchivedOrderItem
+    extra = 0
+    can_delete = False
+
+    def has_add_permission(self, request, obj=None):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    list_display = ['id', 'customer_name', 'total_amount', 'order_date', 'archived_at']
+    date_hierarchy = 'order_date'
+    inlines = [ArchivedOrderItemInline]
+
+    # Archived orders are read-only, like in the API.
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
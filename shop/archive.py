@@ -0,0 +1,109 @@
+"""
+Archival of cold orders out of the hot tables.
+
+archive_orders() moves the orders placed before a cutoff date, with their
+lines, into ArchivedOrder and ArchivedOrderItem, one batch per transaction.
+A batch is two INSERT ... SELECT statements and two DELETEs, so no order is
+ever loaded into Python. Archived orders keep their ids and stay counted in
+Product.sold_items_count and the DailySales rollups, so the counters are not
+touched. They are still served by /api/v1/orders/<pk>/ (the detail
+projections fall back to the archive) but are read-only: writes to them
+answer 409 with OrderArchived.
+
+On Postgres with ORDERS_ARCHIVE_PARTITIONED, migration 0010 creates the
+archive tables range-partitioned by order_date and the monthly partitions a
+batch needs are created right before it is copied.
+"""
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.db.models import DateTimeField, F, Value
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .caching import order_cache
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+
+ORDER_FIELDS = ['id', 'version', 'updated_at', 'customer_name', 'total_amount', 'order_date']
+LINE_FIELDS = ['id', 'order_id', 'product_id', 'quantity', 'unit_price']
+
+
+class OrderArchived(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = 'This order is archived and can no longer be changed.'
+    default_code = 'archived'
+
+
+def is_archived(pk):
+    return ArchivedOrder.objects.filter(pk=pk).exists()
+
+
+async def ais_archived(pk):
+    return await ArchivedOrder.objects.filter(pk=pk).aexists()
+
+
+def archive_orders(before, batch_size=1000):
+    """
+    Move the orders with ``order_date < before`` and their lines to the
+    archive, ``batch_size`` orders per transaction, oldest first, and return
+    how many were moved. An interrupted run leaves the batches before it
+    fully archived and the rest untouched.
+    """
+    orders = Order.objects.filter(order_date__lt=before)
+    partitioned = is_partitioned()
+    archived = 0
+    while True:
+        with transaction.atomic():
+            order_ids = list(orders.select_for_update().order_by('order_date', 'pk')
+                             .values_list('pk', flat=True)[:batch_size])
+            if not order_ids:
+                return archived
+            if partitioned:
+                create_partitions(Order.objects.filter(pk__in=order_ids).dates('order_date', 'month'))
+
+            archived_at = Value(timezone.now(), output_field=DateTimeField())
+            _insert_from(ArchivedOrder, ORDER_FIELDS + ['archived_at'],
+                         Order.objects.filter(pk__in=order_ids).values(*ORDER_FIELDS, archived_at=archived_at))
+            _insert_from(ArchivedOrderItem, LINE_FIELDS + ['order_date'],
+                         OrderItem.objects.filter(order_id__in=order_ids)
+                         .values(*LINE_FIELDS, archived_order_date=F('order__order_date')))
+
+            # _raw_delete() skips the collector and the delete signals, which
+            # would take the archived lines back out of the counters.
+            lines = OrderItem.objects.filter(order_id__in=order_ids)
+            lines._raw_delete(lines.db)
+            batch = Order.objects.filter(pk__in=order_ids)
+            archived += batch._raw_delete(batch.db)
+            order_cache.touch(orders=order_ids)
+
+
+def _insert_from(model, fields, queryset):
+    """INSERT INTO the table of ``model`` the rows of the values() ``queryset``, whose columns match ``fields``."""
+    quote = connection.ops.quote_name
+    columns = ', '.join(quote(model._meta.get_field(name).column) for name in fields)
+    sql, params = queryset.order_by().query.get_compiler(queryset.db).as_sql()
+    with connection.cursor() as cursor:
+        cursor.execute(f'INSERT INTO {quote(model._meta.db_table)} ({columns}) {sql}', params)
+
+
+def is_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)',
+                       [ArchivedOrder._meta.db_table])
+        return cursor.fetchone() is not None
+
+
+def create_partitions(months):
+    """Create the partitions of both archive tables for the months starting on each of ``months``."""
+    quote = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        for first in months:
+            following = (first + timedelta(days=31)).replace(day=1)
+            for model in [ArchivedOrder, ArchivedOrderItem]:
+                table = model._meta.db_table
+                cursor.execute(f'CREATE TABLE IF NOT EXISTS {quote(f"{table}_p{first:%Y_%m}")} '
+                               f'PARTITION OF {quote(table)} '
+                               f"FOR VALUES FROM ('{first.isoformat()}') TO ('{following.isoformat()}')")
@@ -0,0 +1,225 @@
+"""
+Async versions of the order list, detail, create and update endpoints.
+
+With ORDERS_ASYNC_VIEWS on, shop/urls.py routes /api/v1/orders/ and
+/api/v1/orders/<pk>/ here instead of to the DRF views, for deployments
+served through Straus/asgi.py. Reads go through the async ORM and the async
+cache API, so the view itself never blocks the event loop. Django does not
+support transactions in async code yet, so every write is a single
+sync_to_async() call around the same functions the DRF views use, which
+keeps its transaction (and the Idempotency-Key claim) on one thread.
+
+The async path covers JSON requests with ORDERS_FAST_READS on. It runs the
+authentication, permission and throttle checks of the DRF views with their
+classes, and shares their exception handling. Everything else (the
+browsable API, OPTIONS, HEAD, unsupported methods, object-level
+permissions) is handed to the DRF view, so clients see the same responses
+either way.
+"""
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import Http404
+from django.utils.cache import patch_vary_headers
+from rest_framework import permissions, status
+from rest_framework.exceptions import APIException
+from rest_framework.request import Request
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from . import archive, conditional, counters, fieldsets, idempotency, projections, routers, views
+from .caching import order_cache
+from .instrumentation import serializing
+from .models import Order
+from .pagination import OrderCursorPagination
+from .renderers import FastJSONRenderer
+
+_sync_order_list = sync_to_async(views.OrderListCreateView.as_view())
+_sync_order_edit = sync_to_async(views.OrderRetrieveUpdateDeleteView.as_view())
+
+
+def _allow(view_class):
+    view = view_class()
+    view.setup(None)  # adds HEAD, as for every request to the DRF view
+    return ', '.join(view.allowed_methods)
+
+
+LIST_ALLOW = _allow(views.OrderListCreateView)
+EDIT_ALLOW = _allow(views.OrderRetrieveUpdateDeleteView)
+
+
+def _negotiate(request):
+    """
+    Wrap ``request`` for DRF parsing and pick its renderer the way the DRF
+    views would; None when the async path does not serve it.
+    """
+    drf_request = Request(request, parsers=[parser() for parser in api_settings.DEFAULT_PARSER_CLASSES],
+                          authenticators=[auth() for auth in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    renderers = [renderer() for renderer in api_settings.DEFAULT_RENDERER_CLASSES]
+    try:
+        renderer, media_type = api_settings.DEFAULT_CONTENT_NEGOTIATION_CLASS().select_renderer(
+            drf_request, renderers)
+    except APIException:
+        return None
+    if not isinstance(renderer, FastJSONRenderer):
+        return None
+    drf_request.accepted_renderer, drf_request.accepted_media_type = renderer, media_type
+    return drf_request
+
+
+def _view(view_class, request, **kwargs):
+    """The DRF view instance whose checks and exception handling the async path shares."""
+    return view_class(request=request, args=(), kwargs=kwargs, format_kwarg=None, headers={})
+
+
+async def _check(view, request):
+    """
+    The permission and throttle checks of APIView.initial(), with the classes
+    of the DRF view. Permissions may read the database and throttles the
+    cache, so unless there is nothing but AllowAny to check they run in a
+    thread.
+    """
+    if view.throttle_classes or any(permission is not permissions.AllowAny
+                                    for permission in view.permission_classes):
+        await sync_to_async(_initial_checks)(view, request)
+
+
+def _initial_checks(view, request):
+    view.check_permissions(request)
+    view.check_throttles(request)
+
+
+def _has_object_permissions(view_class):
+    """Whether ``view_class`` checks permissions per order, which needs the order the DRF view loads."""
+    default = permissions.BasePermission.has_object_permission
+    return any(getattr(permission, 'has_object_permission', None) is not default
+               for permission in view_class.permission_classes)
+
+
+async def _authenticate(request):
+    """
+    Run the DRF authenticators, as APIView.initial() does (session users get
+    the CSRF check). Only a session cookie or credentials can make them
+    query the database, and only then do they go to a thread.
+    """
+    if settings.SESSION_COOKIE_NAME in request.COOKIES or 'HTTP_AUTHORIZATION' in request.META:
+        return await sync_to_async(getattr)(request, 'user')
+    return request.user
+
+
+def _finalize(request, response, allow):
+    """What APIView.finalize_response() does for the DRF views."""
+    if isinstance(response, Response):
+        response.accepted_renderer = request.accepted_renderer
+        response.accepted_media_type = request.accepted_media_type
+        response.renderer_context = {'request': request, 'response': response}
+    response['Allow'] = allow
+    if len(api_settings.DEFAULT_RENDERER_CLASSES) > 1:
+        patch_vary_headers(response, ['Accept'])
+    return response
+
+
+async def order_list(request):
+    drf_request = _negotiate(request)
+    if drf_request is None or request.method not in ['GET', 'POST'] \
+            or (request.method == 'GET' and not getattr(settings, 'ORDERS_FAST_READS', False)):
+        return await _sync_order_list(request)
+
+    view = _view(views.OrderListCreateView, drf_request)
+    try:
+        await _authenticate(drf_request)
+        await _check(view, drf_request)
+        if request.method == 'GET':
+            response = await _list(drf_request)
+        else:
+            response = await _create(drf_request)
+    except (APIException, Http404) as exc:
+        response = view.handle_exception(exc)
+    return _finalize(drf_request, response, LIST_ALLOW)
+
+
+async def order_edit(request, pk):
+    drf_request = _negotiate(request)
+    if drf_request is None or request.method not in ['GET', 'PUT', 'PATCH', 'DELETE'] \
+            or (request.method == 'GET' and not getattr(settings, 'ORDERS_FAST_READS', False)) \
+            or _has_object_permissions(views.OrderRetrieveUpdateDeleteView):
+        return await _sync_order_edit(request, pk=pk)
+
+    view = _view(views.OrderRetrieveUpdateDeleteView, drf_request, pk=pk)
+    try:
+        await _authenticate(drf_request)
+        await _check(view, drf_request)
+        if request.method == 'GET':
+            response = await _detail(drf_request, pk)
+        elif request.method == 'DELETE':
+            response = await _delete(pk)
+        else:
+            response = await _update(drf_request, pk, partial=request.method == 'PATCH')
+    except (APIException, Http404) as exc:
+        response = view.handle_exception(exc)
+    return _finalize(drf_request, response, EDIT_ALLOW)
+
+
+# The DRF views are csrf_exempt through as_view(); Django 4.2's csrf_exempt()
+# does not wrap coroutine functions, so the flag is set directly.
+order_list.csrf_exempt = True
+order_edit.csrf_exempt = True
+
+
+async def _list(request):
+    try:
+        fieldset = fieldsets.parse(request.query_params, fieldsets.LIST)
+        filters = views.order_filters(request.query_params)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    paginator = OrderCursorPagination()
+    orders = Order.objects.filter(filters)
+
+    async def build():
+        with serializing():
+            page = await paginator.apaginate_queryset(orders.values(*projections.list_columns(fieldset)), request)
+            return paginator.get_paginated_response(await projections.aorder_list(page, fieldset)).data
+
+    async def respond():
+        return Response(await order_cache.alist_page(request, build))
+
+    with routers.read_replica(request):
+        page = OrderCursorPagination().get_page_queryset(orders, request)
+        return await conditional.aconditional_response(request, page, respond, fieldset)
+
+
+async def _detail(request, pk):
+    try:
+        fieldset = fieldsets.parse(request.query_params, fieldsets.DETAIL)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    async def build():
+        with serializing():
+            return await projections.aorder_detail(pk, fieldset)
+
+    async def respond():
+        return Response(await order_cache.adetail(pk, build, fieldsets.variant(request.query_params)))
+
+    with routers.read_replica(request):
+        return await conditional.aconditional_response(request, Order.objects.filter(pk=pk), respond, fieldset)
+
+
+async def _create(request):
+    # Parsed here; the key claim and the write then share one transaction on one thread.
+    data = request.data
+    return await sync_to_async(idempotency.idempotent)(request, lambda: views.create_order(data))
+
+
+async def _update(request, pk, partial):
+    instance = await Order.objects.filter(pk=pk).afirst()
+    if instance is None:
+        raise archive.OrderArchived if await archive.ais_archived(pk) else Http404
+    data = request.data
+    return await sync_to_async(views.update_order)(instance, data, partial=partial)
+
+
+async def _delete(pk):
+    if not await Order.objects.filter(pk=pk).aexists():
+        raise archive.OrderArchived if await archive.ais_archived(pk) else Http404
+    await sync_to_async(counters.delete_orders)([pk])
+    return Response(status=status.HTTP_204_NO_CONTENT)
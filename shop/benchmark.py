@@ -0,0 +1,288 @@
+"""
+Benchmarks of the orders API hot paths, run by ``manage.py benchmark``.
+
+Every scenario sends requests through the URLconf, middleware and views
+with the test client, so the numbers cover everything but the network and
+the WSGI server. Latencies come from a plain timed loop; query counts and
+peak memory come from a few extra requests run under CaptureQueriesContext
+and tracemalloc, which would otherwise skew the timings.
+
+``run_asgi()`` instead drives Django's ASGI handler directly with many
+concurrent clients that upload and read slowly, to compare the sync and the
+async order views under load.
+
+``cache_hit_ratio`` is the share of the timed requests' order cache lookups
+that hit, or None with the cache off. ``list_with_writes`` mixes one order
+write into every LIST_WRITE_EVERY list reads: each write starts a new
+generation of the whole list cache, so its ratio shows how fast the list
+cache, which is meant for read-mostly traffic, falls off under writes.
+"""
+import asyncio
+import json
+import math
+import random
+import threading
+import time
+import tracemalloc
+from urllib.parse import urlsplit
+
+from django.core.handlers.asgi import ASGIHandler
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+
+from .caching import order_cache
+from .models import Order, Product
+
+# list_with_writes creates an order after every this many list reads.
+LIST_WRITE_EVERY = 10
+
+
+class Workload:
+    """Random but reproducible request payloads over the orders and products in the database."""
+
+    def __init__(self, seed=1, bulk_size=50):
+        self.rng = random.Random(seed)
+        self.bulk_size = bulk_size
+        self.orders = list(Order.objects.order_by('id').values_list('id', flat=True))
+        self.rng.shuffle(self.orders)
+        self.doomed = []
+        self.products = list(Product.objects.order_by('id').values_list('name', flat=True))
+        self.mixed_sent = 0
+
+    def reserve(self, count):
+        """Set ``count`` orders aside for deletion; the other scenarios never pick them."""
+        if count >= len(self.orders):
+            raise ValueError(f'{count} orders to delete need a dataset of more than {count} orders.')
+        self.doomed, self.orders = self.orders[:count], self.orders[count:]
+
+    def order_id(self):
+        return self.rng.choice(self.orders)
+
+    def order_products(self):
+        names = self.rng.sample(self.products, k=self.rng.randint(1, min(3, len(self.products))))
+        return [{'name': name, 'quantity': self.rng.randint(1, 3)} for name in names]
+
+
+# A scenario returns the (method, path, JSON body or None) of its next request.
+
+def list_orders(work):
+    return 'get', reverse('order_list'), None
+
+
+def list_with_writes(work):
+    work.mixed_sent += 1
+    if work.mixed_sent % (LIST_WRITE_EVERY + 1) == 0:
+        return create_order(work)
+    return list_orders(work)
+
+
+def order_detail(work):
+    return 'get', reverse('order_edit', args=[work.order_id()]), None
+
+
+def create_order(work):
+    return 'post', reverse('order_list'), {'customer_name': 'Benchmark', 'products': work.order_products()}
+
+
+def bulk_create_orders(work):
+    return 'post', reverse('order_bulk'), [{'customer_name': 'Benchmark', 'products': work.order_products()}
+                                           for _ in range(work.bulk_size)]
+
+
+def update_order(work):
+    return 'put', reverse('order_edit', args=[work.order_id()]), {'products': work.order_products()}
+
+
+def delete_order(work):
+    return 'delete', reverse('order_edit', args=[work.doomed.pop()]), None
+
+
+SCENARIOS = {
+    'list': list_orders,
+    'list_with_writes': list_with_writes,
+    'detail': order_detail,
+    'create': create_order,
+    'bulk_create': bulk_create_orders,
+    'update': update_order,
+    'delete': delete_order,
+}
+
+READ_SCENARIOS = ['list', 'detail']
+
+# The scenarios the async views serve.
+ASGI_SCENARIOS = ['list', 'detail', 'create', 'update']
+
+
+def percentile(values, p):
+    """Nearest-rank percentile of ``values``."""
+    ordered = sorted(values)
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+def _cache_lookups():
+    stats = order_cache.stats()
+    return stats['hits'], stats['misses']
+
+
+def _hit_ratio(before):
+    if not order_cache.enabled:
+        return None
+    hits, misses = (after - was for after, was in zip(_cache_lookups(), before))
+    return round(hits / (hits + misses), 3) if hits + misses else None
+
+
+def _send(name, client, work):
+    method, path, data = SCENARIOS[name](work)
+    if data is None:
+        response = getattr(client, method)(path)
+    else:
+        response = getattr(client, method)(path, data, content_type='application/json')
+    if response.status_code >= 400:
+        raise RuntimeError(f'{name}: {method.upper()} {path} returned {response.status_code}.')
+    return response
+
+
+def run(name, work, iterations=100, warmup=10, samples=10):
+    """Send ``warmup + iterations + samples`` requests of scenario ``name`` and return their metrics."""
+    client = Client()
+    for _ in range(warmup):
+        _send(name, client, work)
+
+    latencies = []
+    lookups = _cache_lookups()
+    started = time.perf_counter()
+    for _ in range(iterations):
+        sent = time.perf_counter()
+        _send(name, client, work)
+        latencies.append(time.perf_counter() - sent)
+    elapsed = time.perf_counter() - started
+    hit_ratio = _hit_ratio(lookups)
+
+    queries, peaks = [], []
+    tracemalloc.start()
+    try:
+        for _ in range(samples):
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            with CaptureQueriesContext(connection) as captured:
+                _send(name, client, work)
+            queries.append(len(captured))
+            peaks.append(tracemalloc.get_traced_memory()[1] - before)
+    finally:
+        tracemalloc.stop()
+
+    return {
+        'iterations': iterations,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'max_ms': round(max(latencies) * 1000, 3),
+        'throughput_rps': round(iterations / elapsed, 1),
+        'queries': max(queries, default=None),
+        'peak_memory_kib': round(max(peaks) / 1024, 1) if peaks else None,
+        'cache_hit_ratio': hit_ratio,
+    }
+
+
+def run_asgi(name, work, requests=200, concurrency=50, client_delay=0.05):
+    """
+    Send ``requests`` requests of scenario ``name`` through the ASGI handler
+    from ``concurrency`` clients at a time. Each client waits
+    ``client_delay`` seconds before uploading its body and again before
+    reading the response, like a client on a slow network; latencies include
+    those waits. ``peak_threads`` is the most threads alive at once.
+    """
+    specs = [SCENARIOS[name](work) for _ in range(requests)]
+    app = ASGIHandler()
+    latencies, failures, peak_threads = [], [], [threading.active_count()]
+
+    async def client(pending):
+        for method, path, data in pending:
+            sent = time.perf_counter()
+            status = await _asgi_request(app, method, path, data, client_delay)
+            latencies.append(time.perf_counter() - sent)
+            peak_threads[0] = max(peak_threads[0], threading.active_count())
+            if status >= 400:
+                failures.append(f'{name}: {method.upper()} {path} returned {status}.')
+
+    async def load():
+        pending = iter(specs)
+        await asyncio.gather(*(client(pending) for _ in range(concurrency)))
+
+    lookups = _cache_lookups()
+    started = time.perf_counter()
+    asyncio.run(load())
+    elapsed = time.perf_counter() - started
+    hit_ratio = _hit_ratio(lookups)
+    if failures:
+        raise RuntimeError(failures[0])
+
+    return {
+        'iterations': requests,
+        'concurrency': concurrency,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+        'max_ms': round(max(latencies) * 1000, 3),
+        'throughput_rps': round(requests / elapsed, 1),
+        'peak_threads': peak_threads[0],
+        'queries': None,
+        'peak_memory_kib': None,
+        'cache_hit_ratio': hit_ratio,
+    }
+
+
+async def _asgi_request(app, method, path, data, client_delay):
+    url = urlsplit(path)
+    body = b'' if data is None else json.dumps(data).encode()
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'scheme': 'http',
+        'method': method.upper(), 'path': url.path, 'raw_path': url.path.encode(), 'root_path': '',
+        'query_string': url.query.encode(), 'client': ('127.0.0.1', 0), 'server': ('testserver', 80),
+        'headers': [(b'host', b'testserver'), (b'content-type', b'application/json'),
+                    (b'content-length', str(len(body)).encode())],
+    }
+    done = asyncio.Event()
+    uploaded, status = False, None
+
+    async def receive():
+        nonlocal uploaded
+        if uploaded:
+            await done.wait()
+            return {'type': 'http.disconnect'}
+        await asyncio.sleep(client_delay)
+        uploaded = True
+        return {'type': 'http.request', 'body': body, 'more_body': False}
+
+    async def send(message):
+        nonlocal status
+        if message['type'] == 'http.response.start':
+            status = message['status']
+            await asyncio.sleep(client_delay)
+        elif not message.get('more_body', False):
+            done.set()
+
+    await app(scope, receive, send)
+    done.set()
+    return status
+
+
+def compare(baseline, report, threshold=0.2):
+    """
+    Describe every scenario of ``report`` whose p95 latency or peak memory
+    grew by more than ``threshold`` over ``baseline``, or that runs more
+    queries. Scenarios missing from the baseline are not compared.
+    """
+    regressions = []
+    for size, scenarios in report['results'].items():
+        for name, current in scenarios.items():
+            base = baseline.get('results', {}).get(size, {}).get(name)
+            if base is None:
+                continue
+            for metric in ['p95_ms', 'peak_memory_kib']:
+                if base.get(metric) and (current[metric] or 0) > base[metric] * (1 + threshold):
+                    regressions.append(f'{name}@{size}: {metric} {base[metric]} -> {current[metric]}')
+            if base.get('queries') is not None and current['queries'] is not None \
+                    and current['queries'] > base['queries']:
+                regressions.append(f'{name}@{size}: queries {base["queries"]} -> {current["queries"]}')
+    return regressions
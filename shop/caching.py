@@ -0,0 +1,239 @@
+"""
+Caching of serialized order payloads.
+
+Every cacheable object (an order, a product, a category, and the order list
+as a whole) has a version token in the cache. A detail entry stores the
+tokens of everything it was built from and is served only while they all
+still match, which costs two cache reads. Writers replace the tokens of
+what they changed through ``touch()``: the counter layer for order lines
+and sold counters, and the receivers in signals.py for everything else.
+
+The list pages share the single list token, which every order write
+replaces, so the list cache only pays off for read-mostly traffic: each
+write empties it for every filter and page. ``manage.py benchmark --cache``
+shows its hit ratio with and without writes mixed in (``list`` and
+``list_with_writes``).
+
+Tokens start with the time they were written. A payload read from a
+replica (see routers.py) is not stored while any of its tokens is younger
+than DB_REPLICA_PIN_SECONDS: the replica may not have the write that
+replaced the token yet, and the stale payload would otherwise be served
+under the new token to everyone, including the clients pinned to the
+primary.
+"""
+import hashlib
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+
+from . import routers
+
+
+class OrderResponseCache:
+    list_key = 'shop:v:orders'
+
+    def __init__(self, enabled=True, ttl=300, version=1, cache_alias='default'):
+        self.enabled = enabled
+        self.ttl = ttl
+        self.version = version
+        self.cache_alias = cache_alias
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.hit_seconds = 0.0
+        self.miss_seconds = 0.0
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def detail(self, order_id, build, variant=''):
+        """
+        Return the payload of order ``order_id``. ``build()`` is called only
+        on a miss and returns ``(data, products)``, where ``products`` lists
+        the ``(product_id, category_id)`` pairs the payload was built from
+        (``category_id`` None when it does not depend on the category).
+        ``variant`` tells sparse payloads of the order apart (see fieldsets.py).
+        """
+        if not self.enabled:
+            return build()[0]
+
+        started = time.perf_counter()
+        key = self.detail_key(order_id, variant)
+        entry = self.cache.get(key, version=self.version)
+        if entry is not None and self._tokens(entry['deps']) == entry['deps']:
+            self._record(hit=True, started=started)
+            return entry['data']
+
+        # Read the order's token before the database so that a write landing
+        # in between leaves this entry already stale rather than wrong.
+        deps = self._tokens([self.order_key(order_id)], create=True)
+        data, products = build()
+        deps.update(self._tokens([self.product_key(pk) for pk, _ in products] +
+                                 [self.category_key(pk) for _, pk in products if pk is not None], create=True))
+        if self._settled(deps.values()):
+            self.cache.set(key, {'data': data, 'deps': deps}, timeout=self.ttl, version=self.version)
+        self._record(hit=False, started=started)
+        return data
+
+    async def adetail(self, order_id, build, variant=''):
+        """detail() for async views, through the async cache API; ``build`` is a coroutine function."""
+        if not self.enabled:
+            return (await build())[0]
+
+        started = time.perf_counter()
+        key = self.detail_key(order_id, variant)
+        entry = await self.cache.aget(key, version=self.version)
+        if entry is not None and await self._atokens(entry['deps']) == entry['deps']:
+            self._record(hit=True, started=started)
+            return entry['data']
+
+        deps = await self._atokens([self.order_key(order_id)], create=True)
+        data, products = await build()
+        deps.update(await self._atokens([self.product_key(pk) for pk, _ in products] +
+                                        [self.category_key(pk) for _, pk in products if pk is not None],
+                                        create=True))
+        if self._settled(deps.values()):
+            await self.cache.aset(key, {'data': data, 'deps': deps}, timeout=self.ttl, version=self.version)
+        self._record(hit=False, started=started)
+        return data
+
+    def list_page(self, request, build):
+        """Return one page of the order list; ``build()`` returns its payload."""
+        if not self.enabled:
+            return build()
+
+        started = time.perf_counter()
+        generation = self._tokens([self.list_key], create=True)[self.list_key]
+        key = self.list_page_key(request, generation)
+
+        data = self.cache.get(key, version=self.version)
+        if data is not None:
+            self._record(hit=True, started=started)
+            return data
+
+        data = build()
+        if self._settled([generation]):
+            self.cache.set(key, data, timeout=self.ttl, version=self.version)
+        self._record(hit=False, started=started)
+        return data
+
+    async def alist_page(self, request, build):
+        """list_page() for async views; ``build`` is a coroutine function."""
+        if not self.enabled:
+            return await build()
+
+        started = time.perf_counter()
+        generation = (await self._atokens([self.list_key], create=True))[self.list_key]
+        key = self.list_page_key(request, generation)
+
+        data = await self.cache.aget(key, version=self.version)
+        if data is not None:
+            self._record(hit=True, started=started)
+            return data
+
+        data = await build()
+        if self._settled([generation]):
+            await self.cache.aset(key, data, timeout=self.ttl, version=self.version)
+        self._record(hit=False, started=started)
+        return data
+
+    def touch(self, orders=(), products=(), categories=()):
+        """
+        Invalidate cached payloads that depend on the given ids. Tokens are
+        replaced now and again on commit, so a reader that saw the old rows
+        while the transaction was open cannot keep its entry alive.
+        """
+        if not self.enabled:
+            return
+
+        keys = [self.list_key]
+        keys += [self.order_key(pk) for pk in orders]
+        keys += [self.product_key(pk) for pk in products]
+        keys += [self.category_key(pk) for pk in categories]
+
+        def replace():
+            self.cache.set_many({key: self._new_token() for key in keys}, timeout=None, version=self.version)
+
+        replace()
+        transaction.on_commit(replace)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        average_hit = self.hit_seconds / self.hits if self.hits else 0.0
+        average_miss = self.miss_seconds / self.misses if self.misses else 0.0
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else None,
+            'average_hit_ms': average_hit * 1000,
+            'average_miss_ms': average_miss * 1000,
+            'estimated_saved_ms': max(average_miss - average_hit, 0.0) * self.hits * 1000,
+        }
+
+    def detail_key(self, pk, variant=''):
+        if variant:
+            return f'shop:order-detail:{pk}:{hashlib.md5(variant.encode()).hexdigest()}'
+        return f'shop:order-detail:{pk}'
+
+    def list_page_key(self, request, generation):
+        digest = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+        return f'shop:order-list:{generation}:{digest}'
+
+    def order_key(self, pk):
+        return f'shop:v:order:{pk}'
+
+    def product_key(self, pk):
+        return f'shop:v:product:{pk}'
+
+    def category_key(self, pk):
+        return f'shop:v:category:{pk}'
+
+    def _new_token(self):
+        return f'{time.time():.3f}:{uuid.uuid4().hex}'
+
+    def _settled(self, tokens):
+        """Whether a payload built from the current reads may be stored under ``tokens``."""
+        if not routers.reading_replica():
+            return True
+        horizon = time.time() - routers.pin_seconds()
+        return all(float(token.partition(':')[0]) < horizon for token in tokens)
+
+    def _tokens(self, keys, create=False):
+        keys = set(keys)
+        tokens = self.cache.get_many(keys, version=self.version)
+        if create:
+            for key in keys - tokens.keys():
+                tokens[key] = self.cache.get_or_set(key, self._new_token(), timeout=None, version=self.version)
+        return tokens
+
+    async def _atokens(self, keys, create=False):
+        keys = set(keys)
+        tokens = await self.cache.aget_many(keys, version=self.version)
+        if create:
+            for key in keys - tokens.keys():
+                tokens[key] = await self.cache.aget_or_set(key, self._new_token(), timeout=None,
+                                                           version=self.version)
+        return tokens
+
+    def _record(self, hit, started):
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            if hit:
+                self.hits += 1
+                self.hit_seconds += elapsed
+            else:
+                self.misses += 1
+                self.miss_seconds += elapsed
+
+
+order_cache = OrderResponseCache(
+    enabled=getattr(settings, 'ORDERS_CACHE_ENABLED', True),
+    ttl=getattr(settings, 'ORDERS_CACHE_TTL', 300),
+    version=getattr(settings, 'ORDERS_CACHE_VERSION', 1),
+    cache_alias=getattr(settings, 'ORDERS_CACHE_ALIAS', 'default'),
+)
@@ -0,0 +1,88 @@
+"""
+ETag / Last-Modified support for the order GET endpoints.
+
+Validators come from one aggregate query over the order rows and the
+versions of the products and categories they reference, so a poll that
+ends in 304 never runs the prefetch or the serializer. Versions only grow
+and a change of the product set bumps the order's own version, so the sums
+below change whenever anything in the payload does.
+"""
+import hashlib
+
+from django.db.models import Max, Sum
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+
+from . import fieldsets
+from .models import Order
+
+
+def fingerprints(queryset, fieldset=None):
+    """
+    One row of versions per order in ``queryset``. The aggregate runs over
+    ``pk IN (queryset)`` so that a sliced page is limited before grouping.
+    Products and categories that ``fieldset`` (see fieldsets.py) does not
+    expand are left out, and so are their joins.
+    """
+    products = fieldset is None or fieldsets.is_expanded(fieldset, 'products')
+    categories = products and (fieldset is None or fieldsets.is_expanded(fieldset['products'], 'category'))
+    annotations = {}
+    if products:
+        annotations.update(products_version=Sum('products__version'),
+                           products_updated_at=Max('products__updated_at'))
+    if categories:
+        annotations.update(categories_version=Sum('products__category__version'),
+                           categories_updated_at=Max('products__category__updated_at'))
+    return Order.objects.filter(pk__in=queryset.values('pk')).values('id', 'version', 'updated_at').annotate(
+        **annotations)
+
+
+def validators(request, rows):
+    """Return ``(etag, last_modified)`` for ``rows`` from fingerprints()."""
+    digest = hashlib.sha1(request.accepted_media_type.encode())
+    # Sparse payloads of the same rows are other representations, with ETags of their own.
+    digest.update(fieldsets.variant(request.query_params).encode())
+    last_modified = None
+    for row in sorted(rows, key=lambda row: row['id']):
+        digest.update(f"{row['id']}:{row['version']}:{row.get('products_version')}:"
+                      f"{row.get('categories_version')};".encode())
+        stamps = [row['updated_at'], row.get('products_updated_at'), row.get('categories_updated_at')]
+        newest = max(stamp for stamp in stamps if stamp is not None)
+        last_modified = newest if last_modified is None else max(last_modified, newest)
+    return quote_etag(digest.hexdigest()), last_modified
+
+
+def conditional_response(request, queryset, respond, fieldset=None):
+    """
+    Answer ``If-None-Match``/``If-Modified-Since`` for the orders in
+    ``queryset``, calling ``respond()`` only when the client's copy is stale.
+    """
+    rows = list(fingerprints(queryset, fieldset))
+    if not rows:
+        return respond()
+
+    etag, timestamp, response = _check(request, rows)
+    return _stamp(response or respond(), etag, timestamp)
+
+
+async def aconditional_response(request, queryset, respond, fieldset=None):
+    """conditional_response() for async views; ``respond`` is a coroutine function."""
+    rows = [row async for row in fingerprints(queryset, fieldset)]
+    if not rows:
+        return await respond()
+
+    etag, timestamp, response = _check(request, rows)
+    return _stamp(response or await respond(), etag, timestamp)
+
+
+def _check(request, rows):
+    etag, last_modified = validators(request, rows)
+    timestamp = int(last_modified.timestamp())
+    return etag, timestamp, get_conditional_response(request, etag=etag, last_modified=timestamp)
+
+
+def _stamp(response, etag, timestamp):
+    if response.status_code in [200, 304]:
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(timestamp)
+    return response
@@ -0,0 +1,343 @@
+"""
+Set-based maintenance of Order.total_amount (the sum of quantity * unit_price
+over its lines), Product.sold_items_count (the quantity ordered in total)
+and the DailySales rollups.
+
+Views write order lines through the functions below, which apply every
+change as a handful of aggregate UPDATE statements. Line changes are
+described by sales deltas, {(order_date, product_id): (quantity, revenue)},
+from which both the sold counters and the rollups are updated. The receivers in
+signals.py cover writes that bypass this module (admin, shell,
+``order.products.add()``) and stay silent while a managed write is running,
+so a change is never counted twice.
+"""
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+from contextvars import ContextVar
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Now
+
+from . import rollups
+from .caching import order_cache
+from .models import Order, OrderItem, Product, SoldItemsDelta
+
+_managed = ContextVar('shop_counters_managed', default=False)
+_money = DecimalField(max_digits=14, decimal_places=2)
+
+
+class OrderTooLarge(ValueError):
+    """A write would leave a line over ORDERS_MAX_QUANTITY or a total that Order.total_amount cannot hold."""
+
+
+def _too_large(total, quantities):
+    """The OrderTooLarge error for an order with ``total`` and line ``quantities``, if any."""
+    field = Order._meta.get_field('total_amount')
+    max_total = Decimal(10) ** (field.max_digits - field.decimal_places) - Decimal(10) ** -field.decimal_places
+    max_quantity = getattr(settings, 'ORDERS_MAX_QUANTITY', 10000)
+    if any(quantity > max_quantity for quantity in quantities):
+        return OrderTooLarge(f"A product can be ordered at most {max_quantity} times.")
+    if total > max_total:
+        return OrderTooLarge(f"The order total would exceed {max_total}.")
+    return None
+
+
+@contextmanager
+def managed_write():
+    """Mark the enclosed writes as already accounted for by this module."""
+    token = _managed.set(True)
+    try:
+        yield
+    finally:
+        _managed.reset(token)
+
+
+def is_managed():
+    return _managed.get()
+
+
+def is_deferred():
+    return getattr(settings, 'SOLD_ITEMS_DEFERRED', False)
+
+
+def apply_sales_deltas(deltas):
+    """
+    Add sales ``deltas`` to Product.sold_items_count and the rollups, or,
+    with SOLD_ITEMS_DEFERRED, append them to the SoldItemsDelta outbox in a
+    single INSERT for outbox.flush() to merge in later.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if any(delta)}
+    if is_deferred():
+        SoldItemsDelta.objects.bulk_create([
+            SoldItemsDelta(order_date=order_date, product_id=product_id, delta=quantity, revenue=revenue)
+            for (order_date, product_id), (quantity, revenue) in deltas.items()])
+        return
+
+    sold = Counter()
+    for (_, product_id), (quantity, _) in deltas.items():
+        sold[product_id] += quantity
+    update_sold_items(sold)
+    rollups.update(deltas)
+
+
+def update_sold_items(deltas, batch_size=500):
+    """
+    Write ``deltas`` to the product rows now, with one UPDATE per
+    ``batch_size`` products however many orders the deltas add up. Rows are
+    locked in primary key order, so concurrent writers cannot deadlock.
+    """
+    product_ids = sorted(pk for pk, delta in deltas.items() if delta)
+    for start in range(0, len(product_ids), batch_size):
+        batch = product_ids[start:start + batch_size]
+        if len({deltas[pk] for pk in batch}) == 1:
+            delta = Value(deltas[batch[0]])
+        else:
+            delta = Case(*[When(pk=pk, then=Value(deltas[pk])) for pk in batch], default=Value(0),
+                         output_field=IntegerField())
+        Product.objects.filter(pk__in=batch).update(
+            sold_items_count=F('sold_items_count') + delta, version=F('version') + 1, updated_at=Now())
+
+
+def refresh_order_totals(order_ids):
+    """Recompute total_amount as the sum of quantity * unit_price for ``order_ids`` with a single UPDATE."""
+    amounts = (OrderItem.objects.filter(order_id=OuterRef('pk')).order_by().values('order_id')
+               .annotate(amount=Sum(F('quantity') * F('unit_price'))).values('amount'))
+    Order.objects.filter(pk__in=order_ids).update(
+        total_amount=Coalesce(Subquery(amounts, output_field=DecimalField(max_digits=10, decimal_places=2)),
+                              Value(Decimal('0'))),
+        version=F('version') + 1, updated_at=Now())
+
+
+def fill_unit_prices(order_ids):
+    """Snapshot the current product price into lines of ``order_ids`` written without one."""
+    prices = Product.objects.filter(pk=OuterRef('product_id')).values('price')[:1]
+    OrderItem.objects.filter(order_id__in=order_ids, unit_price__isnull=True).update(unit_price=Subquery(prices))
+
+
+def sync_counters(order_ids, deltas):
+    apply_sales_deltas(deltas)
+    refresh_order_totals(order_ids)
+    order_cache.touch(orders=order_ids, products={pk for (_, pk), delta in deltas.items() if any(delta)})
+
+
+def sales_deltas(lines, sign=1):
+    """Sales deltas adding (``sign=1``) or removing (``sign=-1``) the OrderItem queryset ``lines``."""
+    rows = (lines.order_by().values('order__order_date', 'product_id')
+            .annotate(sold=Sum('quantity'), amount=Sum(F('quantity') * F('unit_price'), output_field=_money))
+            .values_list('order__order_date', 'product_id', 'sold', 'amount'))
+    return {(order_date, pk): (sign * quantity, sign * (revenue or 0)) for order_date, pk, quantity, revenue in rows}
+
+
+def order_sales(order_ids):
+    return sales_deltas(OrderItem.objects.filter(order_id__in=order_ids))
+
+
+def resync_orders(order_ids, before):
+    """
+    Bring the counters up to date after the lines of ``order_ids`` were
+    written directly; ``before`` is their order_sales() from beforehand.
+    """
+    fill_unit_prices(order_ids)
+    after = order_sales(order_ids)
+    zero = (0, 0)
+    sync_counters(order_ids, {key: (after.get(key, zero)[0] - before.get(key, zero)[0],
+                                    after.get(key, zero)[1] - before.get(key, zero)[1])
+                              for key in before.keys() | after.keys()})
+
+
+def _prices(product_ids):
+    """{product_id: current price}; a product deleted since it was resolved is an error."""
+    prices = dict(Product.objects.filter(pk__in=product_ids).values_list('pk', 'price'))
+    missing = set(product_ids) - prices.keys()
+    if missing:
+        raise Product.DoesNotExist(f"Products with ids {missing} do not exist.")
+    return prices
+
+
+def price_orders(orders, quantities, prices=None):
+    """
+    Set the total_amount of unsaved ``orders`` from ``quantities[i]``
+    ({product_id: quantity}) and the current prices, or the given
+    ``prices``. Returns the prices and, per order, its OrderTooLarge error
+    or None, so a batch can report its oversized orders one by one.
+    """
+    if prices is None:
+        prices = _prices({pk for wanted in quantities for pk in wanted})
+    errors = []
+    for order, wanted in zip(orders, quantities):
+        order.total_amount = sum((prices[pk] * quantity for pk, quantity in wanted.items()), Decimal('0'))
+        errors.append(_too_large(order.total_amount, wanted.values()))
+    return prices, errors
+
+
+def create_orders(orders, quantities, prices=None):
+    """
+    Insert unsaved ``orders`` with ``quantities[i]`` ({product_id: quantity})
+    as the lines of ``orders[i]``, in a fixed number of statements whatever
+    the batch size. Totals are computed from the prices read here, or the
+    ``prices`` price_orders() returned, which are also the prices the lines
+    keep. Raises Product.DoesNotExist or OrderTooLarge before anything is
+    written.
+    """
+    # Checked before the transaction: an exception leaving a block without a
+    # savepoint would doom the caller's transaction (the Idempotency-Key claim).
+    prices, errors = price_orders(orders, quantities, prices)
+    for error in errors:
+        if error:
+            raise error
+    return _insert_orders(orders, quantities, prices)
+
+
+@transaction.atomic(savepoint=False)
+def _insert_orders(orders, quantities, prices):
+    orders = Order.objects.bulk_create(orders)
+    OrderItem.objects.bulk_create([
+        OrderItem(order_id=order.pk, product_id=pk, quantity=quantity, unit_price=prices[pk])
+        for order, wanted in zip(orders, quantities) for pk, quantity in wanted.items()])
+
+    deltas = defaultdict(lambda: (0, 0))
+    for order, wanted in zip(orders, quantities):
+        for pk, quantity in wanted.items():
+            sold, revenue = deltas[order.order_date, pk]
+            deltas[order.order_date, pk] = (sold + quantity, revenue + quantity * prices[pk])
+    apply_sales_deltas(deltas)
+    order_cache.touch(orders=[order.pk for order in orders], products={pk for _, pk in deltas})
+    return orders
+
+
+def set_order_products(order, quantities):
+    """Make ``quantities`` ({product_id: quantity}) the lines of ``order``, writing only the lines that change."""
+    with transaction.atomic(savepoint=False):
+        total = _lock_order(order)
+        current = _lines(order)
+        wanted = dict.fromkeys(current, 0)
+        wanted.update(quantities)
+        error = _apply_line_changes(order, current, wanted, total)
+    if error:
+        raise error
+
+
+def change_order_products(order, add=None, remove=None):
+    """
+    Raise the quantities in ``add`` and lower those in ``remove`` (both
+    {product_id: quantity}) for ``order``. A line whose quantity drops to
+    zero is deleted; removing more than was ordered is not an error.
+    """
+    with transaction.atomic(savepoint=False):
+        total = _lock_order(order)
+        add, remove = add or {}, remove or {}
+        current = _lines(order, add.keys() | remove.keys())
+        wanted = {pk: max(current.get(pk, (0, None))[0] + add.get(pk, 0) - remove.get(pk, 0), 0)
+                  for pk in add.keys() | remove.keys()}
+        error = _apply_line_changes(order, current, wanted, total)
+    if error:
+        raise error
+
+
+def _lock_order(order):
+    # Serializes concurrent line changes of one order, so each diff is taken
+    # against the lines the previous writer left behind.
+    # Returns the total the diff is applied to.
+    return Order.objects.select_for_update().filter(pk=order.pk).values_list('total_amount', flat=True).first() or 0
+
+
+def _lines(order, product_ids=None):
+    """{product_id: (quantity, unit_price)} of the lines of ``order``."""
+    lines = OrderItem.objects.filter(order_id=order.pk)
+    if product_ids is not None:
+        lines = lines.filter(product_id__in=product_ids)
+    return {pk: (quantity, price) for pk, quantity, price in lines.values_list('product_id', 'quantity', 'unit_price')}
+
+
+def _apply_line_changes(order, current, wanted, total):
+    """
+    Write the difference between ``current`` (from _lines()) and ``wanted``
+    ({product_id: quantity}) for ``order``, whose total is now ``total``.
+    Returns the OrderTooLarge error instead, without writing, if the change
+    makes the order too large; raised inside the transaction it would doom
+    the caller's transaction too.
+    """
+    current_quantities = {pk: quantity for pk, (quantity, _) in current.items()}
+    changes = {pk: quantity - current_quantities.get(pk, 0) for pk, quantity in wanted.items()
+               if quantity != current_quantities.get(pk, 0)}
+    if not changes:
+        return None
+
+    removed = [pk for pk in changes if not wanted[pk]]
+    added = [pk for pk in changes if not current_quantities.get(pk)]
+    changed = defaultdict(list)
+    for pk in changes:
+        if wanted[pk] and current_quantities.get(pk):
+            changed[wanted[pk]].append(pk)
+
+    # Existing lines keep the price they were ordered at.
+    prices = {pk: price or 0 for pk, (_, price) in current.items()}
+    if added:
+        prices.update(_prices(added))
+    total += sum(change * prices[pk] for pk, change in changes.items())
+    error = _too_large(total, [wanted[pk] for pk in changes])
+    if error:
+        return error
+
+    if removed:
+        OrderItem.objects.filter(order_id=order.pk, product_id__in=removed).delete()
+    if added:
+        OrderItem.objects.bulk_create([OrderItem(order_id=order.pk, product_id=pk, quantity=wanted[pk],
+                                                 unit_price=prices[pk]) for pk in added])
+    for quantity, product_ids in changed.items():
+        OrderItem.objects.filter(order_id=order.pk, product_id__in=product_ids).update(quantity=quantity)
+
+    sync_counters([order.pk], {(order.order_date, pk): (change, change * prices[pk]) for pk, change in changes.items()})
+    order.refresh_from_db(fields=['total_amount', 'version', 'updated_at'])
+    return None
+
+
+def release_order_products(order_ids):
+    """Take the lines of ``order_ids`` back out of Product.sold_items_count and the rollups."""
+    deltas = sales_deltas(OrderItem.objects.filter(order_id__in=order_ids), sign=-1)
+    apply_sales_deltas(deltas)
+    order_cache.touch(orders=order_ids, products={pk for _, pk in deltas})
+
+
+@transaction.atomic(savepoint=False)
+def delete_orders(order_ids):
+    with managed_write():
+        release_order_products(order_ids)
+        Order.objects.filter(pk__in=order_ids).delete()
+
+
+def purge_orders(ids=None, date_from=None, date_to=None, chunk_size=1000):
+    """
+    Delete the orders in ``ids`` or with ``date_from <= order_date <=
+    date_to``, ``chunk_size`` at a time, and return how many were deleted.
+    Each chunk is a transaction of its own: one aggregate query over its
+    lines gives the sales to take back, which go out in a few set-based
+    UPDATEs, then its lines and orders are deleted with one statement each.
+    Row locks are held for one chunk only; an interrupted purge leaves the
+    chunks before it fully deleted.
+    """
+    orders = Order.objects.all()
+    if ids is not None:
+        orders = orders.filter(pk__in=ids)
+    if date_from is not None:
+        orders = orders.filter(order_date__gte=date_from)
+    if date_to is not None:
+        orders = orders.filter(order_date__lte=date_to)
+
+    deleted = 0
+    while True:
+        with transaction.atomic(), managed_write():
+            order_ids = list(orders.select_for_update().order_by('order_date', 'pk')
+                             .values_list('pk', flat=True)[:chunk_size])
+            if not order_ids:
+                return deleted
+            release_order_products(order_ids)
+            # _raw_delete() skips the collector, which would load every order
+            # to send the per-instance delete signals this function replaces.
+            lines = OrderItem.objects.filter(order_id__in=order_ids)
+            lines._raw_delete(lines.db)
+            chunk = Order.objects.filter(pk__in=order_ids)
+            deleted += chunk._raw_delete(chunk.db)
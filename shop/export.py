@@ -0,0 +1,83 @@
+"""
+Streaming export of orders for reporting.
+
+Orders are read in ``order_date, id`` order through a server-side cursor
+(``iterator()``) and their lines are prefetched one chunk at a time, so
+memory stays flat however many orders the date range holds. Archived
+orders (see archive.py) are read the same way and merged in.
+"""
+import csv
+import heapq
+import json
+
+from django.db.models import Prefetch
+
+from . import renderers
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+
+EXPORT_FORMATS = ['ndjson', 'csv']
+CSV_HEADER = ['id', 'customer_name', 'order_date', 'total_amount', 'products', 'categories', 'quantities']
+
+
+def export_rows(date_from=None, date_to=None, chunk_size=2000):
+    """Yield one dict per order, hot or archived, with ``date_from <= order_date <= date_to``."""
+    return heapq.merge(_rows(Order, OrderItem, date_from, date_to, chunk_size),
+                       _rows(ArchivedOrder, ArchivedOrderItem, date_from, date_to, chunk_size),
+                       key=lambda row: (row['order_date'], row['id']))
+
+
+def _rows(model, line_model, date_from, date_to, chunk_size):
+    orders = model.objects.only('id', 'customer_name', 'order_date', 'total_amount').order_by('order_date', 'id')
+    if date_from is not None:
+        orders = orders.filter(order_date__gte=date_from)
+    if date_to is not None:
+        orders = orders.filter(order_date__lte=date_to)
+
+    items = (line_model.objects.select_related('product__category').order_by('id')
+             .only('order_id', 'quantity', 'unit_price', 'product__name', 'product__category__name'))
+    orders = orders.prefetch_related(Prefetch('items', queryset=items))
+
+    for order in orders.iterator(chunk_size=chunk_size):
+        yield {
+            'id': order.id,
+            'customer_name': order.customer_name,
+            'order_date': order.order_date.isoformat(),
+            'total_amount': str(order.total_amount),
+            'products': [{'name': item.product.name, 'category': {'name': item.product.category.name},
+                          'quantity': item.quantity,
+                          'unit_price': None if item.unit_price is None else str(item.unit_price)}
+                         for item in order.items.all()],
+        }
+
+
+def ndjson_lines(rows):
+    if renderers.engine is not None:
+        for row in rows:
+            yield renderers.dumps(row).decode() + '\n'
+    else:
+        for row in rows:
+            yield json.dumps(row, ensure_ascii=False) + '\n'
+
+
+class _Line:
+    """File-like sink that hands each csv row back instead of buffering it."""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(rows):
+    writer = csv.writer(_Line())
+    yield writer.writerow(CSV_HEADER)
+    for row in rows:
+        yield writer.writerow([
+            row['id'], row['customer_name'], row['order_date'], row['total_amount'],
+            '; '.join(product['name'] for product in row['products']),
+            '; '.join(product['category']['name'] for product in row['products']),
+            '; '.join(str(product['quantity']) for product in row['products']),
+        ])
+
+
+def export_lines(export_format, date_from=None, date_to=None, chunk_size=2000):
+    rows = export_rows(date_from, date_to, chunk_size)
+    return csv_lines(rows) if export_format == 'csv' else ndjson_lines(rows)
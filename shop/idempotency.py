@@ -0,0 +1,99 @@
+"""
+``Idempotency-Key`` support for POST endpoints.
+
+The key is claimed by inserting its IdempotencyKey row in the same
+transaction as the write it guards, and the response is stored in that row
+before commit. A retry therefore finds either nothing (the first attempt
+failed and was rolled back) or the complete response, which is replayed
+with one indexed lookup. Keys are scoped to the client that sent them
+(see ``client()``), so two clients picking the same key never see each
+other's responses. Two attempts racing with the same key are serialized
+by the unique constraint on ``(client, key)``: the loser's INSERT fails
+once the winner commits, and it replays the winner's response.
+"""
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.throttling import BaseThrottle
+
+from .models import IdempotencyKey
+
+HEADER = 'Idempotency-Key'
+
+
+def fingerprint(request):
+    body = json.dumps(request.data, sort_keys=True, cls=DjangoJSONEncoder)
+    return hashlib.sha256(f'{request.method} {request.path}\n{body}'.encode()).hexdigest()
+
+
+def client(request):
+    """
+    Digest of who sent ``request``: the authenticated user, else the address
+    DRF throttles anonymous clients by.
+    """
+    if request.user.is_authenticated:
+        identity = f'user:{request.user.pk}'
+    else:
+        identity = f'anon:{BaseThrottle().get_ident(request)}'
+    return hashlib.sha256(identity.encode()).hexdigest()
+
+
+def expired_before():
+    return timezone.now() - timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 86400))
+
+
+def _lookup(sender, key):
+    return IdempotencyKey.objects.filter(client=sender, key=key).first()
+
+
+def _replay(record, digest):
+    if record.request_hash != digest:
+        return Response({"error": f"{HEADER} was already used with a different request."},
+                        status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+    response = Response(record.response, status=record.status_code)
+    response['Idempotent-Replayed'] = 'true'
+    return response
+
+
+def idempotent(request, handle):
+    """
+    Return ``handle()`` for ``request``, or the stored response of an earlier
+    request with the same ``Idempotency-Key``. Only successful responses are
+    stored; anything else is rolled back, so the client may retry the key.
+    """
+    key = request.headers.get(HEADER)
+    if key is None:
+        return handle()
+    if not key or len(key) > IdempotencyKey._meta.get_field('key').max_length:
+        return Response({"error": f"{HEADER} should be 1 to 255 characters long."},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    sender, digest = client(request), fingerprint(request)
+    record = _lookup(sender, key)
+    if record is not None:
+        if record.created_at >= expired_before():
+            return _replay(record, digest)
+        IdempotencyKey.objects.filter(pk=record.pk).delete()
+
+    try:
+        with transaction.atomic():
+            record = IdempotencyKey.objects.create(client=sender, key=key, request_hash=digest)
+            response = handle()
+            if status.is_success(response.status_code):
+                record.status_code, record.response = response.status_code, response.data
+                record.save(update_fields=['status_code', 'response'])
+            else:
+                transaction.set_rollback(True)
+    except IntegrityError:
+        record = _lookup(sender, key)
+        if record is None:
+            raise
+        return _replay(record, digest)
+    return response
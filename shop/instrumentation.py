@@ -0,0 +1,230 @@
+"""
+Per-request SQL and timing instrumentation.
+
+RequestMetricsMiddleware counts the queries of every request and times them
+through an execute wrapper installed on every connection (see signals.py),
+times the serialization (the views building their payloads inside
+serializing(), less the queries that runs) and the rendering of the
+response, and records the numbers per resolved URL name and method. The
+metrics travel in a context variable, so the queries async views run in
+worker threads are counted too. The numbers are aggregated per worker for
+/api/v1/metrics/, go back in a Server-Timing header to staff users (to
+everyone with DEBUG), and are checked against QUERY_BUDGETS, so an N+1
+shows up as a warning in the log (an error with QUERY_BUDGET_RAISE, as in
+tests) rather than as a slow endpoint. The cost is a function call per query and
+a few clock reads per request. Queries run while a streaming body is
+consumed happen after the middleware returns and are not counted.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.utils.functional import SimpleLazyObject, empty
+
+logger = logging.getLogger(__name__)
+
+_current = ContextVar('request_metrics', default=None)
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class RequestMetrics:
+    """Counts and times the queries of one request."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self.render_seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.db_seconds += time.perf_counter() - started
+
+
+class EndpointStats:
+    """Totals per (URL name, method) of the requests served by this worker."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._endpoints = {}
+
+    def record(self, name, method, metrics, total_seconds, over_budget):
+        with self._lock:
+            entry = self._endpoints.setdefault((name, method), {
+                'requests': 0, 'queries': 0, 'max_queries': 0, 'db_seconds': 0.0, 'serialize_seconds': 0.0,
+                'render_seconds': 0.0, 'total_seconds': 0.0, 'max_seconds': 0.0, 'over_budget': 0})
+            entry['requests'] += 1
+            entry['queries'] += metrics.queries
+            entry['max_queries'] = max(entry['max_queries'], metrics.queries)
+            entry['db_seconds'] += metrics.db_seconds
+            entry['serialize_seconds'] += metrics.serialize_seconds
+            entry['render_seconds'] += metrics.render_seconds
+            entry['total_seconds'] += total_seconds
+            entry['max_seconds'] = max(entry['max_seconds'], total_seconds)
+            entry['over_budget'] += over_budget
+
+    def stats(self):
+        with self._lock:
+            endpoints = {key: dict(entry) for key, entry in self._endpoints.items()}
+
+        result = {}
+        for (name, method), entry in sorted(endpoints.items()):
+            requests = entry['requests']
+            result.setdefault(name, {})[method] = {
+                'requests': requests,
+                'avg_queries': round(entry['queries'] / requests, 2),
+                'max_queries': entry['max_queries'],
+                'budget': query_budget(name, method),
+                'over_budget': entry['over_budget'],
+                'avg_db_ms': round(entry['db_seconds'] / requests * 1000, 3),
+                'avg_serialize_ms': round(entry['serialize_seconds'] / requests * 1000, 3),
+                'avg_render_ms': round(entry['render_seconds'] / requests * 1000, 3),
+                'avg_total_ms': round(entry['total_seconds'] / requests * 1000, 3),
+                'max_total_ms': round(entry['max_seconds'] * 1000, 3),
+            }
+        return result
+
+    def reset(self):
+        with self._lock:
+            self._endpoints.clear()
+
+
+endpoint_stats = EndpointStats()
+
+
+def record_query(execute, sql, params, many, context):
+    """Execute wrapper that reports to the metrics of the current request, if any."""
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+def instrument(connection):
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+@contextmanager
+def serializing():
+    """Count the enclosed payload building, less its queries, as serialization time of the current request."""
+    metrics = _current.get()
+    if metrics is None:
+        yield
+        return
+    started, db_seconds = time.perf_counter(), metrics.db_seconds
+    try:
+        yield
+    finally:
+        metrics.serialize_seconds += time.perf_counter() - started - (metrics.db_seconds - db_seconds)
+
+
+def query_budget(name, method):
+    """The QUERY_BUDGETS entry for ``'name:METHOD'``, else for ``'name'``, else None."""
+    budgets = getattr(settings, 'QUERY_BUDGETS', {})
+    return budgets.get(f'{name}:{method}', budgets.get(name))
+
+
+def server_timing(metrics, total_seconds):
+    return (f'db;dur={metrics.db_seconds * 1000:.3f};desc="{metrics.queries} queries", '
+            f'serialize;dur={metrics.serialize_seconds * 1000:.3f}, render;dur={metrics.render_seconds * 1000:.3f}, '
+            f'total;dur={total_seconds * 1000:.3f}')
+
+
+def shows_server_timing(request):
+    """
+    Whether ``request`` gets the Server-Timing header: with DEBUG, or for a
+    staff user the view authenticated. A user the view never looked at is
+    not loaded here, as that could query the database from the event loop.
+    """
+    if not getattr(settings, 'REQUEST_METRICS_SERVER_TIMING', True):
+        return False
+    if settings.DEBUG:
+        return True
+    user = getattr(request, 'user', None)
+    if user is None or (isinstance(user, SimpleLazyObject) and user._wrapped is empty):
+        return False
+    return user.is_staff
+
+
+class RequestMetricsMiddleware:
+    """Measure every request; should come first in MIDDLEWARE so that the others are measured too."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        if not getattr(settings, 'REQUEST_METRICS_ENABLED', True):
+            return self.get_response(request)
+
+        started = time.perf_counter()
+        metrics = request._request_metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, started)
+
+    async def __acall__(self, request):
+        if not getattr(settings, 'REQUEST_METRICS_ENABLED', True):
+            return await self.get_response(request)
+
+        started = time.perf_counter()
+        metrics = request._request_metrics = RequestMetrics()
+        token = _current.set(metrics)
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        return self.finish(request, response, started)
+
+    def finish(self, request, response, started):
+        metrics = request._request_metrics
+        total_seconds = time.perf_counter() - started
+
+        if shows_server_timing(request):
+            response['Server-Timing'] = server_timing(metrics, total_seconds)
+
+        match = request.resolver_match
+        if match is None or not match.url_name:
+            return response
+
+        budget = query_budget(match.url_name, request.method)
+        over_budget = budget is not None and metrics.queries > budget
+        endpoint_stats.record(match.url_name, request.method, metrics, total_seconds, over_budget)
+        if over_budget:
+            message = (f'{request.method} {match.url_name} ran {metrics.queries} queries, '
+                       f'over its budget of {budget}.')
+            if getattr(settings, 'QUERY_BUDGET_RAISE', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+        return response
+
+    def process_template_response(self, request, response):
+        metrics = getattr(request, '_request_metrics', None)
+        if metrics is not None:
+            started = time.perf_counter()
+
+            def rendered(response):
+                metrics.render_seconds += time.perf_counter() - started
+
+            response.add_post_render_callback(rendered)
+        return response
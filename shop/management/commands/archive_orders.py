@@ -0,0 +1,25 @@
+from datetime import date, timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from shop.archive import archive_orders
+
+
+class Command(BaseCommand):
+    help = ('Move orders placed before --before, or more than --older-than days ago, with their lines to the '
+            'archive tables, one batch per transaction. Archived orders stay readable by id and counted in the '
+            'sold counters and rollups.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', type=date.fromisoformat,
+                            help='Archive orders with an earlier order_date (YYYY-MM-DD).')
+        parser.add_argument('--older-than', type=int, default=getattr(settings, 'ORDERS_ARCHIVE_AFTER_DAYS', 365),
+                            help='Archive orders placed more than this many days ago, unless --before is given.')
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'ORDERS_ARCHIVE_BATCH_SIZE', 1000))
+
+    def handle(self, *args, **options):
+        before = options['before'] or timezone.localdate() - timedelta(days=options['older_than'])
+        archived = archive_orders(before, batch_size=options['batch_size'])
+        self.stderr.write(f'Archived {archived} orders placed before {before.isoformat()}.')
@@ -0,0 +1,156 @@
+import json
+import platform
+from datetime import datetime, timezone
+
+import django
+from django.conf import settings
+from django.core.management import call_command
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from shop import benchmark
+from shop.caching import order_cache
+from shop.counters import is_deferred
+from shop.urls import api_urlconf
+
+
+class Command(BaseCommand):
+    help = ('Benchmark the orders API on generated datasets of each --sizes: p50/p95 latency, throughput, SQL '
+            'queries, peak memory and order cache hit ratio per scenario. Runs on a throwaway test database unless '
+            '--in-place is given; with --compare, fails when a scenario regresses against an earlier --output. With '
+            '--asgi, compares the sync and async order views under --concurrency slow clients instead.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000], help='Orders in the dataset.')
+        parser.add_argument('--scenarios', nargs='+', choices=list(benchmark.SCENARIOS),
+                            default=list(benchmark.SCENARIOS))
+        parser.add_argument('--iterations', type=int, default=100, help='Timed requests per scenario.')
+        parser.add_argument('--warmup', type=int, default=10, help='Untimed requests before the timed ones.')
+        parser.add_argument('--samples', type=int, default=10,
+                            help='Extra requests per scenario that count queries and memory.')
+        parser.add_argument('--products', type=int, default=200)
+        parser.add_argument('--bulk-size', type=int, default=50, help='Orders per bulk_create request.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--cache', action='store_true',
+                            help='Keep the order response cache on; by default every read hits the database.')
+        parser.add_argument('--output', help='Write the results as JSON to this file.')
+        parser.add_argument('--compare', help='JSON results of an earlier run to check for regressions.')
+        parser.add_argument('--threshold', type=float, default=0.2,
+                            help='Allowed relative growth of p95 latency and peak memory over --compare.')
+        parser.add_argument('--in-place', action='store_true',
+                            help='Run against the configured database, replacing all of its shop data.')
+        parser.add_argument('--asgi', action='store_true',
+                            help='Send --iterations requests per scenario through the ASGI handler, once to the '
+                                 'sync and once to the async order views.')
+        parser.add_argument('--concurrency', type=int, default=50, help='Concurrent clients with --asgi.')
+        parser.add_argument('--client-delay', type=float, default=0.05,
+                            help='Seconds each --asgi client takes to upload its request and to start reading.')
+
+    def handle(self, *args, **options):
+        baseline = None
+        if options['compare']:
+            with open(options['compare'], encoding='utf-8') as source:
+                baseline = json.load(source)
+
+        if options['in_place']:
+            report = self.run(options)
+        else:
+            old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+            try:
+                report = self.run(options)
+            finally:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as output:
+                json.dump(report, output, indent=2)
+
+        if baseline is not None:
+            regressions = benchmark.compare(baseline, report, options['threshold'])
+            if regressions:
+                raise CommandError(f'{len(regressions)} regression(s) against {options["compare"]}:\n'
+                                   + '\n'.join(regressions))
+            self.stderr.write(f'No regressions against {options["compare"]}.')
+
+    def run(self, options):
+        report = {
+            'created_at': datetime.now(timezone.utc).isoformat(),
+            'environment': {
+                'database': connection.vendor,
+                'python': platform.python_version(),
+                'django': django.get_version(),
+                'cache': options['cache'],
+                'fast_reads': getattr(settings, 'ORDERS_FAST_READS', False),
+                'sold_items_deferred': is_deferred(),
+                'asgi': options['asgi'],
+            },
+            'results': {},
+        }
+        if options['asgi']:
+            skipped = sorted(set(options['scenarios']) & set(benchmark.ASGI_SCENARIOS) - set(self.asgi_scenarios()))
+            if skipped:
+                self.stderr.write(f'Skipping {", ".join(skipped)} with --asgi: {connection.vendor} cannot run '
+                                  f'concurrent writes.')
+            self.stdout.write(f'{"size":>8}  {"scenario":<18}{"p50 ms":>9}{"p95 ms":>9}{"req/s":>9}{"threads":>9}'
+                              f'{"hit %":>8}')
+        else:
+            self.stdout.write(f'{"size":>8}  {"scenario":<18}{"p50 ms":>9}{"p95 ms":>9}{"req/s":>9}'
+                              f'{"queries":>9}{"peak KiB":>10}{"hit %":>8}')
+
+        enabled = order_cache.enabled
+        order_cache.enabled = options['cache']
+        try:
+            with override_settings(DEBUG=False):
+                for size in options['sizes']:
+                    report['results'][str(size)] = self.run_size(size, options)
+        finally:
+            order_cache.enabled = enabled
+        return report
+
+    def run_size(self, size, options):
+        call_command('generate_data', clear=True, orders=size, products=options['products'], seed=options['seed'],
+                     stderr=self.stderr)
+        work = benchmark.Workload(seed=options['seed'], bulk_size=options['bulk_size'])
+        if 'delete' in options['scenarios']:
+            try:
+                work.reserve(options['warmup'] + options['iterations'] + options['samples'])
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        results = {}
+        for name in benchmark.SCENARIOS:
+            if name not in options['scenarios']:
+                continue
+            try:
+                if options['asgi']:
+                    if name in self.asgi_scenarios():
+                        for flavor in ['sync', 'async']:
+                            results[f'{name}:{flavor}'] = self.run_asgi(name, work, flavor == 'async', options)
+                else:
+                    results[name] = benchmark.run(name, work, options['iterations'], options['warmup'],
+                                                  options['samples'])
+            except RuntimeError as e:
+                raise CommandError(str(e))
+
+        for name, result in results.items():
+            line = (f'{size:>8}  {name:<18}{result["p50_ms"]:>9.2f}{result["p95_ms"]:>9.2f}'
+                    f'{result["throughput_rps"]:>9.1f}')
+            if options['asgi']:
+                line += f'{result["peak_threads"]:>9}'
+            else:
+                line += f'{result["queries"]:>9}{result["peak_memory_kib"]:>10.1f}'
+            hit_ratio = '-' if result['cache_hit_ratio'] is None else f'{result["cache_hit_ratio"]:.0%}'
+            self.stdout.write(f'{line}{hit_ratio:>8}')
+        return results
+
+    def asgi_scenarios(self):
+        if connection.vendor == 'sqlite':
+            # SQLite locks whole tables, so concurrent writes fail with "database table is locked".
+            return [name for name in benchmark.ASGI_SCENARIOS if name in benchmark.READ_SCENARIOS]
+        return benchmark.ASGI_SCENARIOS
+
+    def run_asgi(self, name, work, asynchronous, options):
+        with override_settings(ROOT_URLCONF=api_urlconf(asynchronous)):
+            return benchmark.run_asgi(name, work, options['iterations'], options['concurrency'],
+                                      options['client_delay'])
@@ -0,0 +1,38 @@
+from datetime import date
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from shop.export import EXPORT_FORMATS, export_lines
+
+
+class Command(BaseCommand):
+    help = 'Stream orders of an order_date range to a file or stdout as NDJSON or CSV.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', type=date.fromisoformat,
+                            help='First order_date to export (YYYY-MM-DD).')
+        parser.add_argument('--to', dest='date_to', type=date.fromisoformat,
+                            help='Last order_date to export (YYYY-MM-DD).')
+        parser.add_argument('--format', dest='export_format', choices=EXPORT_FORMATS, default='ndjson')
+        parser.add_argument('--output', help='File to write to; stdout by default.')
+        parser.add_argument('--chunk-size', type=int, default=getattr(settings, 'ORDERS_EXPORT_CHUNK_SIZE', 2000))
+
+    def handle(self, *args, **options):
+        lines = export_lines(options['export_format'], options['date_from'], options['date_to'],
+                             chunk_size=options['chunk_size'])
+
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8', newline='') as output:
+                count = self._write(lines, output.write)
+        else:
+            count = self._write(lines, lambda line: self.stdout.write(line, ending=''))
+
+        self.stderr.write(f'Exported {count} lines.')
+
+    def _write(self, lines, write):
+        count = 0
+        for line in lines:
+            write(line)
+            count += 1
+        return count
@@ -0,0 +1,28 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from shop import outbox
+
+
+class Command(BaseCommand):
+    help = 'Merge pending sold_items_count deltas into the products, once or every --interval seconds.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, default=getattr(settings, 'SOLD_ITEMS_MAX_STALENESS', 5),
+                            help='Seconds between flushes; bounds how stale the counters get.')
+        parser.add_argument('--once', action='store_true', help='Flush what is pending and exit.')
+        parser.add_argument('--batch-size', type=int, default=getattr(settings, 'SOLD_ITEMS_FLUSH_BATCH', 5000))
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            started = time.monotonic()
+            flushed = outbox.flush(options['batch_size'])
+            if flushed or options['once']:
+                self.stderr.write(f'Flushed {flushed} deltas in {time.monotonic() - started:.3f}s.')
+            if options['once']:
+                return
+            time.sleep(max(options['interval'] - (time.monotonic() - started), 0))
@@ -0,0 +1,170 @@
+import random
+import time
+from collections import Counter, defaultdict
+from datetime import timedelta
+from decimal import Decimal
+from itertools import accumulate
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.utils import timezone
+
+from shop.caching import order_cache
+from shop.models import ArchivedOrder, ArchivedOrderItem, Category, DailySales, IdempotencyKey, Order, OrderItem, \
+    Product, SoldItemsDelta
+from shop.resolvers import product_resolver
+
+PRODUCT_NAMES = {
+    "cloth": ["T-shirt", "Jeans", "Dress", "Sweater", "Jacket", "Skirt", "Shorts", "Hoodie"],
+    "jewel": ["Necklace", "Ring", "Earrings", "Bracelet", "Brooch", "Watch", "Anklet", "Cufflinks"],
+    "shoes": ["Sneakers", "Boots", "Sandals", "Flats", "Heels", "Loafers", "Oxfords", "Slippers"],
+    "accessory": ["Handbag", "Hat", "Scarf", "Sunglasses", "Gloves", "Belt", "Wallet", "Umbrella"],
+    "electronics": ["Smartphone", "Laptop", "Smartwatch", "Headphones", "Tablet", "Camera", "Fitness Tracker",
+                    "Bluetooth Speaker"]
+}
+
+
+class Command(BaseCommand):
+    help = ('Fill the shop with generated categories, products and orders for load testing. Product popularity '
+            'follows a Zipf law; the same --seed always produces the same data.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--categories', type=int, default=len(PRODUCT_NAMES))
+        parser.add_argument('--products', type=int, default=40)
+        parser.add_argument('--orders', type=int, default=10000)
+        parser.add_argument('--customers', type=int, help='Distinct customer names; --orders // 10 by default.')
+        parser.add_argument('--days', type=int, default=365, help='Spread order dates over this many days.')
+        parser.add_argument('--max-lines', type=int, default=5, help='Products drawn per order, at most.')
+        parser.add_argument('--max-quantity', type=int, default=3, help='Pieces per draw, at most.')
+        parser.add_argument('--skew', type=float, default=1.1, help='Zipf exponent of product popularity.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--clear', action='store_true', help='Delete all shop data first.')
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+
+        with transaction.atomic():
+            if options['clear']:
+                self.clear()
+            elif Product.objects.exists():
+                raise CommandError('The shop already has products; pass --clear to replace them.')
+
+            products = self.create_catalog(options['categories'], options['products'])
+            orders, lines = self.create_orders(products, options)
+
+        product_resolver.invalidate()
+        order_cache.touch()
+        self.stderr.write(f'Generated {len(products)} products, {orders} orders and {lines} order lines '
+                          f'in {time.monotonic() - started:.1f}s.')
+
+    def clear(self):
+        # The archive goes too: its lines reference the products, and its ids
+        # would collide with the orders generated once the sequences restart.
+        models = [ArchivedOrderItem, ArchivedOrder, OrderItem, SoldItemsDelta, DailySales, IdempotencyKey, Order,
+                  Product, Category]
+        tables = [model._meta.db_table for model in models]
+        connection.ops.execute_sql_flush(connection.ops.sql_flush(no_style(), tables, reset_sequences=True))
+
+    def create_catalog(self, category_count, product_count):
+        names = list(PRODUCT_NAMES)
+        categories = Category.objects.bulk_create([
+            Category(name=names[i % len(names)] + (f' {i // len(names) + 1}' if i >= len(names) else ''))
+            for i in range(category_count)])
+
+        products = []
+        for i in range(product_count):
+            category = categories[i % len(categories)]
+            base = PRODUCT_NAMES.get(category.name.split()[0], ['Product'])
+            base = base[(i // len(categories)) % len(base)]
+            products.append(Product(name=f'{base} #{i + 1}', category=category,
+                                    price=Decimal(self.rng.randint(100, 50000)) / 100))
+        return Product.objects.bulk_create(products, batch_size=self.batch_size)
+
+    def create_orders(self, products, options):
+        """
+        Write the orders and their lines with explicit ids in multi-row
+        INSERTs, and the totals, sold counters and rollups computed along
+        the way, so the data looks exactly as if the API had written it.
+        """
+        rng = self.rng
+        # Popularity by rank, with ranks shuffled so hits spread over categories.
+        ranked = products[:]
+        rng.shuffle(ranked)
+        weights = list(accumulate(1 / (rank + 1) ** options['skew'] for rank in range(len(ranked))))
+        pieces = list(range(1, options['max_quantity'] + 1))
+        piece_weights = list(accumulate(1 / q ** 2 for q in pieces))
+
+        customers = options['customers'] or max(options['orders'] // 10, 1)
+        # Values are adapted for the driver once here rather than per row;
+        # ints and Decimals go to the driver as they are.
+        today = timezone.localdate()
+        dates = [connection.ops.adapt_datefield_value(today - timedelta(days=offset))
+                 for offset in range(options['days'])]
+        stamp = connection.ops.adapt_datetimefield_value(timezone.now())
+
+        next_order = (Order.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+        next_line = (OrderItem.objects.order_by('-id').values_list('id', flat=True).first() or 0) + 1
+        sold = Counter()
+        daily = defaultdict(lambda: [0, Decimal('0')])
+        order_rows, line_rows, total_lines = [], [], 0
+
+        for order_id in range(next_order, next_order + options['orders']):
+            order_date = rng.choice(dates)
+            draws = rng.choices(ranked, cum_weights=weights, k=rng.randint(1, options['max_lines']))
+            quantities = Counter()
+            for product in draws:
+                quantities[product] += rng.choices(pieces, cum_weights=piece_weights)[0]
+
+            total = Decimal('0')
+            for product, quantity in quantities.items():
+                line_rows.append((next_line, order_id, product.pk, quantity, product.price))
+                next_line += 1
+                total += product.price * quantity
+                sold[product.pk] += quantity
+                rollup = daily[order_date, product.pk]
+                rollup[0] += quantity
+                rollup[1] += product.price * quantity
+            order_rows.append((order_id, f'Customer {rng.randrange(customers) + 1}', total, order_date, 1, stamp))
+
+            if len(line_rows) >= self.batch_size:
+                total_lines += self.flush_rows(order_rows, line_rows)
+
+        total_lines += self.flush_rows(order_rows, line_rows)
+        with connection.cursor() as cursor:
+            for sql in connection.ops.sequence_reset_sql(no_style(), [Order, OrderItem]):
+                cursor.execute(sql)
+
+        for product in products:
+            product.sold_items_count = sold[product.pk]
+        Product.objects.bulk_update(products, ['sold_items_count'], batch_size=self.batch_size)
+        categories = {product.pk: product.category_id for product in products}
+        self.insert(DailySales, ['order_date', 'product', 'category', 'quantity', 'revenue'],
+                    [(order_date, pk, categories[pk], quantity, revenue)
+                     for (order_date, pk), (quantity, revenue) in daily.items()])
+        return options['orders'], total_lines
+
+    def flush_rows(self, order_rows, line_rows):
+        self.insert(Order, ['id', 'customer_name', 'total_amount', 'order_date', 'version', 'updated_at'], order_rows)
+        self.insert(OrderItem, ['id', 'order', 'product', 'quantity', 'unit_price'], line_rows)
+        written = len(line_rows)
+        order_rows.clear()
+        line_rows.clear()
+        return written
+
+    def insert(self, model, field_names, rows):
+        """INSERT ``rows`` of driver-ready values, as many per statement as the backend allows."""
+        fields = [model._meta.get_field(name) for name in field_names]
+        columns = ', '.join(connection.ops.quote_name(field.column) for field in fields)
+        placeholder = '(' + ', '.join(['%s'] * len(fields)) + ')'
+        batch_size = min(self.batch_size, connection.ops.bulk_batch_size(fields, rows) or self.batch_size)
+
+        with connection.cursor() as cursor:
+            for start in range(0, len(rows), batch_size):
+                batch = rows[start:start + batch_size]
+                cursor.execute(f'INSERT INTO {connection.ops.quote_name(model._meta.db_table)} ({columns}) '
+                               f'VALUES {", ".join([placeholder] * len(batch))}',
+                               [value for row in batch for value in row])
@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+
+from shop.idempotency import expired_before
+from shop.models import IdempotencyKey
+
+
+class Command(BaseCommand):
+    help = 'Delete Idempotency-Key records older than IDEMPOTENCY_KEY_TTL.'
+
+    def handle(self, *args, **options):
+        deleted, _ = IdempotencyKey.objects.filter(created_at__lt=expired_before()).delete()
+        self.stderr.write(f'Deleted {deleted} expired keys.')
@@ -0,0 +1,28 @@
+from datetime import date
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from shop.counters import purge_orders
+
+
+class Command(BaseCommand):
+    help = ('Delete orders by id or by order_date range, taking their lines back out of the sold counters and '
+            'rollups with set-based queries, one chunk per transaction.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ids', type=int, nargs='+', help='Ids of the orders to delete.')
+        parser.add_argument('--from', dest='date_from', type=date.fromisoformat,
+                            help='First order_date to delete (YYYY-MM-DD).')
+        parser.add_argument('--to', dest='date_to', type=date.fromisoformat,
+                            help='Last order_date to delete (YYYY-MM-DD).')
+        parser.add_argument('--chunk-size', type=int, default=getattr(settings, 'ORDERS_PURGE_CHUNK_SIZE', 1000))
+
+    def handle(self, *args, **options):
+        dates = options['date_from'] is not None or options['date_to'] is not None
+        if bool(options['ids']) == dates:
+            raise CommandError('Give either --ids or at least one of --from and --to.')
+
+        deleted = purge_orders(options['ids'], options['date_from'], options['date_to'],
+                               chunk_size=options['chunk_size'])
+        self.stderr.write(f'Deleted {deleted} orders.')
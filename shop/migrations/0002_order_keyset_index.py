@@ -0,0 +1,84 @@
+# Generated by Django 4.2.7 on 2026-10-18 06:18
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='category',
+            options={'verbose_name': 'Категория', 'verbose_name_plural': 'Категории'},
+        ),
+        migrations.AlterModelOptions(
+            name='order',
+            options={'verbose_name': 'Заказ', 'verbose_name_plural': 'Заказы'},
+        ),
+        migrations.AlterModelOptions(
+            name='product',
+            options={'verbose_name': 'Товар', 'verbose_name_plural': 'Товары'},
+        ),
+        migrations.AlterField(
+            model_name='category',
+            name='name',
+            field=models.CharField(max_length=100, verbose_name='Наименование категории'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='customer_name',
+            field=models.CharField(max_length=100, verbose_name='Имя заказчика'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='order_date',
+            field=models.DateField(auto_now_add=True, db_index=True, verbose_name='Дата заказа'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='products',
+            field=models.ManyToManyField(to='shop.product', verbose_name='Товары в заказе'),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='total_amount',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Общая сумма заказа'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='category',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='shop.category', verbose_name='Категория'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, verbose_name='Дата создания'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='name',
+            field=models.CharField(max_length=200, verbose_name='Наименование товара'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='price',
+            field=models.DecimalField(decimal_places=2, max_digits=10, verbose_name='Цена'),
+        ),
+        migrations.AlterField(
+            model_name='product',
+            name='sold_items_count',
+            field=models.IntegerField(default=0, verbose_name='Количество проданных товаров'),
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['order_date', 'id'], name='shop_order_order_d_51c0e8_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(fields=['category'], name='shop_produc_categor_d249e3_idx'),
+        ),
+    ]
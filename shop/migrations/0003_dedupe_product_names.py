@@ -0,0 +1,33 @@
+# Generated by Django 4.2.7 on 2026-10-18 06:22
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def dedupe_product_names(apps, schema_editor):
+    """
+    Keep the oldest product under each duplicated name and rename the rest to
+    "<name> #<id>". Orders reference products by id, so their lines and the
+    sold counters stay intact; only lookups by the old name change.
+    """
+    Product = apps.get_model('shop', 'Product')
+    duplicated = Product.objects.values('name').annotate(n=Count('id'), keep=Min('id')).filter(n__gt=1)
+
+    renamed = []
+    for row in duplicated:
+        for product in Product.objects.filter(name=row['name']).exclude(id=row['keep']).only('id', 'name'):
+            suffix = f' #{product.id}'
+            product.name = product.name[:200 - len(suffix)] + suffix
+            renamed.append(product)
+    Product.objects.bulk_update(renamed, ['name'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0002_order_keyset_index'),
+    ]
+
+    operations = [
+        migrations.RunPython(dedupe_product_names, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 06:22
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0003_dedupe_product_names'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='name',
+            field=models.CharField(max_length=200, unique=True, verbose_name='Наименование товара'),
+        ),
+    ]
@@ -0,0 +1,84 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:10
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import DecimalField, F, OuterRef, PositiveIntegerField, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_items(apps, schema_editor):
+    """
+    Give every existing line the current price of its product, then
+    recompute the order totals as a sum of prices rather than a count of
+    lines, and the sold counters from the lines themselves.
+    """
+    Order = apps.get_model('shop', 'Order')
+    OrderItem = apps.get_model('shop', 'OrderItem')
+    Product = apps.get_model('shop', 'Product')
+
+    prices = Product.objects.filter(pk=OuterRef('product_id')).values('price')[:1]
+    OrderItem.objects.filter(unit_price__isnull=True).update(unit_price=Subquery(prices))
+
+    amounts = (OrderItem.objects.filter(order_id=OuterRef('pk')).order_by().values('order_id')
+               .annotate(amount=Sum(F('quantity') * F('unit_price'))).values('amount'))
+    Order.objects.update(
+        total_amount=Coalesce(Subquery(amounts, output_field=DecimalField(max_digits=10, decimal_places=2)),
+                              Value(Decimal('0'))),
+        version=F('version') + 1)
+
+    sold = (OrderItem.objects.filter(product_id=OuterRef('pk')).order_by().values('product_id')
+            .annotate(n=Sum('quantity')).values('n'))
+    Product.objects.update(sold_items_count=Coalesce(Subquery(sold, output_field=PositiveIntegerField()), Value(0)))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0005_versioning'),
+    ]
+
+    operations = [
+        # The plain many-to-many table already has the shape of OrderItem
+        # (id, order_id, product_id, unique pair), so it is adopted as is
+        # instead of copying every line into a new table.
+        migrations.SeparateDatabaseAndState(
+            state_operations=[
+                migrations.CreateModel(
+                    name='OrderItem',
+                    fields=[
+                        ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False,
+                                                   verbose_name='ID')),
+                        ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items',
+                                                    to='shop.order', verbose_name='Заказ')),
+                        ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE,
+                                                      to='shop.product', verbose_name='Товар')),
+                    ],
+                    options={
+                        'verbose_name': 'Позиция заказа',
+                        'verbose_name_plural': 'Позиции заказа',
+                        'db_table': 'shop_order_products',
+                        'unique_together': {('order', 'product')},
+                    },
+                ),
+                migrations.AlterField(
+                    model_name='order',
+                    name='products',
+                    field=models.ManyToManyField(through='shop.OrderItem', to='shop.product',
+                                                 verbose_name='Товары в заказе'),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='quantity',
+            field=models.PositiveIntegerField(default=1, verbose_name='Количество'),
+        ),
+        migrations.AddField(
+            model_name='orderitem',
+            name='unit_price',
+            field=models.DecimalField(decimal_places=2, max_digits=10, null=True, verbose_name='Цена за единицу'),
+        ),
+        migrations.RunPython(backfill_items, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-18 09:40
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0006_order_items'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SoldItemsDelta',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('delta', models.IntegerField(verbose_name='Изменение')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shop.product', verbose_name='Товар')),
+            ],
+            options={
+                'verbose_name': 'Отложенное изменение счетчика',
+                'verbose_name_plural': 'Отложенные изменения счетчиков',
+            },
+        ),
+    ]
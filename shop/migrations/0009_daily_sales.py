@@ -0,0 +1,58 @@
+# Generated by Django 4.2.7 on 2026-10-18 11:05
+
+from django.db import migrations, models
+from django.db.models import DecimalField, F, Sum
+import django.db.models.deletion
+
+
+def backfill_daily_sales(apps, schema_editor):
+    OrderItem = apps.get_model('shop', 'OrderItem')
+    DailySales = apps.get_model('shop', 'DailySales')
+
+    sums = (OrderItem.objects.order_by().values('order__order_date', 'product_id', 'product__category_id')
+            .annotate(sold=Sum('quantity'),
+                      amount=Sum(F('quantity') * F('unit_price'),
+                                  output_field=DecimalField(max_digits=14, decimal_places=2))))
+    DailySales.objects.bulk_create(
+        (DailySales(order_date=row['order__order_date'], product_id=row['product_id'],
+                    category_id=row['product__category_id'], quantity=row['sold'], revenue=row['amount'] or 0)
+         for row in sums.iterator(chunk_size=2000)),
+        batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0008_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='solditemsdelta',
+            name='order_date',
+            field=models.DateField(null=True, verbose_name='Дата заказа'),
+        ),
+        migrations.AddField(
+            model_name='solditemsdelta',
+            name='revenue',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Изменение выручки'),
+        ),
+        migrations.CreateModel(
+            name='DailySales',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('order_date', models.DateField(verbose_name='Дата заказа')),
+                ('quantity', models.IntegerField(default=0, verbose_name='Количество')),
+                ('revenue', models.DecimalField(decimal_places=2, default=0, max_digits=14, verbose_name='Выручка')),
+                ('category', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shop.category', verbose_name='Категория')),
+                ('product', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shop.product', verbose_name='Товар')),
+            ],
+            options={
+                'verbose_name': 'Продажи за день',
+                'verbose_name_plural': 'Продажи по дням',
+                'indexes': [models.Index(fields=['category', 'order_date'], name='shop_dailys_categor_18be16_idx'), models.Index(fields=['product', 'order_date'], name='shop_dailys_product_85c1d2_idx')],
+                'unique_together': {('order_date', 'product')},
+            },
+        ),
+        migrations.RunPython(backfill_daily_sales, migrations.RunPython.noop),
+    ]
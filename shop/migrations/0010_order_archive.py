@@ -0,0 +1,96 @@
+# Generated by Django 4.2.7 on 2026-10-18 07:15
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def partitioned(schema_editor):
+    return (schema_editor.connection.vendor == 'postgresql'
+            and getattr(settings, 'ORDERS_ARCHIVE_PARTITIONED', False))
+
+
+def partitioned_table_sql(schema_editor, model):
+    """CREATE TABLE for ``model`` range-partitioned by order_date, which the primary key has to include."""
+    connection, quote = schema_editor.connection, schema_editor.quote_name
+    columns = []
+    for field in model._meta.local_concrete_fields:
+        definition = f'{quote(field.column)} {field.db_type(connection)} {"NULL" if field.null else "NOT NULL"}'
+        check = field.db_check(connection)
+        if check:
+            definition += f' CHECK ({check})'
+        if field.remote_field and field.db_constraint:
+            target = field.target_field
+            definition += (f' REFERENCES {quote(target.model._meta.db_table)} ({quote(target.column)}) '
+                           f'DEFERRABLE INITIALLY DEFERRED')
+        columns.append(definition)
+    columns.append(f'PRIMARY KEY ({quote("id")}, {quote("order_date")})')
+    return (f'CREATE TABLE {quote(model._meta.db_table)} ({", ".join(columns)}) '
+            f'PARTITION BY RANGE ({quote("order_date")})')
+
+
+def create_archive_tables(apps, schema_editor):
+    archived_order = apps.get_model('shop', 'ArchivedOrder')
+    archived_item = apps.get_model('shop', 'ArchivedOrderItem')
+    if not partitioned(schema_editor):
+        schema_editor.create_model(archived_order)
+        schema_editor.create_model(archived_item)
+        return
+
+    # Monthly partitions are added by shop.archive as orders are archived.
+    quote = schema_editor.quote_name
+    schema_editor.execute(partitioned_table_sql(schema_editor, archived_order))
+    schema_editor.execute(partitioned_table_sql(schema_editor, archived_item))
+    table = archived_item._meta.db_table
+    for name in ['order', 'product']:
+        column = archived_item._meta.get_field(name).column
+        schema_editor.execute(f'CREATE INDEX {quote(f"{table}_{column}_idx")} ON {quote(table)} ({quote(column)})')
+
+
+def drop_archive_tables(apps, schema_editor):
+    schema_editor.delete_model(apps.get_model('shop', 'ArchivedOrderItem'))
+    schema_editor.delete_model(apps.get_model('shop', 'ArchivedOrder'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0009_daily_sales'),
+    ]
+
+    operations = [
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.CreateModel(
+                name='ArchivedOrder',
+                fields=[
+                    ('id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='ID')),
+                    ('version', models.PositiveIntegerField(default=1, verbose_name='Версия')),
+                    ('updated_at', models.DateTimeField(verbose_name='Дата изменения')),
+                    ('customer_name', models.CharField(max_length=100, verbose_name='Имя заказчика')),
+                    ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=10, verbose_name='Общая сумма заказа')),
+                    ('order_date', models.DateField(verbose_name='Дата заказа')),
+                    ('archived_at', models.DateTimeField(verbose_name='Дата архивации')),
+                ],
+                options={
+                    'verbose_name': 'Архивный заказ',
+                    'verbose_name_plural': 'Архивные заказы',
+                },
+            ),
+            migrations.CreateModel(
+                name='ArchivedOrderItem',
+                fields=[
+                    ('id', models.BigIntegerField(primary_key=True, serialize=False, verbose_name='ID')),
+                    ('quantity', models.PositiveIntegerField(default=1, verbose_name='Количество')),
+                    ('unit_price', models.DecimalField(decimal_places=2, max_digits=10, null=True, verbose_name='Цена за единицу')),
+                    ('order_date', models.DateField(verbose_name='Дата заказа')),
+                    ('order', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='items', to='shop.archivedorder', verbose_name='Заказ')),
+                    ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='shop.product', verbose_name='Товар')),
+                ],
+                options={
+                    'verbose_name': 'Позиция архивного заказа',
+                    'verbose_name_plural': 'Позиции архивных заказов',
+                },
+            ),
+        ]),
+        migrations.RunPython(create_archive_tables, drop_archive_tables),
+    ]
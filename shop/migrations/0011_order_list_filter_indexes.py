@@ -0,0 +1,44 @@
+# Generated by Django 4.2.7 on 2026-10-18 07:27
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+SQLITE_LIKE_INDEX = 'shop_order_customer_name_like'
+
+
+def create_sqlite_like_index(apps, schema_editor):
+    # SQLite runs startswith as a case-insensitive LIKE, which only a NOCASE
+    # index can serve; on Postgres the pattern_ops index above does.
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'CREATE INDEX {SQLITE_LIKE_INDEX} '
+                              f'ON shop_order (customer_name COLLATE NOCASE, order_date, id)')
+
+
+def drop_sqlite_like_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {SQLITE_LIKE_INDEX}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0010_order_archive'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer_name', 'order_date', 'id'], name='shop_order_custome_b44d2c_idx', opclasses=['varchar_pattern_ops', 'date_ops', 'int8_ops']),
+        ),
+        migrations.RunPython(create_sqlite_like_index, drop_sqlite_like_index),
+        migrations.AddIndex(
+            model_name='orderitem',
+            index=models.Index(fields=['product', 'order'], name='shop_order__product_2de6d4_idx'),
+        ),
+        # The (product, order) index above replaces the plain product_id one.
+        migrations.AlterField(
+            model_name='orderitem',
+            name='product',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='shop.product', verbose_name='Товар'),
+        ),
+    ]
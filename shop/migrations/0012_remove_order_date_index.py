@@ -0,0 +1,32 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:01
+
+from django.db import migrations, models
+
+SQLITE_LIKE_INDEX = 'shop_order_customer_name_like'
+
+
+def create_sqlite_like_index(apps, schema_editor):
+    # SQLite applies the AlterField below by rebuilding shop_order, which
+    # drops the NOCASE index migration 0011 created outside the model state.
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f'CREATE INDEX IF NOT EXISTS {SQLITE_LIKE_INDEX} '
+                              f'ON shop_order (customer_name COLLATE NOCASE, order_date, id)')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0011_order_list_filter_indexes'),
+    ]
+
+    operations = [
+        # Runs when unapplying, after the rebuild that restores the index below.
+        migrations.RunPython(migrations.RunPython.noop, create_sqlite_like_index),
+        # The (order_date, id) index serves every lookup the single-column one did.
+        migrations.AlterField(
+            model_name='order',
+            name='order_date',
+            field=models.DateField(auto_now_add=True, verbose_name='Дата заказа'),
+        ),
+        migrations.RunPython(create_sqlite_like_index, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0012_remove_order_date_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='idempotencykey',
+            name='client',
+            field=models.CharField(default='', max_length=64, verbose_name='Клиент'),
+        ),
+        migrations.AlterField(
+            model_name='idempotencykey',
+            name='key',
+            field=models.CharField(max_length=255, verbose_name='Ключ'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='idempotencykey',
+            unique_together={('client', 'key')},
+        ),
+    ]
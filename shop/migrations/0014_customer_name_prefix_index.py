@@ -0,0 +1,39 @@
+# Generated by Django 4.2.7 on 2026-10-18 08:04
+
+from django.db import migrations, models
+
+POSTGRES_PREFIX_INDEX = 'shop_order_customer_name_upper'
+
+
+def create_postgres_prefix_index(apps, schema_editor):
+    # istartswith runs as UPPER(customer_name) LIKE UPPER('x%') on Postgres,
+    # which the pattern operator class serves under any collation. SQLite
+    # runs it as a plain LIKE, served by the NOCASE index of migration 0011.
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'CREATE INDEX {POSTGRES_PREFIX_INDEX} '
+                              f'ON shop_order ((UPPER(customer_name::text)) text_pattern_ops, order_date, id)')
+
+
+def drop_postgres_prefix_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f'DROP INDEX IF EXISTS {POSTGRES_PREFIX_INDEX}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('shop', '0013_idempotency_key_client'),
+    ]
+
+    operations = [
+        # Back to the default operator classes: the index now only serves exact names.
+        migrations.RemoveIndex(
+            model_name='order',
+            name='shop_order_custome_b44d2c_idx',
+        ),
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['customer_name', 'order_date', 'id'], name='shop_order_custome_b44d2c_idx'),
+        ),
+        migrations.RunPython(create_postgres_prefix_index, drop_postgres_prefix_index),
+    ]
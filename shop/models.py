@@ -1,19 +1,43 @@
+from django.core.serializers.json import DjangoJSONEncoder
 from django.db import models
+from django.db.models import F
 
 
-class Category(models.Model):
+class VersionedModel(models.Model):
+    """
+    Bumps ``version`` on every update, for conditional GETs. Set-based
+    updates that bypass save() (see counters.py) bump it themselves.
+    """
+    version = models.PositiveIntegerField(default=1, editable=False, verbose_name='Версия')
+    updated_at = models.DateTimeField(auto_now=True, verbose_name='Дата изменения')
+
+    class Meta:
+        abstract = True
+
+    def save(self, *args, **kwargs):
+        if self._state.adding:
+            return super().save(*args, **kwargs)
+
+        self.version = F('version') + 1
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'version', 'updated_at'}
+        super().save(*args, **kwargs)
+        self.refresh_from_db(fields=['version'])
+
+
+class Category(VersionedModel):
     name = models.CharField(max_length=100, verbose_name='Наименование категории')
 
     def __str__(self):
         return self.name
 
-    class Meta:
+    class Meta(VersionedModel.Meta):
         verbose_name = 'Категория'
         verbose_name_plural = 'Категории'
 
 
-class Product(models.Model):
-    name = models.CharField(max_length=200, verbose_name='Наименование товара')
+class Product(VersionedModel):
+    name = models.CharField(max_length=200, unique=True, verbose_name='Наименование товара')
     category = models.ForeignKey(Category, on_delete=models.CASCADE, verbose_name='Категория', db_index=True)
     price = models.DecimalField(max_digits=10, decimal_places=2, verbose_name='Цена')
     sold_items_count = models.IntegerField(default=0, verbose_name='Количество проданных товаров')
@@ -22,7 +46,7 @@ class Product(models.Model):
     def __str__(self):
         return self.name
 
-    class Meta:
+    class Meta(VersionedModel.Meta):
         verbose_name = 'Товар'
         verbose_name_plural = 'Товары'
         indexes = [
@@ -30,18 +54,159 @@ class Product(models.Model):
         ]
 
 
-class Order(models.Model):
+class Order(VersionedModel):
     customer_name = models.CharField(max_length=100, verbose_name='Имя заказчика')
-    products = models.ManyToManyField(Product, verbose_name='Товары в заказе')
+    products = models.ManyToManyField(Product, through='OrderItem', verbose_name='Товары в заказе')
     total_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name='Общая сумма заказа')
-    order_date = models.DateField(auto_now_add=True, verbose_name='Дата заказа', db_index=True)
+    order_date = models.DateField(auto_now_add=True, verbose_name='Дата заказа')
 
     def __str__(self):
         return f"{self.customer_name}_{self.order_date}"
 
-    class Meta:
+    class Meta(VersionedModel.Meta):
         verbose_name = 'Заказ'
         verbose_name_plural = 'Заказы'
         indexes = [
-            models.Index(fields=['order_date']),
+            models.Index(fields=['order_date', 'id']),
+            # Exact customer_name filters of the order list, in page order. The case-insensitive prefix
+            # filter has a per-backend index outside the model state: NOCASE on SQLite (migration 0011),
+            # UPPER(customer_name) text_pattern_ops on Postgres (migration 0014).
+            models.Index(fields=['customer_name', 'order_date', 'id'], name='shop_order_custome_b44d2c_idx'),
         ]
+
+
+class OrderItem(models.Model):
+    """
+    One line of an order: a product, how many of it and its price at the
+    time it was ordered. Lives in the table Django created for the original
+    plain many-to-many, so existing lines became one-piece items in place.
+    """
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items', verbose_name='Заказ')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, db_index=False, verbose_name='Товар')
+    quantity = models.PositiveIntegerField(default=1, verbose_name='Количество')
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, verbose_name='Цена за единицу')
+
+    def __str__(self):
+        return f"{self.product_id} x {self.quantity}"
+
+    class Meta:
+        db_table = 'shop_order_products'
+        verbose_name = 'Позиция заказа'
+        verbose_name_plural = 'Позиции заказа'
+        unique_together = [('order', 'product')]
+        indexes = [
+            # Orders containing a product, from the index alone; also serves the foreign key.
+            models.Index(fields=['product', 'order']),
+        ]
+
+
+class SoldItemsDelta(models.Model):
+    """
+    Pending change of Product.sold_items_count and of the DailySales row of
+    ``order_date``. Written in the order's transaction when
+    SOLD_ITEMS_DEFERRED is on, so checkouts never lock the product or rollup
+    rows, and merged into them later by outbox.flush().
+    """
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+', verbose_name='Товар')
+    delta = models.IntegerField(verbose_name='Изменение')
+    order_date = models.DateField(null=True, verbose_name='Дата заказа')
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name='Изменение выручки')
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')
+
+    class Meta:
+        verbose_name = 'Отложенное изменение счетчика'
+        verbose_name_plural = 'Отложенные изменения счетчиков'
+
+
+class DailySales(models.Model):
+    """
+    Quantity sold and revenue of one product on one order date, kept up to
+    date by counters.py (see rollups.py). ``category`` is the product's
+    category, copied so reports by category never join the catalog.
+    """
+    order_date = models.DateField(verbose_name='Дата заказа')
+    category = models.ForeignKey(Category, on_delete=models.CASCADE, related_name='+', db_index=False,
+                                 verbose_name='Категория')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+', db_index=False,
+                                verbose_name='Товар')
+    quantity = models.IntegerField(default=0, verbose_name='Количество')
+    revenue = models.DecimalField(max_digits=14, decimal_places=2, default=0, verbose_name='Выручка')
+
+    class Meta:
+        verbose_name = 'Продажи за день'
+        verbose_name_plural = 'Продажи по дням'
+        unique_together = [('order_date', 'product')]
+        indexes = [
+            models.Index(fields=['category', 'order_date']),
+            models.Index(fields=['product', 'order_date']),
+        ]
+
+
+class IdempotencyKey(models.Model):
+    """
+    Outcome of a POST sent with an ``Idempotency-Key`` header, kept for
+    IDEMPOTENCY_KEY_TTL seconds so that a retry gets the same response
+    instead of creating the order again (see idempotency.py).
+    """
+    client = models.CharField(max_length=64, default='', verbose_name='Клиент')
+    key = models.CharField(max_length=255, verbose_name='Ключ')
+    request_hash = models.CharField(max_length=64, verbose_name='Хеш запроса')
+    status_code = models.PositiveSmallIntegerField(null=True, verbose_name='Код ответа')
+    response = models.JSONField(null=True, encoder=DjangoJSONEncoder, verbose_name='Ответ')
+    created_at = models.DateTimeField(auto_now_add=True, db_index=True, verbose_name='Дата создания')
+
+    def __str__(self):
+        return self.key
+
+    class Meta:
+        verbose_name = 'Ключ идемпотентности'
+        verbose_name_plural = 'Ключи идемпотентности'
+        # Each client has keys of its own (see idempotency.client()).
+        unique_together = [('client', 'key')]
+
+
+class ArchivedOrder(models.Model):
+    """
+    An order moved out of the hot tables by archive.archive_orders(), with
+    its id and fields as they were. Archived orders stay counted in the sold
+    counters and rollups, are read-only and are still served by
+    /api/v1/orders/<pk>/ (see projections.order_detail()). On Postgres with
+    ORDERS_ARCHIVE_PARTITIONED the table is range-partitioned by month of
+    ``order_date`` (see migration 0010).
+    """
+    id = models.BigIntegerField(primary_key=True, verbose_name='ID')
+    version = models.PositiveIntegerField(default=1, verbose_name='Версия')
+    updated_at = models.DateTimeField(verbose_name='Дата изменения')
+    customer_name = models.CharField(max_length=100, verbose_name='Имя заказчика')
+    total_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0, verbose_name='Общая сумма заказа')
+    order_date = models.DateField(verbose_name='Дата заказа')
+    archived_at = models.DateTimeField(verbose_name='Дата архивации')
+
+    def __str__(self):
+        return f"{self.customer_name}_{self.order_date}"
+
+    class Meta:
+        verbose_name = 'Архивный заказ'
+        verbose_name_plural = 'Архивные заказы'
+
+
+class ArchivedOrderItem(models.Model):
+    """
+    A line of an ArchivedOrder. ``order_date`` is copied from the order so
+    the lines can be partitioned like the orders; a partitioned table cannot
+    be the target of a foreign key, hence no constraint on ``order``.
+    """
+    id = models.BigIntegerField(primary_key=True, verbose_name='ID')
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, db_constraint=False, related_name='items',
+                              verbose_name='Заказ')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='+', verbose_name='Товар')
+    quantity = models.PositiveIntegerField(default=1, verbose_name='Количество')
+    unit_price = models.DecimalField(max_digits=10, decimal_places=2, null=True, verbose_name='Цена за единицу')
+    order_date = models.DateField(verbose_name='Дата заказа')
+
+    def __str__(self):
+        return f"{self.product_id} x {self.quantity}"
+
+    class Meta:
+        verbose_name = 'Позиция архивного заказа'
+        verbose_name_plural = 'Позиции архивных заказов'
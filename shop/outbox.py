@@ -0,0 +1,80 @@
+"""
+Deferred maintenance of Product.sold_items_count and the DailySales rollups.
+
+With SOLD_ITEMS_DEFERRED on, order writes only append rows to the
+SoldItemsDelta outbox (see counters.apply_sales_deltas), so a checkout
+never waits on the row lock of a popular product or of its rollup row.
+``flush()`` merges the pending rows per product and day and applies them
+with the usual grouped UPDATEs; it is run by ``manage.py flush_sold_items`` every
+SOLD_ITEMS_MAX_STALENESS seconds, which bounds how far the counters lag
+behind the orders, and can be called directly wherever the counters must
+be exact right away (tests, reports).
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from . import counters, rollups
+from .caching import order_cache
+from .models import SoldItemsDelta
+
+
+def flush(batch_size=None):
+    """Apply every pending delta; return the number of outbox rows consumed."""
+    batch_size = batch_size or getattr(settings, 'SOLD_ITEMS_FLUSH_BATCH', 5000)
+    flushed = 0
+    while True:
+        consumed = _flush_batch(batch_size)
+        flushed += consumed
+        if consumed < batch_size:
+            return flushed
+
+
+@transaction.atomic(savepoint=False)
+def _flush_batch(batch_size):
+    # Rows locked by a concurrent flusher are skipped rather than waited on,
+    # so every row is applied exactly once however many flushers run.
+    ids = list(SoldItemsDelta.objects.select_for_update(skip_locked=True)
+               .order_by('id').values_list('id', flat=True)[:batch_size])
+    if not ids:
+        return 0
+
+    rows = (SoldItemsDelta.objects.filter(id__in=ids).order_by().values('order_date', 'product_id')
+            .annotate(quantity=Sum('delta'), revenue=Sum('revenue'))
+            .values_list('order_date', 'product_id', 'quantity', 'revenue'))
+    deltas = {(order_date, pk): (quantity, revenue) for order_date, pk, quantity, revenue in rows}
+
+    sold = Counter()
+    for (_, pk), (quantity, _) in deltas.items():
+        sold[pk] += quantity
+    counters.update_sold_items(sold)
+    rollups.update(deltas)
+    SoldItemsDelta.objects.filter(id__in=ids).delete()
+    order_cache.touch(products=[pk for pk, delta in sold.items() if delta])
+    return len(ids)
+
+
+def lock():
+    """
+    Keep new outbox rows out until the current transaction ends, first
+    waiting for the transactions adding some now. On SQLite every write
+    transaction already excludes the others.
+    """
+    connection = transaction.get_connection()
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(f'LOCK TABLE {connection.ops.quote_name(SoldItemsDelta._meta.db_table)} IN EXCLUSIVE MODE')
+
+
+def stats():
+    oldest = SoldItemsDelta.objects.order_by('id').values_list('created_at', flat=True).first()
+    lag = (timezone.now() - oldest).total_seconds() if oldest is not None else 0.0
+    return {
+        'deferred': counters.is_deferred(),
+        'pending': SoldItemsDelta.objects.count(),
+        'oldest_pending_seconds': lag,
+        'stale': lag > getattr(settings, 'SOLD_ITEMS_MAX_STALENESS', 5),
+    }
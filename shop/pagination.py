@@ -0,0 +1,106 @@
+from datetime import date
+
+from django.conf import settings
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import Cursor, CursorPagination
+
+
+class OrderCursorPagination(CursorPagination):
+    """
+    Keyset pagination over (order_date, id).
+
+    DRF's CursorPagination positions on the first ordering field only and
+    falls back to an OFFSET for ties, which degrades when thousands of orders
+    share one order_date. Here the cursor carries both values, so every page
+    is a single index range scan followed by LIMIT.
+    """
+    ordering = ('order_date', 'id')
+    page_size_query_param = 'page_size'
+
+    def get_page_size(self, request):
+        # Read per request rather than at import, so changed settings apply.
+        self.page_size = getattr(settings, 'ORDERS_PAGE_SIZE', 50)
+        self.max_page_size = getattr(settings, 'ORDERS_MAX_PAGE_SIZE', 500)
+        return super().get_page_size(request)
+
+    def get_page_queryset(self, queryset, request):
+        """
+        Order and filter ``queryset`` for the requested page, sliced to one
+        row more than the page size so the caller can tell whether another
+        page follows.
+        """
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+
+        cursor = self.decode_cursor(request)
+        self.reverse = cursor.reverse if cursor else False
+        self.position = self._parse_position(cursor.position) if cursor else None
+
+        if self.reverse:
+            queryset = queryset.order_by('-order_date', '-id')
+        else:
+            queryset = queryset.order_by('order_date', 'id')
+
+        if self.position is not None:
+            order_date, pk = self.position
+            if self.reverse:
+                queryset = queryset.filter(
+                    Q(order_date__lte=order_date) & (Q(order_date__lt=order_date) | Q(id__lt=pk)))
+            else:
+                queryset = queryset.filter(
+                    Q(order_date__gte=order_date) & (Q(order_date__gt=order_date) | Q(id__gt=pk)))
+
+        return queryset[:self.page_size + 1]
+
+    def paginate_queryset(self, queryset, request, view=None):
+        # Slicing before evaluation also limits prefetch_related() to this page.
+        return self.paginate_results(list(self.get_page_queryset(queryset, request)))
+
+    async def apaginate_queryset(self, queryset, request):
+        return self.paginate_results([row async for row in self.get_page_queryset(queryset, request)])
+
+    def paginate_results(self, results):
+        """Turn the rows of get_page_queryset() into the page and its next/previous state."""
+        has_more = len(results) > self.page_size
+        self.page = results[:self.page_size]
+
+        if self.reverse:
+            self.page.reverse()
+            self.has_next = self.position is not None
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.position is not None
+
+        if (self.has_next or self.has_previous) and self.template is not None:
+            self.display_page_controls = True
+
+        return self.page
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        position = self._get_position_from_instance(self.page[-1], self.ordering)
+        return self.encode_cursor(Cursor(offset=0, reverse=False, position=position))
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        position = self._get_position_from_instance(self.page[0], self.ordering)
+        return self.encode_cursor(Cursor(offset=0, reverse=True, position=position))
+
+    def _get_position_from_instance(self, instance, ordering):
+        if isinstance(instance, dict):
+            return f"{instance['order_date'].isoformat()}|{instance['id']}"
+        return f'{instance.order_date.isoformat()}|{instance.id}'
+
+    def _parse_position(self, position):
+        if position is None:
+            return None
+        try:
+            order_date, pk = position.split('|')
+            return date.fromisoformat(order_date), int(pk)
+        except ValueError:
+            raise NotFound(self.invalid_cursor_message)
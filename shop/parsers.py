@@ -0,0 +1,22 @@
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+
+from .renderers import FastJSONRenderer, engine
+
+
+class FastJSONParser(JSONParser):
+    """JSONParser that decodes with the engine chosen by JSON_ENGINE."""
+    renderer_class = FastJSONRenderer
+    engine = engine
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        encoding = (parser_context or {}).get('encoding', 'utf-8').lower().replace('_', '-')
+        # orjson reads UTF-8 only and always rejects NaN/Infinity, so lenient
+        # parsing and other charsets stay on the stdlib path.
+        if self.engine is None or not self.strict or encoding not in ['utf-8', 'utf8']:
+            return super().parse(stream, media_type, parser_context)
+
+        try:
+            return self.engine.loads(stream.read())
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -0,0 +1,177 @@
+"""
+Serializer-free read path for the order list and detail payloads.
+
+Builds the same JSON as OrderListSerializer and OrderSerializer from
+``values()`` rows joined in Python, without instantiating models or
+per-row DRF fields. Scalar formatting is delegated to module-level DRF
+field instances, so numbers and dates come out exactly as the serializers
+render them. Enabled with ORDERS_FAST_READS; tests compare both paths.
+The ``a``-prefixed variants run the same queries through the async ORM.
+Order details fall back to the archive (see archive.py), which only this
+module reads. Both payloads follow a fieldset tree (see fieldsets.py), and
+the order line queries select only the columns, and join only the tables,
+that its fields are read from.
+"""
+from collections import defaultdict
+
+from django.http import Http404
+from rest_framework import serializers
+
+from . import fieldsets
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+
+LIST_FIELDS = ['id', 'customer_name', 'order_date']
+
+_amount = serializers.DecimalField(max_digits=10, decimal_places=2)
+_date = serializers.DateField()
+_datetime = serializers.DateTimeField()
+
+# Columns of the order line queries that the product, category and item fields are read from.
+PRODUCT_COLUMNS = {
+    'id': 'product_id',
+    'category': 'product__category_id',
+    'name': 'product__name',
+    'price': 'product__price',
+    'sold_items_count': 'product__sold_items_count',
+    'created_at': 'product__created_at',
+}
+CATEGORY_COLUMNS = {'id': 'product__category_id', 'name': 'product__category__name'}
+ITEM_COLUMNS = {'product': 'product_id', 'quantity': 'quantity', 'unit_price': 'unit_price'}
+
+_FORMATS = {
+    'price': _amount.to_representation,
+    'total_amount': _amount.to_representation,
+    'unit_price': lambda value: None if value is None else _amount.to_representation(value),
+    'created_at': _datetime.to_representation,
+    'order_date': _date.to_representation,
+}
+
+
+def _format(name, value):
+    return value if name not in _FORMATS else _FORMATS[name](value)
+
+
+class _LinePlan:
+    """
+    The columns of the order line query for a fieldset tree, and how its
+    rows turn into products and items. A spec is a list of (key, column
+    index, formatter, nested spec) per field.
+    """
+
+    def __init__(self, tree, columns=(), dependencies=True):
+        self.columns = list(columns)
+        self.products = 'products' in tree
+        products = tree.get('products')
+        self.product_spec = None if products is None else self._spec(products, PRODUCT_COLUMNS)
+        self.product_id = None
+        if self.products and (products is None or dependencies):
+            self.product_id = self._index('product_id')
+        self.category_id = None
+        if dependencies and products is not None and fieldsets.is_expanded(products, 'category'):
+            self.category_id = self._index('product__category_id')
+        self.item_spec = self._spec(tree['items'], ITEM_COLUMNS) if 'items' in tree else None
+
+    def _index(self, column):
+        if column not in self.columns:
+            self.columns.append(column)
+        return self.columns.index(column)
+
+    def _spec(self, tree, columns):
+        return [(name, None, None, self._spec(subtree, CATEGORY_COLUMNS)) if subtree is not None
+                else (name, self._index(columns[name]), _FORMATS.get(name), None)
+                for name, subtree in tree.items()]
+
+    def product(self, row):
+        return row[self.product_id] if self.product_spec is None else _render(self.product_spec, row)
+
+    def item(self, row):
+        return _render(self.item_spec, row)
+
+
+def _render(spec, row):
+    return {name: _render(nested, row) if nested is not None
+            else row[index] if formatter is None else formatter(row[index])
+            for name, index, formatter, nested in spec}
+
+
+def list_columns(tree=fieldsets.LIST):
+    """Order columns to fetch for the list payload of ``tree``; pagination always needs id and order_date."""
+    return ['id', 'order_date', *[name for name in fieldsets.scalars(tree) if name not in ['id', 'order_date']]]
+
+
+def order_list(orders, tree=fieldsets.LIST):
+    """List payload for ``orders``, dicts of list_columns(), with at most one extra query."""
+    plan = _LinePlan(tree, ['order_id'], dependencies=False)
+    return _list_payload(orders, _list_lines(orders, plan) if plan.products else [], tree, plan)
+
+
+async def aorder_list(orders, tree=fieldsets.LIST):
+    plan = _LinePlan(tree, ['order_id'], dependencies=False)
+    lines = [line async for line in _list_lines(orders, plan)] if plan.products else []
+    return _list_payload(orders, lines, tree, plan)
+
+
+def _list_lines(orders, plan):
+    return (OrderItem.objects.filter(order_id__in=[order['id'] for order in orders]).order_by('id')
+            .values_list(*plan.columns))
+
+
+def _list_payload(orders, lines, tree, plan):
+    products = defaultdict(list)
+    for line in lines:
+        products[line[0]].append(plan.product(line))
+
+    return [{name: products[order['id']] if name == 'products' else _format(name, order[name]) for name in tree}
+            for order in orders]
+
+
+_SOURCES = [(Order, OrderItem), (ArchivedOrder, ArchivedOrderItem)]
+
+
+def order_detail(pk, tree=fieldsets.DETAIL):
+    """
+    Return ``(data, products)`` for order ``pk``, where ``products`` lists
+    ``(product_id, category_id)`` pairs for cache dependency tracking;
+    ``category_id`` is None when the payload has no category names.
+    Orders missing from the hot table are looked up in the archive.
+    """
+    plan = _LinePlan(tree)
+    for order_model, line_model in _SOURCES:
+        order = order_model.objects.filter(pk=pk).values(*_detail_columns(tree)).first()
+        if order is not None:
+            lines = _detail_lines(line_model, pk, plan) if plan.columns else []
+            return _detail_payload(order, lines, tree, plan)
+    raise Http404
+
+
+async def aorder_detail(pk, tree=fieldsets.DETAIL):
+    plan = _LinePlan(tree)
+    for order_model, line_model in _SOURCES:
+        order = await order_model.objects.filter(pk=pk).values(*_detail_columns(tree)).afirst()
+        if order is not None:
+            lines = [line async for line in _detail_lines(line_model, pk, plan)] if plan.columns else []
+            return _detail_payload(order, lines, tree, plan)
+    raise Http404
+
+
+def _detail_columns(tree):
+    return ['id', *[name for name in fieldsets.scalars(tree) if name != 'id']]
+
+
+def _detail_lines(line_model, pk, plan):
+    return line_model.objects.filter(order_id=pk).order_by('id').values_list(*plan.columns)
+
+
+def _detail_payload(order, lines, tree, plan):
+    products, items, dependencies = [], [], []
+    for line in lines:
+        if plan.products:
+            products.append(plan.product(line))
+            dependencies.append((line[plan.product_id],
+                                 None if plan.category_id is None else line[plan.category_id]))
+        if plan.item_spec is not None:
+            items.append(plan.item(line))
+
+    lists = {'products': products, 'items': items}
+    data = {name: lists[name] if name in lists else _format(name, order[name]) for name in tree}
+    return data, dependencies
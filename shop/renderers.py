@@ -0,0 +1,60 @@
+"""
+JSON rendering through a faster engine when one is installed.
+
+JSON_ENGINE selects it: ``'auto'`` (default) uses orjson if it can be
+imported and the standard library otherwise, ``'orjson'`` requires it and
+``'stdlib'`` keeps DRF's own encoder. Values orjson cannot encode natively
+(Decimal, lazy strings) and datetimes, which DRF formats with a trailing
+``Z``, are handed to DRF's encoder so both engines produce the same JSON.
+"""
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils import encoders
+
+
+def load_engine(name):
+    """Return the orjson module, or None when the stdlib should be used."""
+    if name == 'stdlib':
+        return None
+    if name not in ['auto', 'orjson']:
+        raise ImproperlyConfigured(f"JSON_ENGINE should be 'auto', 'orjson' or 'stdlib', not {name!r}.")
+    try:
+        import orjson
+    except ImportError:
+        if name == 'orjson':
+            raise ImproperlyConfigured("JSON_ENGINE is 'orjson' but orjson is not installed.")
+        return None
+    return orjson
+
+
+engine = load_engine(getattr(settings, 'JSON_ENGINE', 'auto'))
+
+_default = encoders.JSONEncoder().default
+
+
+def dumps(data, json_engine=None):
+    """Compact UTF-8 JSON bytes for ``data`` using ``json_engine`` (the configured one by default)."""
+    json_engine = json_engine or engine
+    options = json_engine.OPT_PASSTHROUGH_DATETIME | json_engine.OPT_NON_STR_KEYS
+    return json_engine.dumps(data, default=_default, option=options)
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer that encodes with the configured engine. Indented output
+    and the non-default ensure_ascii/non-compact settings, which orjson does
+    not support, go through the stdlib path.
+    """
+    engine = engine
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+
+        indent = self.get_indent(accepted_media_type, renderer_context or {})
+        if self.engine is None or indent is not None or self.ensure_ascii or not self.compact:
+            return super().render(data, accepted_media_type, renderer_context)
+
+        # Same escaping as JSONRenderer, so the output stays a strict JavaScript subset.
+        return dumps(data, self.engine).replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
@@ -0,0 +1,129 @@
+"""
+Product name -> id resolution for order writes.
+
+Orders reference products by name, so every write used to start with a
+catalog query. ProductNameResolver keeps a bounded LRU of name -> id with a
+TTL, invalidated from signals.py whenever a Product or Category changes.
+With ``shared=True`` entries and invalidations also go through Django's
+cache framework, so a catalog change made by one worker is seen by all.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .models import Product
+
+
+class ProductNameResolver:
+    generation_key = 'shop:product-names:generation'
+
+    def __init__(self, maxsize=10000, ttl=300, shared=False, cache_alias='default'):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.shared = shared
+        self.cache_alias = cache_alias
+        self._entries = OrderedDict()
+        # Bumped on every local clear, so a DB load that raced with an
+        # invalidation is not written back into the LRU.
+        self._generation = 0
+        self._shared_generation_seen = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def resolve(self, names):
+        """
+        Return {name: product_id} for the ``names`` that exist. Unknown names
+        are simply absent; they are not cached, so a new product is found as
+        soon as it is committed.
+        """
+        names = set(names)
+        now = time.monotonic()
+        shared_generation = self._shared_generation() if self.shared else None
+        found = {}
+
+        with self._lock:
+            if shared_generation != self._shared_generation_seen:
+                self._entries.clear()
+                self._generation += 1
+                self._shared_generation_seen = shared_generation
+            generation = self._generation
+
+            for name in names:
+                entry = self._entries.get(name)
+                if entry is not None and entry[1] > now:
+                    self._entries.move_to_end(name)
+                    found[name] = entry[0]
+            self.hits += len(found)
+            self.misses += len(names) - len(found)
+
+        missing = names - found.keys()
+        if not missing:
+            return found
+
+        loaded = {}
+        if self.shared:
+            keys = {self._shared_key(name, shared_generation): name for name in missing}
+            loaded.update({keys[key]: pk for key, pk in self.cache.get_many(keys).items()})
+            missing -= loaded.keys()
+
+        if missing:
+            from_db = dict(Product.objects.filter(name__in=missing).values_list('name', 'id'))
+            if self.shared and from_db:
+                self.cache.set_many({self._shared_key(name, shared_generation): pk for name, pk in from_db.items()},
+                                    timeout=self.ttl)
+            loaded.update(from_db)
+
+        with self._lock:
+            if generation == self._generation:
+                expires = now + self.ttl
+                for name, pk in loaded.items():
+                    self._entries[name] = (pk, expires)
+                    self._entries.move_to_end(name)
+                while len(self._entries) > self.maxsize:
+                    self._entries.popitem(last=False)
+
+        found.update(loaded)
+        return found
+
+    def invalidate(self):
+        with self._lock:
+            self._entries.clear()
+            self._generation += 1
+        if self.shared:
+            try:
+                self.cache.incr(self.generation_key)
+            except ValueError:
+                self.cache.set(self.generation_key, 1, timeout=None)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': self.hits / lookups if lookups else None,
+            'size': len(self._entries),
+            'maxsize': self.maxsize,
+        }
+
+    def _shared_generation(self):
+        return self.cache.get_or_set(self.generation_key, 0, timeout=None)
+
+    def _shared_key(self, name, generation):
+        digest = hashlib.md5(name.encode()).hexdigest()
+        return f'shop:product-name:{generation}:{digest}'
+
+
+product_resolver = ProductNameResolver(
+    maxsize=getattr(settings, 'PRODUCT_NAME_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'PRODUCT_NAME_CACHE_TTL', 300),
+    shared=getattr(settings, 'PRODUCT_NAME_CACHE_SHARED', False),
+)
@@ -0,0 +1,134 @@
+"""
+Daily sales rollups behind the /api/v1/stats/ endpoints.
+
+DailySales holds one row per (order_date, product) with the quantity sold
+and the revenue (quantity * unit_price of the lines). The counter layer
+feeds every line change through ``update()`` as a sales delta
+{(order_date, product_id): (quantity, revenue)}, directly or, with
+SOLD_ITEMS_DEFERRED, via the outbox. Reports then read a row per product
+and day however many orders there are. ``rebuild()`` recomputes a date
+range from the order lines, archived ones included.
+"""
+import heapq
+from decimal import Decimal
+from itertools import groupby
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, IntegerField, Q, Sum, Value, When
+
+from .models import ArchivedOrderItem, DailySales, OrderItem, Product
+
+_revenue = DecimalField(max_digits=14, decimal_places=2)
+
+
+def update(deltas, batch_size=500):
+    """
+    Add sales ``deltas`` to the rollups: one INSERT of the missing rows and
+    one UPDATE per ``batch_size`` keys, whatever the number of products.
+    """
+    deltas = {key: delta for key, delta in deltas.items() if key[0] is not None and any(delta)}
+    if not deltas:
+        return
+
+    categories = dict(Product.objects.filter(pk__in={pk for _, pk in deltas}).values_list('pk', 'category_id'))
+    DailySales.objects.bulk_create([DailySales(order_date=order_date, product_id=pk, category_id=categories[pk])
+                                    for order_date, pk in deltas if pk in categories], ignore_conflicts=True)
+
+    keys = list(deltas)
+    for start in range(0, len(keys), batch_size):
+        batch = keys[start:start + batch_size]
+        quantities, revenues, by_date = [], [], {}
+        for order_date, pk in batch:
+            quantity, revenue = deltas[order_date, pk]
+            quantities.append(When(order_date=order_date, product_id=pk, then=Value(quantity)))
+            revenues.append(When(order_date=order_date, product_id=pk, then=Value(revenue)))
+            by_date.setdefault(order_date, []).append(pk)
+
+        rows = Q()
+        for order_date, product_ids in by_date.items():
+            rows |= Q(order_date=order_date, product_id__in=product_ids)
+        DailySales.objects.filter(rows).update(
+            quantity=F('quantity') + Case(*quantities, default=Value(0), output_field=IntegerField()),
+            revenue=F('revenue') + Case(*revenues, default=Value(Decimal('0')), output_field=_revenue))
+
+
+def recategorize(product):
+    """Move the rollups of ``product`` to its current category."""
+    DailySales.objects.filter(product=product).exclude(category_id=product.category_id).update(
+        category_id=product.category_id)
+
+
+def _sums(lines, order_date):
+    """Quantity and revenue of ``lines`` per (``order_date``, product), in that order."""
+    return (lines.values('product_id', day=F(order_date), category=F('product__category_id'))
+            .annotate(sold=Sum('quantity'), amount=Sum(F('quantity') * F('unit_price'), output_field=_revenue))
+            .order_by('day', 'product_id'))
+
+
+def _backfill(date_from, date_to, batch_size):
+    hot = _in_range(OrderItem.objects.all(), date_from, date_to, field='order__order_date')
+    archived = _in_range(ArchivedOrderItem.objects.all(), date_from, date_to)
+    # Both sides are sorted by key, so a day and product that has hot and
+    # archived lines is merged on the fly.
+    rows = heapq.merge(_sums(hot, 'order__order_date').iterator(chunk_size=batch_size),
+                       _sums(archived, 'order_date').iterator(chunk_size=batch_size),
+                       key=lambda row: (row['day'], row['product_id']))
+
+    batch, written = [], 0
+    for (order_date, product_id), group in groupby(rows, key=lambda row: (row['day'], row['product_id'])):
+        group = list(group)
+        batch.append(DailySales(order_date=order_date, product_id=product_id, category_id=group[0]['category'],
+                                quantity=sum(row['sold'] for row in group),
+                                revenue=sum(row['amount'] or 0 for row in group)))
+        if len(batch) == batch_size:
+            written += len(DailySales.objects.bulk_create(batch))
+            batch = []
+    return written + len(DailySales.objects.bulk_create(batch))
+
+
+@transaction.atomic
+def rebuild(date_from=None, date_to=None, batch_size=2000):
+    """
+    Replace the rollups of ``date_from..date_to`` (inclusive, open if None)
+    with sums over the order lines, archived ones included; returns the
+    number of rows written.
+    """
+    _in_range(DailySales.objects.all(), date_from, date_to).delete()
+    return _backfill(date_from, date_to, batch_size)
+
+
+def _in_range(rows, date_from, date_to, category=None, product=None, field='order_date'):
+    if date_from is not None:
+        rows = rows.filter(**{f'{field}__gte': date_from})
+    if date_to is not None:
+        rows = rows.filter(**{f'{field}__lte': date_to})
+    if category is not None:
+        rows = rows.filter(category_id=category)
+    if product is not None:
+        rows = rows.filter(product_id=product)
+    return rows
+
+
+SORT_FIELDS = {'quantity': 'sold', 'revenue': 'amount'}
+
+
+def top_products(date_from=None, date_to=None, category=None, product=None, by='quantity', limit=10):
+    """The ``limit`` best-selling products of the range, by ``quantity`` or ``revenue``."""
+    rows = _in_range(DailySales.objects.all(), date_from, date_to, category, product)
+    return (rows.values('product_id', 'product__name', 'category_id', 'category__name')
+            .annotate(sold=Sum('quantity'), amount=Sum('revenue'))
+            .order_by('-' + SORT_FIELDS[by], 'product_id')[:limit])
+
+
+DAILY_GROUPS = {
+    'total': [],
+    'category': ['category_id', 'category__name'],
+    'product': ['product_id', 'product__name'],
+}
+
+
+def daily(date_from=None, date_to=None, group='total', category=None, product=None):
+    """Quantity and revenue per order date, optionally split by category or product."""
+    rows = _in_range(DailySales.objects.all(), date_from, date_to, category, product)
+    fields = ['order_date'] + DAILY_GROUPS[group]
+    return rows.values(*fields).annotate(sold=Sum('quantity'), amount=Sum('revenue')).order_by(*fields)
@@ -0,0 +1,108 @@
+"""
+Read-replica routing for the order GET endpoints.
+
+ReplicaRouter sends reads to a replica only inside ``read_replica()``, which
+the order list and detail views (sync and async) wrap their GET handling
+in; every other read, and every write, goes to the ``default`` database.
+The chosen alias travels in a context variable, so the async views' ORM
+calls in worker threads see it too.
+
+Replicas lag behind the primary, so a client that has just written would
+not see its own change. ReadYourWritesMiddleware stamps every successful
+unsafe request with the time until which that client reads from the
+primary, DB_REPLICA_PIN_SECONDS from now, as a cookie and as the
+``X-Read-Primary-Until`` response header; clients that do not keep cookies
+send the header back. The time is signed, so a client cannot pin itself to
+the primary for longer than its last write did. Nothing is pinned or
+routed while DATABASE_REPLICAS is empty.
+"""
+import random
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.core import signing
+from django.db import DEFAULT_DB_ALIAS
+
+PIN_COOKIE = 'read_primary_until'
+PIN_HEADER = 'X-Read-Primary-Until'
+PIN_SALT = 'shop.routers.pin'
+SAFE_METHODS = ['GET', 'HEAD', 'OPTIONS', 'TRACE']
+
+_replica = ContextVar('shop_read_replica', default=None)
+
+
+def replicas():
+    return getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def pin_seconds():
+    return getattr(settings, 'DB_REPLICA_PIN_SECONDS', 10)
+
+
+def pinned(request):
+    """Whether ``request`` comes from a client that wrote within the last DB_REPLICA_PIN_SECONDS."""
+    until = request.COOKIES.get(PIN_COOKIE) or request.headers.get(PIN_HEADER)
+    try:
+        return float(signing.Signer(salt=PIN_SALT).unsign(until)) > time.time()
+    except (TypeError, ValueError, signing.BadSignature):
+        return False
+
+
+def reading_replica():
+    return _replica.get() is not None
+
+
+@contextmanager
+def read_replica(request):
+    """Route the reads of the enclosed block to a random replica, unless ``request`` is pinned to the primary."""
+    aliases = replicas()
+    token = _replica.set(random.choice(aliases) if aliases and not pinned(request) else None)
+    try:
+        yield
+    finally:
+        _replica.reset(token)
+
+
+class ReplicaRouter:
+    def db_for_read(self, model, **hints):
+        return _replica.get()
+
+    def db_for_write(self, model, **hints):
+        # Explicit, or Django would save an instance back to the replica it was read from.
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        databases = {DEFAULT_DB_ALIAS, *replicas()}
+        if obj1._state.db in databases and obj2._state.db in databases:
+            return True
+        return None
+
+
+class ReadYourWritesMiddleware:
+    """Pin the client of every successful write to the primary for DB_REPLICA_PIN_SECONDS."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        return self.pin(request, self.get_response(request))
+
+    async def __acall__(self, request):
+        return self.pin(request, await self.get_response(request))
+
+    def pin(self, request, response):
+        if request.method in SAFE_METHODS or response.status_code >= 400 or not replicas():
+            return response
+        until = signing.Signer(salt=PIN_SALT).sign(f'{time.time() + pin_seconds():.3f}')
+        response.set_cookie(PIN_COOKIE, until, max_age=pin_seconds(), httponly=True, samesite='Lax')
+        response[PIN_HEADER] = until
+        return response
@@ -1,44 +1,84 @@
 from rest_framework import serializers
-from .models import Category, Product, Order
-
-
-class CategorySerializer(serializers.ModelSerializer):
+from .models import Category, Product, Order, OrderItem
+
+
+class SparseFieldsMixin:
+    """
+    Keeps only the fields that the fieldset tree in ``context['fieldset']``
+    (see fieldsets.py) selects at this serializer's place in the payload,
+    and renders the relations it does not expand as primary keys.
+    """
+
+    def get_fields(self):
+        fields = super().get_fields()
+        tree = self.context.get('fieldset')
+        if tree is None:
+            return fields
+        for name in self._path():
+            tree = tree[name]
+
+        selected = {}
+        for name, subtree in tree.items():
+            field = fields[name]
+            if subtree is None and isinstance(field, serializers.BaseSerializer):
+                field = serializers.PrimaryKeyRelatedField(
+                    many=isinstance(field, serializers.ListSerializer), read_only=True)
+            selected[name] = field
+        return selected
+
+    def _path(self):
+        names, node = [], self
+        while node.parent is not None:
+            if node.field_name:
+                names.append(node.field_name)
+            node = node.parent
+        return reversed(names)
+
+
+class CategorySerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
-        fields = '__all__'
+        exclude = ['version', 'updated_at']
 
 
-class ProductSerializer(serializers.ModelSerializer):
+class ProductSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     category = CategorySerializer()
 
     class Meta:
         model = Product
-        fields = '__all__'
+        exclude = ['version', 'updated_at']
 
 
 class OrderCreateUpdateSerializer(serializers.ModelSerializer):
     class Meta:
         model = Order
-        exclude = ['products']
+        exclude = ['products', 'version', 'updated_at']
         read_only_fields = ['total_amount']
 
 
-class OrderSerializer(serializers.ModelSerializer):
+class OrderItemSerializer(SparseFieldsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = OrderItem
+        fields = ['product', 'quantity', 'unit_price']
+
+
+class OrderSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     products = ProductSerializer(many=True)
+    items = OrderItemSerializer(many=True, read_only=True)
 
     class Meta:
         model = Order
-        fields = '__all__'
+        exclude = ['version', 'updated_at']
         read_only_fields = ['total_amount']
 
 
-class CatListSerializer(serializers.ModelSerializer):
+class CatListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Category
         fields = ['name']
 
 
-class ProdListSerializer(serializers.ModelSerializer):
+class ProdListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     category = CatListSerializer(read_only=True)
 
     class Meta:
@@ -46,9 +86,28 @@ class ProdListSerializer(serializers.ModelSerializer):
         fields = ['name', 'category']
 
 
-class OrderListSerializer(serializers.ModelSerializer):
+class OrderListSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     products = ProdListSerializer(many=True, read_only=True)
 
     class Meta:
         model = Order
         fields = ['id', 'customer_name', 'order_date', 'products']
+
+
+class TopProductSerializer(serializers.Serializer):
+    product_id = serializers.IntegerField()
+    product_name = serializers.CharField(source='product__name')
+    category_id = serializers.IntegerField()
+    category_name = serializers.CharField(source='category__name')
+    quantity = serializers.IntegerField(source='sold')
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2, source='amount')
+
+
+class DailySalesSerializer(serializers.Serializer):
+    order_date = serializers.DateField()
+    category_id = serializers.IntegerField(required=False)
+    category_name = serializers.CharField(source='category__name', required=False)
+    product_id = serializers.IntegerField(required=False)
+    product_name = serializers.CharField(source='product__name', required=False)
+    quantity = serializers.IntegerField(source='sold')
+    revenue = serializers.DecimalField(max_digits=14, decimal_places=2, source='amount')
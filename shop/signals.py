@@ -1,41 +1,92 @@
-from django.db.models import F
-from django.db.models.signals import m2m_changed, pre_delete
+from django.db import transaction
+from django.db.backends.signals import connection_created
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
 from django.dispatch import receiver
-from .models import Order, Product
+from . import counters, instrumentation, rollups
+from .caching import order_cache
+from .models import Category, Order, OrderItem, Product
+from .resolvers import product_resolver
 
 
-@receiver(m2m_changed, sender=Order.products.through)
-def update_order_total_amount(sender, instance, action, **kwargs):
-    if action in ['post_add', 'post_remove', 'post_clear']:
-        total_amount = instance.products.all().count()
-        if instance.total_amount != total_amount:
-            instance.total_amount = total_amount
-            instance.save()
+def _linked_lines(instance, reverse, pk_set):
+    """The OrderItem rows a relation change on ``instance`` concerns, and the ids of their orders."""
+    own, other = ('product_id', 'order_id') if reverse else ('order_id', 'product_id')
+    lines = OrderItem.objects.filter(**{own: instance.pk})
+    if pk_set is not None:
+        lines = lines.filter(**{f'{other}__in': pk_set})
+    order_ids = set(lines.values_list('order_id', flat=True)) if reverse else [instance.pk]
+    return lines, order_ids
 
-            Order.objects.bulk_update([instance], ['total_amount'])
 
+@receiver(m2m_changed, sender=OrderItem)
+def update_order_counters(sender, instance, action, reverse, model, pk_set, **kwargs):
+    if counters.is_managed():
+        return
 
-@receiver(m2m_changed, sender=Order.products.through)
-def update_product_sold_items_count(sender, instance, action, reverse, model, pk_set, **kwargs):
-    if action in ['post_add', 'post_remove']:
-        products = model.objects.filter(pk__in=pk_set)
+    if action in ['pre_remove', 'pre_clear']:
+        # Django reports every requested pk on removal, linked or not, and
+        # none at all on clear, so remember what is actually about to go.
+        lines, order_ids = _linked_lines(instance, reverse, pk_set)
+        instance._counters_pending = order_ids, counters.sales_deltas(lines, sign=-1)
+        return
 
-        updates = []
+    if action == 'post_add':
+        # Lines added through the relation keep the quantity given in
+        # through_defaults (1 otherwise) and get their price snapshot here.
+        lines, order_ids = _linked_lines(instance, reverse, pk_set)
+        counters.fill_unit_prices(order_ids)
+        deltas = counters.sales_deltas(lines)
+    elif action in ['post_remove', 'post_clear']:
+        order_ids, deltas = instance.__dict__.pop('_counters_pending', ((), {}))
+    else:
+        return
 
-        for product in products:
-            if action == 'post_add':
-                updates.append(Product(id=product.id, sold_items_count=F('sold_items_count') + 1))
-            elif action == 'post_remove':
-                updates.append(Product(id=product.id, sold_items_count=F('sold_items_count') - 1))
-
-        Product.objects.bulk_update(updates, ['sold_items_count'])
+    if deltas:
+        counters.sync_counters(order_ids, deltas)
 
 
 @receiver(pre_delete, sender=Order)
-def update_product_sold_items_count_on_order_delete(sender, instance, **kwargs):
-    products = instance.products.all()
-    updates = []
-    for product in products:
-        updates.append(Product(id=product.id, sold_items_count=F('sold_items_count') - 1))
+def update_counters_on_order_delete(sender, instance, **kwargs):
+    if counters.is_managed():
+        return
+    counters.release_order_products([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_product_names(sender, **kwargs):
+    # Once now for this connection, and again after commit in case another
+    # request re-read the old catalog while the transaction was open.
+    product_resolver.invalidate()
+    transaction.on_commit(product_resolver.invalidate)
+
+
+@receiver(post_save, sender=Product)
+def move_product_rollups(sender, instance, created, **kwargs):
+    if not created:
+        rollups.recategorize(instance)
+
+
+@receiver(post_save, sender=Order)
+@receiver(post_delete, sender=Order)
+def invalidate_order_payloads(sender, instance, **kwargs):
+    order_cache.touch(orders=[instance.pk])
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def invalidate_product_payloads(sender, instance, **kwargs):
+    order_cache.touch(products=[instance.pk])
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def invalidate_category_payloads(sender, instance, **kwargs):
+    order_cache.touch(categories=[instance.pk])
+
 
-    Product.objects.bulk_update(updates, ['sold_items_count'])
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    instrumentation.instrument(connection)
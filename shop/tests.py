@@ -1,12 +1,53 @@
+import importlib
+import itertools
+import json
+import os
+import tempfile
+import time
+from collections import defaultdict
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from decimal import Decimal
+from io import BytesIO, StringIO
+from unittest import skipUnless
+from unittest.mock import patch
+
+from asgiref.sync import async_to_sync
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
-from rest_framework import status
-from .models import Order, Product, Category
+from rest_framework import permissions, status
+from rest_framework.exceptions import ParseError
+from rest_framework.throttling import BaseThrottle
+from . import archive, benchmark, counters, export, idempotency, outbox, renderers, rollups, views
+from .models import Order, OrderItem, Product, Category, DailySales, IdempotencyKey, SoldItemsDelta, ArchivedOrder, \
+    ArchivedOrderItem
+from .parsers import FastJSONParser
+from .projections import order_detail, order_list, LIST_FIELDS
+from .resolvers import ProductNameResolver, product_resolver
+from .urls import api_urlconf
+from .caching import order_cache
+from .instrumentation import QueryBudgetExceeded, endpoint_stats, shows_server_timing
 
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.management import call_command, CommandError
+from django.db import IntegrityError, connection
+from django.test import RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.translation import gettext_lazy
+from django.db.models import F
 from django.db.models.signals import m2m_changed, pre_delete
-from .signals import update_order_total_amount, update_product_sold_items_count, \
-    update_product_sold_items_count_on_order_delete
+from .serializers import OrderListSerializer, OrderSerializer
+from .signals import update_order_counters, update_counters_on_order_delete
+
+# Every request the tests send has to stay within QUERY_BUDGETS, whatever the settings module or runner.
+enforce_query_budgets = override_settings(QUERY_BUDGET_RAISE=True)
+
+
+def setUpModule():
+    enforce_query_budgets.enable()
+
+
+def tearDownModule():
+    enforce_query_budgets.disable()
 
 
 class OrderAPITestCase(APITestCase):
@@ -63,9 +104,126 @@ class OrderAPITestCase(APITestCase):
         response = self.client.get(url)
         self.assertEqual(response.status_code, status.HTTP_200_OK)
 
-        self.assertEqual(len(response.data), 2)
-        self.assertEqual(response.data[0]['customer_name'], 'Test Customer')
-        self.assertEqual(response.data[1]['customer_name'], 'Test Customer2')
+        self.assertEqual(len(response.data['results']), 2)
+        self.assertEqual(response.data['results'][0]['customer_name'], 'Test Customer')
+        self.assertEqual(response.data['results'][1]['customer_name'], 'Test Customer2')
+
+    def test_create_order_with_repeated_product_name(self):
+        data = {'customer_name': 'Test Customer', 'products': [self.product.name, self.product.name]}
+        response = self.client.post('/api/v1/orders/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        order = Order.objects.get()
+        self.assertEqual(order.products.count(), 1)
+        self.assertEqual(order.items.get().quantity, 2)
+        self.assertEqual(order.total_amount, 2 * self.product.price)
+
+    def test_create_order_with_quantities(self):
+        data = {'customer_name': 'Test Customer', 'products': [{'name': self.product.name, 'quantity': 250}]}
+        response = self.client.post('/api/v1/orders/', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Decimal(response.data['total_amount']), 250 * self.product.price)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.sold_items_count, 250)
+
+        for products in [[{'name': self.product.name, 'quantity': 0}], [{'quantity': 1}], [3]]:
+            response = self.client.post('/api/v1/orders/', {'customer_name': 'X', 'products': products}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(ORDERS_MAX_QUANTITY=100)
+    def test_oversized_orders_are_rejected(self):
+        Product.objects.create(name='Yacht', category=self.category, price='60000000.00')
+        for products in [[{'name': self.product.name, 'quantity': 10 ** 12}], [{'name': 'Yacht', 'quantity': 2}],
+                         [{'name': self.product.name, 'quantity': 60}, {'name': self.product.name, 'quantity': 41}]]:
+            response = self.client.post('/api/v1/orders/', {'customer_name': 'X', 'products': products}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, products)
+            self.assertIn('error', response.data)
+        response = self.client.post('/api/v1/orders/bulk/', [{'customer_name': 'X', 'products': ['Yacht', 'Yacht']}],
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.post('/api/v1/orders/', {'customer_name': 'X', 'products': ['Yacht', 'Yacht']},
+                                    format='json', HTTP_IDEMPOTENCY_KEY='yacht')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(Order.objects.exists())
+
+        order_id = self.client.post('/api/v1/orders/', {'customer_name': 'X', 'products': ['Yacht']},
+                                    format='json').data['id']
+        url = f'/api/v1/orders/{order_id}/'
+        self.assertEqual(self.client.patch(url, {'add': [{'name': self.product.name, 'quantity': 100}]},
+                                           format='json').status_code, status.HTTP_200_OK)
+        # Over the total, and over ORDERS_MAX_QUANTITY once added to the current line.
+        for method, data in [('put', {'products': ['Yacht', 'Yacht']}), ('patch', {'add': ['Yacht']}),
+                             ('patch', {'add': [self.product.name]})]:
+            response = getattr(self.client, method)(url, data, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, data)
+        self.assertEqual(Order.objects.get(pk=order_id).total_amount, Decimal('60001000.00'))
+        self.assertEqual(Product.objects.get(name='Yacht').sold_items_count, 1)
+
+    def test_line_keeps_price_at_order_time(self):
+        data = {'customer_name': 'Test Customer', 'products': [self.product.name]}
+        order_id = self.client.post('/api/v1/orders/', data, format='json').data['id']
+        Product.objects.filter(pk=self.product.pk).update(price=99)
+
+        response = self.client.patch(f'/api/v1/orders/{order_id}/', {'add': [self.product.name]}, format='json')
+        self.assertEqual(Decimal(response.data['total_amount']), 2 * self.product.price)
+        item = self.client.get(f'/api/v1/orders/{order_id}/').data['items'][0]
+        self.assertEqual(item, {'product': self.product.pk, 'quantity': 2, 'unit_price': '10.00'})
+
+    def test_product_names_are_unique(self):
+        with self.assertRaises(IntegrityError):
+            Product.objects.create(name=self.product.name, category=self.category, price=5.0)
+
+
+class OrderPaginationTestCase(APITestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Test Category')
+        product = Product.objects.create(name='Test Product', category=category, price=10.0)
+        for i in range(7):
+            order = Order.objects.create(customer_name=f'Customer {i}')
+            order.products.add(product)
+
+    def test_next_cursor_walks_all_orders(self):
+        url = reverse('order_list')
+        response = self.client.get(url, {'page_size': 3})
+        self.assertIsNone(response.data['previous'])
+
+        seen = []
+        while True:
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertLessEqual(len(response.data['results']), 3)
+            seen.extend(order['id'] for order in response.data['results'])
+            if response.data['next'] is None:
+                break
+            response = self.client.get(response.data['next'])
+
+        self.assertEqual(seen, list(Order.objects.order_by('order_date', 'id').values_list('id', flat=True)))
+
+    def test_previous_cursor_returns_prior_page(self):
+        url = reverse('order_list')
+        first = self.client.get(url, {'page_size': 3})
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual(back.data['results'], first.data['results'])
+
+    def test_page_size_follows_settings(self):
+        url = reverse('order_list')
+        with override_settings(ORDERS_PAGE_SIZE=2, ORDERS_MAX_PAGE_SIZE=5):
+            self.assertEqual(len(self.client.get(url).data['results']), 2)
+            self.assertEqual(len(self.client.get(url, {'page_size': 1000}).data['results']), 5)
+
+    def test_page_query_count_is_constant(self):
+        url = reverse('order_list')
+        # ETag freshness, orders page, then order lines with product and category names, or the products
+        # with their categories the serializers prefetch
+        for fast_reads in [True, False]:
+            for page_size in [2, 5]:
+                order_cache.cache.clear()
+                with override_settings(ORDERS_FAST_READS=fast_reads), self.assertNumQueries(3):
+                    self.client.get(url, {'page_size': page_size})
+
+    def test_invalid_cursor(self):
+        url = reverse('order_list')
+        response = self.client.get(url, {'cursor': 'garbage'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
 
 
 class SignalTests(TestCase):
@@ -79,13 +237,13 @@ class SignalTests(TestCase):
         self.order.products.add(self.product1, self.product2)
 
     def test_update_order_total_amount_signal(self):
-        m2m_changed.connect(update_order_total_amount, sender=Order.products.through)
+        m2m_changed.connect(update_order_counters, sender=Order.products.through)
         self.order.products.add(Product.objects.create(name='New Product', category=self.category, price=15.00))
         self.order.refresh_from_db()
-        self.assertEqual(self.order.total_amount, self.order.products.count())
+        self.assertEqual(self.order.total_amount, 45)
 
     def test_update_product_sold_items_count_signal(self):
-        m2m_changed.connect(update_product_sold_items_count, sender=Order.products.through)
+        m2m_changed.connect(update_order_counters, sender=Order.products.through)
         initial_count_product1 = self.product1.sold_items_count
         initial_count_product2 = self.product2.sold_items_count
 
@@ -99,7 +257,7 @@ class SignalTests(TestCase):
         self.assertEqual(self.product2.sold_items_count, initial_count_product2 + 1)
 
     def test_update_product_sold_items_count_on_order_delete_signal(self):
-        pre_delete.connect(update_product_sold_items_count_on_order_delete, sender=Order)
+        pre_delete.connect(update_counters_on_order_delete, sender=Order)
         self.product1.sold_items_count = 1
         self.product2.sold_items_count = 1
 
@@ -109,4 +267,1357 @@ class SignalTests(TestCase):
         self.product2.refresh_from_db()
 
         self.assertEqual(self.product1.sold_items_count, 0)
-        self.assertEqual(self.product2.sold_items_count, 0)
\ No newline at end of file
+        self.assertEqual(self.product2.sold_items_count, 0)
+
+    def test_remove_and_clear_signal(self):
+        self.order.products.remove(self.product1, Product.objects.create(name='Unlinked', category=self.category,
+                                                                         price=1.00))
+        self.product1.refresh_from_db()
+        self.assertEqual(self.product1.sold_items_count, 0)
+
+        self.order.products.clear()
+        self.product2.refresh_from_db()
+        self.order.refresh_from_db()
+        self.assertEqual(self.product2.sold_items_count, 0)
+        self.assertEqual(self.order.total_amount, 0)
+
+    def test_reverse_add_signal(self):
+        other = Order.objects.create(customer_name='Jane Doe')
+        self.product1.order_set.add(other)
+        self.product1.refresh_from_db()
+        other.refresh_from_db()
+        self.assertEqual(self.product1.sold_items_count, 2)
+        self.assertEqual(other.total_amount, 10)
+
+    def test_add_with_quantity(self):
+        other = Order.objects.create(customer_name='Jane Doe')
+        other.products.add(self.product2, through_defaults={'quantity': 3})
+        other.refresh_from_db()
+        self.product2.refresh_from_db()
+        self.assertEqual(other.total_amount, 60)
+        self.assertEqual(self.product2.sold_items_count, 4)
+        self.assertEqual(other.items.get().unit_price, 20)
+
+
+class CounterViewTests(APITestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Test Category')
+        self.product1 = Product.objects.create(name='Product 1', category=self.category, price=10.00)
+        self.product2 = Product.objects.create(name='Product 2', category=self.category, price=20.00)
+        self.product3 = Product.objects.create(name='Product 3', category=self.category, price=30.00)
+
+    def sold_counts(self):
+        return list(Product.objects.order_by('id').values_list('sold_items_count', flat=True))
+
+    def test_create_update_delete_keep_counters(self):
+        response = self.client.post('/api/v1/orders/', {'customer_name': 'A', 'products': ['Product 1', 'Product 2']},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(float(response.data['total_amount']), 30)
+        self.assertEqual(self.sold_counts(), [1, 1, 0])
+
+        order_id = response.data['id']
+        response = self.client.put(f'/api/v1/orders/{order_id}/', {'products': ['Product 2', 'Product 3']},
+                                   format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.sold_counts(), [0, 1, 1])
+        self.assertEqual(Order.objects.get(id=order_id).total_amount, 50)
+
+        response = self.client.put(f'/api/v1/orders/{order_id}/',
+                                   {'products': [{'name': 'Product 2', 'quantity': 5}, 'Product 3']}, format='json')
+        self.assertEqual(self.sold_counts(), [0, 5, 1])
+        self.assertEqual(Order.objects.get(id=order_id).total_amount, 130)
+
+        response = self.client.delete(f'/api/v1/orders/{order_id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+        self.assertEqual(self.sold_counts(), [0, 0, 0])
+
+    def test_update_touches_only_changed_products(self):
+        order = Order.objects.create(customer_name='A')
+        order.products.add(self.product1, self.product2)
+        # order, products, order row lock, current lines, delete removed, price of added,
+        # insert added, one UPDATE of the sold counters, rollups (categories, insert missing rows,
+        # one UPDATE), order total, refresh
+        with self.assertNumQueries(13):
+            self.client.put(f'/api/v1/orders/{order.id}/', {'products': ['Product 1', 'Product 3']}, format='json')
+
+    def test_patch_add_and_remove(self):
+        order = Order.objects.create(customer_name='A')
+        order.products.add(self.product1, self.product2)
+        url = f'/api/v1/orders/{order.id}/'
+
+        response = self.client.patch(url, {'add': ['Product 3', 'Product 1'], 'remove': ['Product 2']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(float(response.data['total_amount']), 50)
+        self.assertEqual(dict(order.items.values_list('product__name', 'quantity')), {'Product 1': 2, 'Product 3': 1})
+        self.assertEqual(self.sold_counts(), [2, 0, 1])
+
+        response = self.client.patch(url, {'remove': [{'name': 'Product 1', 'quantity': 5}]}, format='json')
+        self.assertEqual(float(response.data['total_amount']), 30)
+        self.assertEqual(self.sold_counts(), [0, 0, 1])
+
+        # removing a product that is not in the order writes nothing:
+        # order, order row lock, lines of the named products (names are cached)
+        with self.assertNumQueries(3):
+            self.client.patch(url, {'remove': ['Product 2']}, format='json')
+        self.assertEqual(self.sold_counts(), [0, 0, 1])
+
+    def test_patch_rejects_conflicting_and_unknown_products(self):
+        order = Order.objects.create(customer_name='A')
+        url = f'/api/v1/orders/{order.id}/'
+        response = self.client.patch(url, {'add': ['Product 1'], 'remove': ['Product 1']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        response = self.client.patch(url, {'add': ['Missing']}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class BulkOrderCreateTests(APITestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Test Category')
+        self.product1 = Product.objects.create(name='Product 1', category=self.category, price=10.00)
+        self.product2 = Product.objects.create(name='Product 2', category=self.category, price=20.00)
+        self.url = reverse('order_bulk')
+
+    def test_bulk_create(self):
+        data = [{'customer_name': f'Customer {i}', 'products': ['Product 1', 'Product 2']} for i in range(20)]
+        # products, prices, orders insert, lines insert, one counter UPDATE,
+        # rollups: categories, insert missing rows, one UPDATE
+        with self.assertNumQueries(8):
+            response = self.client.post(self.url, data, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Order.objects.count(), 20)
+        self.assertEqual([result['order']['customer_name'] for result in response.data['results']],
+                         [item['customer_name'] for item in data])
+        self.assertEqual(float(response.data['results'][0]['order']['total_amount']), 30)
+        self.product1.refresh_from_db()
+        self.assertEqual(self.product1.sold_items_count, 20)
+
+    def test_invalid_item_rejects_batch(self):
+        data = [{'customer_name': 'A', 'products': ['Product 1']}, {'customer_name': 'B', 'products': ['Missing']}]
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(response.data['errors'][0]['index'], 1)
+        self.assertEqual(Order.objects.count(), 0)
+
+    def test_partial_creates_valid_items(self):
+        data = [{'customer_name': 'A', 'products': ['Product 1']}, {'customer_name': 'B', 'products': ['Missing']},
+                {'products': ['Product 2']}]
+        response = self.client.post(f'{self.url}?partial=true', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([result['status'] for result in response.data['results']], [201, 400, 400])
+        self.assertEqual(list(Order.objects.values_list('customer_name', flat=True)), ['A'])
+
+    def test_oversized_item_is_reported_by_index(self):
+        Product.objects.create(name='Yacht', category=self.category, price='60000000.00')
+        data = [{'customer_name': 'A', 'products': ['Product 1']},
+                {'customer_name': 'B', 'products': ['Yacht', 'Yacht']}]
+        response = self.client.post(self.url, data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual([error['index'] for error in response.data['errors']], [1])
+        self.assertFalse(Order.objects.exists())
+
+        response = self.client.post(f'{self.url}?partial=true', data, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual([result['status'] for result in response.data['results']], [201, 400])
+        self.assertIn('99999999.99', response.data['results'][1]['error'])
+        self.assertEqual(list(Order.objects.values_list('customer_name', 'total_amount')), [('A', Decimal('10.00'))])
+
+
+class ProductNameResolverTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Test Category')
+        self.product = Product.objects.create(name='Product 1', category=self.category, price=10.00)
+        self.resolver = ProductNameResolver(maxsize=2, ttl=60)
+
+    def test_hits_skip_the_catalog_query(self):
+        self.assertEqual(self.resolver.resolve(['Product 1', 'Missing']), {'Product 1': self.product.id})
+        with self.assertNumQueries(0):
+            self.assertEqual(self.resolver.resolve(['Product 1']), {'Product 1': self.product.id})
+        self.assertEqual(self.resolver.stats()['hits'], 1)
+        self.assertEqual(self.resolver.stats()['misses'], 2)
+
+    def test_lru_is_bounded(self):
+        for i in range(3):
+            Product.objects.create(name=f'Extra {i}', category=self.category, price=1.00)
+            self.resolver.resolve([f'Extra {i}'])
+        self.assertEqual(self.resolver.stats()['size'], 2)
+
+    def test_product_change_invalidates(self):
+        self.assertEqual(product_resolver.resolve(['Product 1']), {'Product 1': self.product.id})
+        self.product.name = 'Renamed'
+        self.product.save()
+        self.assertEqual(product_resolver.resolve(['Product 1']), {})
+        self.assertEqual(product_resolver.resolve(['Renamed']), {'Renamed': self.product.id})
+
+    def test_shared_generation_invalidates_other_workers(self):
+        other = ProductNameResolver(shared=True)
+        self.resolver.shared = True
+        self.resolver.resolve(['Product 1'])
+        with self.assertNumQueries(0):
+            other.resolve(['Product 1'])
+        other.invalidate()
+        with self.assertNumQueries(1):
+            self.resolver.resolve(['Product 1'])
+
+    def test_metrics_endpoint(self):
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('hits', response.json()['product_resolver'])
+
+
+class OrderResponseCacheTests(APITestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Test Category')
+        self.product1 = Product.objects.create(name='Product 1', category=self.category, price=10.00)
+        self.product2 = Product.objects.create(name='Product 2', category=self.category, price=20.00)
+        self.order = Order.objects.create(customer_name='A')
+        self.order.products.add(self.product1)
+        self.url = f'/api/v1/orders/{self.order.id}/'
+
+    def test_detail_hit_skips_database(self):
+        first = self.client.get(self.url)
+        # only the ETag freshness query
+        with self.assertNumQueries(1):
+            second = self.client.get(self.url)
+        self.assertEqual(first.data, second.data)
+
+    def test_detail_invalidated_by_product_and_category_changes(self):
+        self.client.get(self.url)
+        self.product1.name = 'Renamed'
+        self.product1.save()
+        self.assertEqual(self.client.get(self.url).data['products'][0]['name'], 'Renamed')
+
+        self.category.name = 'Renamed Category'
+        self.category.save()
+        self.assertEqual(self.client.get(self.url).data['products'][0]['category']['name'], 'Renamed Category')
+
+    def test_detail_invalidated_by_order_writes(self):
+        self.client.get(self.url)
+        self.client.put(self.url, {'products': ['Product 2']}, format='json')
+        self.assertEqual([product['name'] for product in self.client.get(self.url).data['products']], ['Product 2'])
+
+        # Another order buying the same product changes its sold_items_count.
+        self.client.post('/api/v1/orders/', {'customer_name': 'B', 'products': ['Product 2']}, format='json')
+        self.assertEqual(self.client.get(self.url).data['products'][0]['sold_items_count'], 2)
+
+        self.client.delete(self.url)
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_list_invalidated_by_new_order(self):
+        url = reverse('order_list')
+        self.client.get(url)
+        # only the ETag freshness query
+        with self.assertNumQueries(1):
+            self.client.get(url)
+        Order.objects.create(customer_name='B')
+        self.assertEqual(len(self.client.get(url).data['results']), 2)
+
+
+class ConditionalGetTests(APITestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Test Category')
+        self.product = Product.objects.create(name='Product 1', category=self.category, price=10.00)
+        self.order = Order.objects.create(customer_name='A')
+        self.order.products.add(self.product)
+        self.url = f'/api/v1/orders/{self.order.id}/'
+
+    def test_detail_not_modified(self):
+        response = self.client.get(self.url)
+        etag = response['ETag']
+        self.assertIn('Last-Modified', response)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(response['ETag'], etag)
+
+        response = self.client.get(self.url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+    def test_etag_changes_with_payload(self):
+        etag = self.client.get(self.url)['ETag']
+
+        self.category.name = 'Renamed'
+        self.category.save()
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        # sold_items_count is part of the detail payload
+        other = Order.objects.create(customer_name='B')
+        other.products.add(self.product)
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        etag = response['ETag']
+
+        # an update that leaves the product set as it is writes nothing
+        self.client.put(self.url, {'products': ['Product 1']}, format='json')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        Product.objects.create(name='Product 2', category=self.category, price=20.00)
+        self.client.put(self.url, {'products': ['Product 1', 'Product 2']}, format='json')
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_list_not_modified(self):
+        url = reverse('order_list')
+        etag = self.client.get(url)['ETag']
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_304_NOT_MODIFIED)
+
+        self.client.post(url, {'customer_name': 'B', 'products': ['Product 1']}, format='json')
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=etag).status_code, status.HTTP_200_OK)
+
+
+class OrderExportTests(APITestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Test Category')
+        product = Product.objects.create(name='Product 1', category=category, price=10.00)
+        for day in [1, 2, 3]:
+            order = Order.objects.create(customer_name=f'Customer {day}')
+            order.products.add(product)
+            Order.objects.filter(pk=order.pk).update(order_date=date(2024, 1, day))
+        self.url = reverse('order_export')
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+
+    def test_admin_only(self):
+        self.client.force_login(User.objects.create_user('user'))
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+        self.client.logout()
+        self.assertEqual(self.client.get(self.url).status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_ndjson_export(self):
+        response = self.client.get(self.url, {'from': '2024-01-02', 'to': '2024-01-03'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['customer_name'] for row in rows], ['Customer 2', 'Customer 3'])
+        self.assertEqual(rows[0]['products'], [{'name': 'Product 1', 'category': {'name': 'Test Category'},
+                                                'quantity': 1, 'unit_price': '10.00'}])
+
+    def test_csv_export(self):
+        response = self.client.get(self.url, {'output': 'csv'})
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(lines[0], 'id,customer_name,order_date,total_amount,products,categories,quantities')
+        self.assertEqual(len(lines), 4)
+
+    def test_invalid_parameters(self):
+        self.assertEqual(self.client.get(self.url, {'from': 'yesterday'}).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(self.url, {'output': 'xml'}).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_management_command(self):
+        out = StringIO()
+        call_command('export_orders', '--from', '2024-01-03', stdout=out, stderr=StringIO())
+        self.assertEqual(json.loads(out.getvalue())['customer_name'], 'Customer 3')
+
+
+class ProjectionEquivalenceTests(TestCase):
+    def setUp(self):
+        cloth = Category.objects.create(name='cloth')
+        shoes = Category.objects.create(name='shoes')
+        products = [Product.objects.create(name=f'Product {i}', category=[cloth, shoes][i % 2], price=f'{i}.5')
+                    for i in range(5)]
+        Order.objects.create(customer_name='Empty')
+        for i in range(4):
+            order = Order.objects.create(customer_name=f'Customer {i}')
+            order.products.add(*products[i:i + 3])
+
+    @staticmethod
+    def normalized(payload):
+        payload = json.loads(json.dumps(payload))
+        for order in payload:
+            order['products'].sort(key=lambda product: product['name'])
+        return payload
+
+    def test_list_matches_serializer(self):
+        orders = Order.objects.order_by('id')
+        expected = OrderListSerializer(orders.prefetch_related('products__category'), many=True).data
+        actual = order_list(list(orders.values(*LIST_FIELDS)))
+        self.assertEqual(self.normalized(actual), self.normalized(expected))
+
+    def test_detail_matches_serializer(self):
+        for order in Order.objects.prefetch_related('products__category'):
+            data, products = order_detail(order.pk)
+            self.assertEqual(self.normalized([data]), self.normalized([OrderSerializer(order).data]))
+            self.assertEqual(sorted(products), sorted((p.pk, p.category_id) for p in order.products.all()))
+
+    def test_views_match_with_fast_reads_off(self):
+        # Lines added in reverse product order: both paths list products and lines in line order.
+        products = list(Product.objects.order_by('-id')[:3])
+        order = Order.objects.create(customer_name='Reversed')
+        for product in products:
+            order.products.add(product)
+        for path in [f'/api/v1/orders/{order.pk}/', '/api/v1/orders/']:
+            order_cache.cache.clear()
+            fast = self.client.get(path).json()
+            order_cache.cache.clear()
+            with self.settings(ORDERS_FAST_READS=False):
+                slow = self.client.get(path).json()
+            self.assertEqual(fast, slow, path)
+        reversed_order, = [result for result in fast['results'] if result['id'] == order.pk]
+        self.assertEqual([product['name'] for product in reversed_order['products']],
+                         [product.name for product in products])
+
+
+class SparseFieldsetTests(APITestCase):
+    queries = [
+        'fields=id,customer_name',
+        'fields=id,products.name,products.category.name',
+        'fields=products.category&expand=products',
+        'expand=',
+        'fields=id,products&expand=products',
+        'fields=',
+    ]
+
+    def setUp(self):
+        cloth = Category.objects.create(name='cloth')
+        shoes = Category.objects.create(name='shoes')
+        products = [Product.objects.create(name=f'Product {i}', category=[cloth, shoes][i % 2], price=f'{i}.5')
+                    for i in range(5)]
+        for i in range(4):
+            order = Order.objects.create(customer_name=f'Customer {i}')
+            order.products.add(*products[i:i + 3])
+        self.order = order.pk
+
+    def get(self, path, asynchronous=False):
+        order_cache.cache.clear()
+        with override_settings(ROOT_URLCONF=api_urlconf(asynchronous)):
+            if asynchronous:
+                async def send():
+                    return await self.async_client.get(path)
+                response = async_to_sync(send)()
+            else:
+                response = self.client.get(path)
+        self.assertEqual(response.status_code, status.HTTP_200_OK, path)
+        return response.json()
+
+    def test_read_paths_agree(self):
+        paths = [f'/api/v1/orders/{self.order}/?fields=products,items.quantity&expand=products']
+        for query in self.queries:
+            paths += [f'/api/v1/orders/?{query}', f'/api/v1/orders/{self.order}/?{query}']
+        for path in paths:
+            fast = self.get(path)
+            self.assertEqual(self.get(path, asynchronous=True), fast, path)
+            with override_settings(ORDERS_FAST_READS=False):
+                self.assertEqual(self.get(path), fast, path)
+
+    def test_sparse_payloads(self):
+        order = Order.objects.get(pk=self.order)
+        product_ids = sorted(order.products.values_list('pk', flat=True))
+        self.assertEqual(self.get(f'/api/v1/orders/{self.order}/?fields=id,customer_name'),
+                         {'id': self.order, 'customer_name': 'Customer 3'})
+        self.assertEqual(self.get(f'/api/v1/orders/{self.order}/?fields=products&expand=')['products'], product_ids)
+        product = self.get(f'/api/v1/orders/{self.order}/?fields=products.name,products.category&'
+                           f'expand=products')['products'][0]
+        self.assertEqual(set(product), {'name', 'category'})
+        self.assertIsInstance(product['category'], int)
+        page = self.get('/api/v1/orders/?fields=customer_name,products.category.name&page_size=2')
+        self.assertEqual(page['results'][0], {'customer_name': 'Customer 0',
+                                              'products': [{'category': {'name': 'cloth'}},
+                                                           {'category': {'name': 'shoes'}},
+                                                           {'category': {'name': 'cloth'}}]})
+        self.assertIsNotNone(page['next'])
+
+        for query in ['fields=price', 'fields=id.name', 'expand=items', 'expand=category']:
+            response = self.client.get(f'/api/v1/orders/{self.order}/?{query}')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+            self.assertIn('error', response.json())
+
+    def test_queries_follow_fieldset(self):
+        def sql(path):
+            order_cache.cache.clear()
+            with CaptureQueriesContext(connection) as captured:
+                self.assertEqual(self.client.get(path).status_code, status.HTTP_200_OK)
+            return ' '.join(query['sql'] for query in captured)
+
+        for fast_reads in [True, False]:
+            with override_settings(ORDERS_FAST_READS=fast_reads):
+                narrow = sql(f'/api/v1/orders/{self.order}/?fields=id,customer_name')
+                self.assertNotIn('shop_product', narrow)
+                self.assertNotIn('total_amount', narrow.split('FROM')[0] if fast_reads else narrow)
+                names = sql(f'/api/v1/orders/{self.order}/?fields=products.name&expand=products')
+                self.assertNotIn('shop_category', names)
+                self.assertNotIn('"price"', names)
+                self.assertNotIn('sold_items_count', names)
+                self.assertIn('shop_category', sql(f'/api/v1/orders/{self.order}/'))
+                self.assertNotIn('shop_category', sql('/api/v1/orders/?expand=products'))
+
+    def test_variants_are_cached_and_tagged_apart(self):
+        full = self.client.get(f'/api/v1/orders/{self.order}/')
+        sparse = self.client.get(f'/api/v1/orders/{self.order}/?fields=id')
+        self.assertEqual(sparse.json(), {'id': self.order})
+        self.assertIn('products', self.client.get(f'/api/v1/orders/{self.order}/').json())
+        self.assertNotEqual(sparse['ETag'], full['ETag'])
+        self.assertEqual(self.client.get(f'/api/v1/orders/{self.order}/?fields=id',
+                                         HTTP_IF_NONE_MATCH=sparse['ETag']).status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+class OrderListFilterTests(APITestCase):
+    filters = {
+        'customer_name': 'customer_name=Alice',
+        'customer_name_prefix': 'customer_name_prefix=Al',
+        'dates': 'from=2024-01-02&to=2024-01-03',
+        'product': 'product={product}',
+        'category': 'category={category}',
+    }
+
+    def setUp(self):
+        cloth = Category.objects.create(name='cloth')
+        shoes = Category.objects.create(name='shoes')
+        self.shirt = Product.objects.create(name='Shirt', category=cloth, price='10.00')
+        self.boots = Product.objects.create(name='Boots', category=shoes, price='50.00')
+        self.orders = {}
+        for name, day, products in [('Alice', 1, [self.shirt]), ('Alice', 2, [self.shirt, self.boots]),
+                                    ('Alan', 3, [self.boots]), ('alex', 2, [self.shirt]), ('Bob', 3, [self.shirt]),
+                                    ('Ann Lee', 1, []), ('Annabel', 1, []), ("O'Brien", 1, []), ('Obi', 1, [])]:
+            order = Order.objects.create(customer_name=name)
+            order.products.add(*products)
+            Order.objects.filter(pk=order.pk).update(order_date=date(2024, 1, day))
+            self.orders.setdefault(name, []).append(order.pk)
+        self.category = cloth.pk
+
+    def ids(self, query, asynchronous=False):
+        order_cache.cache.clear()
+        with override_settings(ROOT_URLCONF=api_urlconf(asynchronous)):
+            if asynchronous:
+                async def send():
+                    return await self.async_client.get(f'/api/v1/orders/?{query}')
+                response = async_to_sync(send)()
+            else:
+                response = self.client.get(f'/api/v1/orders/?{query}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK, query)
+        return sorted(order['id'] for order in response.json()['results'])
+
+    def test_filters(self):
+        alice, alan, alex, bob = (self.orders[name] for name in ['Alice', 'Alan', 'alex', 'Bob'])
+        expected = {
+            'customer_name=Alice': alice,
+            # Case-insensitive on every backend.
+            'customer_name_prefix=Al': alice + alan + alex,
+            'customer_name_prefix=aL': alice + alan + alex,
+            'customer_name_prefix=ALI': alice,
+            'customer_name_prefix=Ann+': self.orders['Ann Lee'],
+            "customer_name_prefix=O'": self.orders["O'Brien"],
+            'from=2024-01-02&to=2024-01-03': [alice[1], *alan, *alex, *bob],
+            'from=2024-01-03': alan + bob,
+            f'product={self.boots.pk}': [alice[1], *alan],
+            f'category={self.category}': [*alice, *alex, *bob],
+            f'customer_name_prefix=Ali&to=2024-01-02&product={self.shirt.pk}': alice,
+            f'customer_name=Bob&category={self.boots.category_id}': [],
+        }
+        for query, ids in expected.items():
+            self.assertEqual(self.ids(query), sorted(ids), query)
+            self.assertEqual(self.ids(query, asynchronous=True), sorted(ids), query)
+            with override_settings(ORDERS_FAST_READS=False):
+                self.assertEqual(self.ids(query), sorted(ids), query)
+
+    def test_invalid_filters(self):
+        for query in ['from=yesterday', 'to=2024-13-01', 'product=shirt', 'category=']:
+            response = self.client.get(f'/api/v1/orders/?{query}')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+            self.assertIn('error', response.json())
+
+    def test_every_combination_uses_indexes(self):
+        """EXPLAIN every query of the list, for every combination of filters: none may scan a whole table."""
+        names = list(self.filters)
+        for n in range(len(names) + 1):
+            for combination in itertools.combinations(names, n):
+                query = '&'.join(self.filters[name] for name in combination).format(
+                    product=self.shirt.pk, category=self.category)
+                order_cache.cache.clear()
+                with CaptureQueriesContext(connection) as captured:
+                    self.assertEqual(self.client.get(f'/api/v1/orders/?{query}').status_code, status.HTTP_200_OK)
+                for sql in [query['sql'] for query in captured if query['sql'].startswith('SELECT')]:
+                    self.assertUsesIndexes(sql, combination)
+
+    def assertUsesIndexes(self, sql, combination):
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # On tables this small the planner would rightly prefer scanning them.
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute(f'EXPLAIN {sql}')
+                plan = [row[0] for row in cursor.fetchall()]
+                scans = [line for line in plan if 'Seq Scan' in line]
+            else:
+                cursor.execute(f'EXPLAIN QUERY PLAN {sql}')
+                plan = [row[-1] for row in cursor.fetchall()]
+                # SCAN reads a whole table or index; only the unfiltered list may, walking
+                # the (order_date, id) index in page order up to the page size.
+                page_order = [index.name for index in Order._meta.indexes if index.fields == ['order_date', 'id']]
+                scans = [line for line in plan if line.startswith('SCAN')
+                         and (combination or not any(name in line for name in page_order))]
+        self.assertEqual(scans, [], f'{combination}: {sql}\n' + '\n'.join(plan))
+
+
+@skipUnless(renderers.load_engine('auto'), 'orjson is not installed')
+class FastJSONTests(TestCase):
+    data = {
+        'price': Decimal('10.50'),
+        'order_date': date(2024, 1, 2),
+        'created_at': datetime(2024, 1, 2, 3, 4, 5, 6000, tzinfo=dt_timezone.utc),
+        'label': gettext_lazy('Invalid cursor'),
+        'text': 'Заказ\u2028\u2029',
+        'products': [{'id': 1, 'name': 'T-shirt'}],
+    }
+
+    def test_engines_render_identically(self):
+        fast = renderers.FastJSONRenderer()
+        stdlib = renderers.FastJSONRenderer()
+        stdlib.engine = None
+        self.assertEqual(fast.render(self.data), stdlib.render(self.data))
+
+    def test_indent_falls_back_to_stdlib(self):
+        rendered = renderers.FastJSONRenderer().render(self.data, 'application/json; indent=2')
+        self.assertIn(b'\n  "price"', rendered)
+
+    def test_parser(self):
+        parser = FastJSONParser()
+        self.assertEqual(parser.parse(BytesIO('{"name": "Заказ", "n": 1.5}'.encode())), {'name': 'Заказ', 'n': 1.5})
+        with self.assertRaises(ParseError):
+            parser.parse(BytesIO(b'{"n": NaN}'))
+
+
+@override_settings(SOLD_ITEMS_DEFERRED=True)
+class SoldItemsOutboxTests(APITestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Test Category')
+        self.product1 = Product.objects.create(name='Product 1', category=self.category, price=10.00)
+        self.product2 = Product.objects.create(name='Product 2', category=self.category, price=20.00)
+
+    def sold_counts(self):
+        return list(Product.objects.order_by('id').values_list('sold_items_count', flat=True))
+
+    def test_order_writes_leave_products_untouched_until_flush(self):
+        versions = list(Product.objects.order_by('id').values_list('version', flat=True))
+        for quantity in [1, 2, 3]:
+            response = self.client.post('/api/v1/orders/', {'customer_name': 'A', 'products': [
+                {'name': 'Product 1', 'quantity': quantity}, 'Product 2']}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.client.delete(f"/api/v1/orders/{response.data['id']}/")
+
+        self.assertEqual(self.sold_counts(), [0, 0])
+        self.assertEqual(list(Product.objects.order_by('id').values_list('version', flat=True)), versions)
+        self.assertEqual(SoldItemsDelta.objects.count(), 8)
+
+        # lock batch, merged deltas, one UPDATE of the sold counters, three for the rollups, delete batch
+        with self.assertNumQueries(7):
+            self.assertEqual(outbox.flush(), 8)
+        self.assertEqual(self.sold_counts(), [3, 2])
+        self.assertFalse(SoldItemsDelta.objects.exists())
+        self.assertEqual(outbox.flush(), 0)
+
+    def test_flush_in_batches(self):
+        for _ in range(5):
+            self.client.post('/api/v1/orders/', {'customer_name': 'A', 'products': ['Product 1']}, format='json')
+        self.assertEqual(outbox.flush(batch_size=2), 5)
+        self.assertEqual(self.sold_counts(), [5, 0])
+
+    def test_stats_and_command(self):
+        self.client.post('/api/v1/orders/', {'customer_name': 'A', 'products': ['Product 2']}, format='json')
+        stats = outbox.stats()
+        self.assertEqual((stats['deferred'], stats['pending'], stats['stale']), (True, 1, False))
+
+        call_command('flush_sold_items', once=True, stderr=StringIO())
+        self.assertEqual(self.sold_counts(), [0, 1])
+        self.assertEqual(outbox.stats()['pending'], 0)
+
+
+class IdempotencyKeyTests(APITestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Test Category')
+        self.product = Product.objects.create(name='Product 1', category=category, price=10.00)
+        self.data = {'customer_name': 'A', 'products': ['Product 1']}
+
+    def post(self, data, key='key-1'):
+        return self.client.post('/api/v1/orders/', data, format='json', HTTP_IDEMPOTENCY_KEY=key)
+
+    def test_retry_replays_first_response(self):
+        first = self.post(self.data)
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+
+        # one indexed lookup; orders, lines and products are not touched
+        with self.assertNumQueries(1):
+            retry = self.post(self.data)
+        self.assertEqual(retry.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 1)
+        self.product.refresh_from_db()
+        self.assertEqual(self.product.sold_items_count, 1)
+
+        self.assertEqual(self.post(self.data, key='key-2').status_code, status.HTTP_201_CREATED)
+        self.assertEqual(Order.objects.count(), 2)
+
+    def test_key_reused_with_another_body(self):
+        self.post(self.data)
+        response = self.post({'customer_name': 'B', 'products': ['Product 1']})
+        self.assertEqual(response.status_code, status.HTTP_422_UNPROCESSABLE_ENTITY)
+        self.assertEqual(Order.objects.count(), 1)
+
+    def test_failed_request_does_not_claim_key(self):
+        self.assertEqual(self.post({'customer_name': 'A', 'products': ['Missing']}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(IdempotencyKey.objects.exists())
+        self.assertEqual(self.post(self.data).status_code, status.HTTP_201_CREATED)
+
+    def test_expired_key_is_reused(self):
+        self.post(self.data)
+        with override_settings(IDEMPOTENCY_KEY_TTL=0):
+            self.assertNotIn('Idempotent-Replayed', self.post(self.data))
+        self.assertEqual(Order.objects.count(), 2)
+
+        with override_settings(IDEMPOTENCY_KEY_TTL=0):
+            call_command('purge_idempotency_keys', stderr=StringIO())
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+    def test_keys_are_scoped_to_the_client(self):
+        first = self.post(self.data)
+        self.client.force_login(User.objects.create_user('alice'))
+        alice = self.post(self.data)
+        self.assertNotIn('Idempotent-Replayed', alice)
+        self.assertNotEqual(alice.json()['id'], first.json()['id'])
+        self.assertEqual(self.post(self.data).json(), alice.json())
+
+        self.client.force_login(User.objects.create_user('bob'))
+        self.assertNotIn('Idempotent-Replayed', self.post(self.data))
+        self.client.logout()
+        other_address = self.client.post('/api/v1/orders/', self.data, format='json', HTTP_IDEMPOTENCY_KEY='key-1',
+                                         REMOTE_ADDR='10.0.0.2')
+        self.assertNotIn('Idempotent-Replayed', other_address)
+        self.assertEqual(self.post(self.data)['Idempotent-Replayed'], 'true')
+        self.assertEqual(Order.objects.count(), 4)
+
+    def test_concurrent_duplicate_replays_winner(self):
+        first = self.post(self.data)
+        # The duplicate misses the stored key as if the winner had not yet
+        # committed, then hits the unique constraint and replays it.
+        with patch.object(idempotency, '_lookup', side_effect=[None, IdempotencyKey.objects.get()]):
+            retry = self.post(self.data)
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(Order.objects.count(), 1)
+
+
+class SalesRollupTests(APITestCase):
+    def setUp(self):
+        self.shoes = Category.objects.create(name='Shoes')
+        self.hats = Category.objects.create(name='Hats')
+        self.boots = Product.objects.create(name='Boots', category=self.shoes, price=100.00)
+        self.sandals = Product.objects.create(name='Sandals', category=self.shoes, price=30.00)
+        self.cap = Product.objects.create(name='Cap', category=self.hats, price=15.00)
+
+    def post(self, *products):
+        return self.client.post('/api/v1/orders/', {'customer_name': 'A', 'products': list(products)}, format='json')
+
+    def rollup_rows(self):
+        return sorted(DailySales.objects.values_list('order_date', 'category_id', 'product_id', 'quantity', 'revenue'))
+
+    def assertMatchesRebuild(self):
+        incremental = [row for row in self.rollup_rows() if row[3] or row[4]]
+        rollups.rebuild()
+        self.assertEqual(incremental, self.rollup_rows())
+
+    def test_incremental_rollups_match_rebuild(self):
+        first = self.post({'name': 'Boots', 'quantity': 2}, 'Cap').data['id']
+        second = self.post('Sandals', 'Cap', 'Cap').data['id']
+        self.client.put(f'/api/v1/orders/{first}/', {'products': ['Boots', 'Sandals']}, format='json')
+        self.client.patch(f'/api/v1/orders/{second}/', {'add': ['Boots'], 'remove': ['Cap']}, format='json')
+        order = Order.objects.get(pk=second)
+        order.products.add(self.boots, through_defaults={'quantity': 4})
+        self.assertMatchesRebuild()
+
+        self.client.delete(f'/api/v1/orders/{first}/')
+        self.assertMatchesRebuild()
+        boots = DailySales.objects.get(product=self.boots)
+        self.assertEqual((boots.quantity, boots.revenue), (1, 100))
+
+    def test_stats_endpoints(self):
+        self.post({'name': 'Cap', 'quantity': 10}, 'Boots')
+        self.post('Sandals', 'Boots')
+
+        response = self.client.get(reverse('stats_top_products'), {'limit': 2})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([(row['product_name'], row['quantity']) for row in response.data['results']],
+                         [('Cap', 10), ('Boots', 2)])
+
+        response = self.client.get(reverse('stats_top_products'), {'by': 'revenue', 'category': self.shoes.pk})
+        self.assertEqual([(row['product_name'], row['revenue']) for row in response.data['results']],
+                         [('Boots', '200.00'), ('Sandals', '30.00')])
+
+        today = date.today().isoformat()
+        response = self.client.get(reverse('stats_daily'), {'group': 'category', 'from': today, 'to': today})
+        self.assertEqual(response.data['results'], [
+            {'order_date': today, 'category_id': self.shoes.pk, 'category_name': 'Shoes',
+             'quantity': 3, 'revenue': '230.00'},
+            {'order_date': today, 'category_id': self.hats.pk, 'category_name': 'Hats',
+             'quantity': 10, 'revenue': '150.00'},
+        ])
+        response = self.client.get(reverse('stats_daily'), {'product': self.boots.pk})
+        self.assertEqual(response.data['results'], [{'order_date': today, 'quantity': 2, 'revenue': '200.00'}])
+
+        # one aggregate query over the rollups, whatever the number of orders
+        with self.assertNumQueries(1):
+            self.client.get(reverse('stats_daily'), {'group': 'product'})
+
+        for params in [{'by': 'price'}, {'limit': 0}, {'from': 'today'}, {'category': 'shoes'}]:
+            self.assertEqual(self.client.get(reverse('stats_top_products'), params).status_code,
+                             status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(self.client.get(reverse('stats_daily'), {'group': 'week'}).status_code,
+                         status.HTTP_400_BAD_REQUEST)
+
+    def test_product_category_change_moves_rollups(self):
+        self.post('Cap')
+        self.cap.category = self.shoes
+        self.cap.save()
+        self.assertEqual(DailySales.objects.get(product=self.cap).category, self.shoes)
+
+    @override_settings(SOLD_ITEMS_DEFERRED=True)
+    def test_deferred_rollups(self):
+        order_id = self.post({'name': 'Boots', 'quantity': 3}).data['id']
+        self.client.patch(f'/api/v1/orders/{order_id}/', {'remove': ['Boots']}, format='json')
+        self.assertFalse(DailySales.objects.exists())
+
+        outbox.flush()
+        self.assertEqual(DailySales.objects.get().quantity, 2)
+        self.assertMatchesRebuild()
+
+    def test_rebuild_command(self):
+        self.post('Cap')
+        DailySales.objects.all().delete()
+        call_command('rebuild_sales_rollups', stderr=StringIO())
+        self.assertEqual(DailySales.objects.get().revenue, 15)
+
+    @override_settings(SOLD_ITEMS_DEFERRED=True)
+    def test_rebuild_command_flushes_in_its_transaction(self):
+        self.post({'name': 'Boots', 'quantity': 3})
+        with patch.object(rollups, 'rebuild', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                call_command('rebuild_sales_rollups', stderr=StringIO())
+        # The failed rebuild took the flush with it.
+        self.assertEqual(SoldItemsDelta.objects.count(), 1)
+        self.assertEqual(Product.objects.get(name='Boots').sold_items_count, 0)
+
+        call_command('rebuild_sales_rollups', stderr=StringIO())
+        self.assertFalse(SoldItemsDelta.objects.exists())
+        self.assertEqual(Product.objects.get(name='Boots').sold_items_count, 3)
+        self.assertEqual(DailySales.objects.get().quantity, 3)
+        self.assertMatchesRebuild()
+
+
+class PurgeOrdersTests(APITestCase):
+    def setUp(self):
+        call_command('generate_data', '--products', '6', '--orders', '60', '--days', '4', stderr=StringIO())
+
+    def assertCountersConsistent(self):
+        for product in Product.objects.all():
+            sold = sum(OrderItem.objects.filter(product=product).values_list('quantity', flat=True))
+            self.assertEqual(product.sold_items_count, sold)
+        rows = sorted(row for row in DailySales.objects.values_list('order_date', 'product_id', 'quantity', 'revenue')
+                      if row[2] or row[3])
+        rollups.rebuild()
+        self.assertEqual(rows, sorted(DailySales.objects.values_list('order_date', 'product_id', 'quantity',
+                                                                     'revenue')))
+
+    def test_purge_date_range(self):
+        day = Order.objects.order_by('order_date').values_list('order_date', flat=True)[30]
+        kept = Order.objects.exclude(order_date=day).count()
+        stderr = StringIO()
+        call_command('purge_orders', '--from', day.isoformat(), '--to', day.isoformat(), '--chunk-size', '4',
+                     stderr=stderr)
+
+        self.assertIn(f'Deleted {60 - kept} orders.', stderr.getvalue())
+        self.assertFalse(Order.objects.filter(order_date=day).exists())
+        self.assertEqual(Order.objects.count(), kept)
+        self.assertFalse(OrderItem.objects.exclude(order__in=Order.objects.all()).exists())
+        self.assertCountersConsistent()
+
+        with self.assertRaises(CommandError):
+            call_command('purge_orders', stderr=StringIO())
+
+    def test_queries_do_not_grow_with_orders(self):
+        ids = list(Order.objects.order_by('pk').values_list('pk', flat=True))
+        with CaptureQueriesContext(connection) as few:
+            self.assertEqual(counters.purge_orders(ids[:3]), 3)
+        with CaptureQueriesContext(connection) as many:
+            self.assertEqual(counters.purge_orders(ids[3:40]), 37)
+        self.assertEqual(len(few), len(many))
+        self.assertCountersConsistent()
+
+    def test_purge_endpoint(self):
+        ids = list(Order.objects.order_by('pk').values_list('pk', flat=True)[:5])
+        url = reverse('order_purge')
+        self.assertEqual(self.client.post(url, {'ids': ids}, format='json').status_code, status.HTTP_403_FORBIDDEN)
+
+        self.client.force_login(User.objects.create_superuser('admin', 'admin@example.com', 'password'))
+        for body in [[1], {}, {'ids': []}, {'ids': ['1']}, {'ids': ids, 'from': '2024-01-01'}, {'from': 'today'}]:
+            self.assertEqual(self.client.post(url, body, format='json').status_code, status.HTTP_400_BAD_REQUEST)
+        with override_settings(ORDERS_BULK_MAX_ITEMS=4):
+            self.assertEqual(self.client.post(url, {'ids': ids}, format='json').status_code,
+                             status.HTTP_400_BAD_REQUEST)
+
+        response = self.client.post(url, {'ids': ids + [10 ** 6]}, format='json')
+        self.assertEqual(response.data, {'deleted': 5})
+        last = Order.objects.order_by('-order_date').values_list('order_date', flat=True).first()
+        response = self.client.post(url, {'from': last.isoformat()}, format='json')
+        self.assertGreater(response.data['deleted'], 0)
+        self.assertEqual(Order.objects.count(), 60 - 5 - response.data['deleted'])
+        self.assertCountersConsistent()
+
+
+class ArchiveTests(APITestCase):
+    def setUp(self):
+        call_command('generate_data', '--products', '6', '--orders', '40', '--days', '6', stderr=StringIO())
+        self.before = sorted(Order.objects.values_list('order_date', flat=True))[20]
+        self.cold = list(Order.objects.filter(order_date__lt=self.before).order_by('pk').values_list('pk', flat=True))
+
+    def details(self, ids, asynchronous=False):
+        order_cache.cache.clear()
+        with override_settings(ROOT_URLCONF=api_urlconf(asynchronous)):
+            if asynchronous:
+                async def send(pk):
+                    return await self.async_client.get(f'/api/v1/orders/{pk}/')
+                responses = [async_to_sync(send)(pk) for pk in ids]
+            else:
+                responses = [self.client.get(f'/api/v1/orders/{pk}/') for pk in ids]
+        self.assertEqual({response.status_code for response in responses}, {status.HTTP_200_OK})
+        return [response.json() for response in responses]
+
+    def test_archive_cold_orders(self):
+        lines = OrderItem.objects.filter(order__in=self.cold).count()
+        sold = dict(Product.objects.values_list('pk', 'sold_items_count'))
+        sales = sorted(DailySales.objects.values_list('order_date', 'product_id', 'quantity', 'revenue'))
+        payloads = self.details(self.cold)
+
+        stderr = StringIO()
+        call_command('archive_orders', '--before', self.before.isoformat(), '--batch-size', '3', stderr=stderr)
+
+        self.assertIn(f'Archived {len(self.cold)} orders', stderr.getvalue())
+        self.assertFalse(Order.objects.filter(order_date__lt=self.before).exists())
+        self.assertEqual(Order.objects.count(), 40 - len(self.cold))
+        self.assertEqual(sorted(ArchivedOrder.objects.values_list('pk', flat=True)), self.cold)
+        self.assertEqual(ArchivedOrderItem.objects.count(), lines)
+        self.assertFalse(ArchivedOrderItem.objects.exclude(order_date=F('order__order_date')).exists())
+        self.assertFalse(OrderItem.objects.filter(order_id__in=self.cold).exists())
+        self.assertEqual(dict(Product.objects.values_list('pk', 'sold_items_count')), sold)
+        self.assertEqual(sorted(DailySales.objects.values_list('order_date', 'product_id', 'quantity', 'revenue')),
+                         sales)
+
+        for fast_reads in [True, False]:
+            with override_settings(ORDERS_FAST_READS=fast_reads):
+                self.assertEqual(self.details(self.cold), payloads)
+        self.assertEqual(self.details(self.cold, asynchronous=True), payloads)
+        self.assertEqual(archive.archive_orders(self.before), 0)
+
+    def test_archived_orders_are_read_only(self):
+        archive.archive_orders(self.before)
+        pk = self.cold[0]
+        for asynchronous in [False, True]:
+            with override_settings(ROOT_URLCONF=api_urlconf(asynchronous)):
+                for method, data in [('put', {'products': ['Product 1']}), ('patch', {'add': ['Product 1']}),
+                                     ('delete', None)]:
+                    response = getattr(self.client, method)(f'/api/v1/orders/{pk}/', data, format='json')
+                    self.assertEqual(response.status_code, status.HTTP_409_CONFLICT, (asynchronous, method))
+                    self.assertEqual(response.json(), {'detail': archive.OrderArchived.default_detail})
+                    missing = getattr(self.client, method)('/api/v1/orders/999999/', data, format='json')
+                    self.assertEqual(missing.status_code, status.HTTP_404_NOT_FOUND)
+        self.assertTrue(ArchivedOrder.objects.filter(pk=pk).exists())
+
+    def test_rebuild_and_export_include_archived_orders(self):
+        sales = sorted(DailySales.objects.values_list('order_date', 'product_id', 'quantity', 'revenue'))
+        exported = list(export.export_rows())
+        archive.archive_orders(self.before)
+
+        rollups.rebuild()
+        self.assertEqual(sorted(DailySales.objects.values_list('order_date', 'product_id', 'quantity', 'revenue')),
+                         sales)
+        self.assertEqual(list(export.export_rows()), exported)
+
+        # A day with both hot and archived lines sums them into one row.
+        Order.objects.filter(pk=Order.objects.order_by('pk')[0].pk).update(order_date=self.before - timedelta(days=1))
+        rollups.rebuild()
+        expected = defaultdict(lambda: [0, Decimal('0')])
+        for lines, order_date in [(OrderItem.objects, 'order__order_date'), (ArchivedOrderItem.objects, 'order_date')]:
+            for day, product, quantity, price in lines.values_list(order_date, 'product', 'quantity', 'unit_price'):
+                expected[day, product][0] += quantity
+                expected[day, product][1] += quantity * price
+        self.assertEqual(sorted(DailySales.objects.values_list('order_date', 'product_id', 'quantity', 'revenue')),
+                         sorted((*key, *totals) for key, totals in expected.items()))
+
+
+@override_settings(DATABASE_REPLICAS=['replica'], DB_REPLICA_PIN_SECONDS=10)
+class ReplicaRoutingTests(APITestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        Product.objects.create(name='Product 1', category=Category.objects.create(name='cloth'), price='1.50')
+        # Stands in for what the replica has replicated so far.
+        self.replicated = Order.objects.using('replica').create(pk=1000, customer_name='Replicated').pk
+
+    def names(self, client, **extra):
+        response = client.get(reverse('order_list'), **extra)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [order['customer_name'] for order in response.data['results']]
+
+    def test_reads_go_to_replica_until_client_writes(self):
+        self.assertEqual(self.names(self.client), ['Replicated'])
+
+        response = self.client.post(reverse('order_list'), {'customer_name': 'Alice', 'products': ['Product 1']},
+                                    format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertFalse(Order.objects.using('replica').filter(customer_name='Alice').exists())
+        pk = response.data['id']
+
+        other = self.client_class()
+        self.assertEqual(self.names(other), ['Replicated'])
+        self.assertEqual(other.get(reverse('order_edit', args=[pk])).status_code, status.HTTP_404_NOT_FOUND)
+        # The writer reads its own order from the primary, through the cookie or the header; the
+        # replica's stale payloads above were not cached under the tokens the write replaced.
+        self.assertEqual(self.names(self.client), ['Alice'])
+        self.assertEqual(self.client.get(reverse('order_edit', args=[pk])).status_code, status.HTTP_200_OK)
+        order_cache.cache.clear()
+        self.assertEqual(self.names(other, HTTP_X_READ_PRIMARY_UNTIL=response['X-Read-Primary-Until']), ['Alice'])
+
+        order_cache.cache.clear()
+        with patch('shop.routers.time.time', return_value=time.time() + 11):
+            self.assertEqual(self.names(self.client), ['Replicated'])
+
+        # Only the server's own stamps pin.
+        forged = response['X-Read-Primary-Until'].replace(response['X-Read-Primary-Until'].split(':')[0], '9999999999')
+        for until in ['9999999999', forged]:
+            order_cache.cache.clear()
+            self.assertEqual(self.names(other, HTTP_X_READ_PRIMARY_UNTIL=until), ['Replicated'])
+
+    def test_writes_and_async_reads(self):
+        self.assertEqual(self.client.put(reverse('order_edit', args=[self.replicated]), {'products': ['Product 1']},
+                                         format='json').status_code, status.HTTP_404_NOT_FOUND)
+        response = self.client.post(reverse('order_list'), {'customer_name': 'Alice', 'products': ['Product 1']},
+                                    format='json')
+        pk = response.data['id']
+        self.assertEqual(self.client.patch(reverse('order_edit', args=[pk]), {'add': ['Product 1']},
+                                           format='json').status_code, status.HTTP_200_OK)
+
+        order_cache.cache.clear()
+        with override_settings(ROOT_URLCONF=api_urlconf(True)):
+            async def get(path, **extra):
+                return await self.async_client.get(path, **extra)
+            self.assertEqual(async_to_sync(get)(f'/api/v1/orders/{pk}/').status_code, status.HTTP_404_NOT_FOUND)
+            pinned = async_to_sync(get)(f'/api/v1/orders/{pk}/', X_READ_PRIMARY_UNTIL=response['X-Read-Primary-Until'])
+            self.assertEqual(pinned.status_code, status.HTTP_200_OK)
+
+    @override_settings(DATABASE_REPLICAS=[])
+    def test_no_replicas(self):
+        response = self.client.post(reverse('order_list'), {'customer_name': 'Alice', 'products': ['Product 1']},
+                                    format='json')
+        self.assertNotIn('X-Read-Primary-Until', response)
+        self.assertEqual(self.names(self.client), ['Alice'])
+
+
+class GenerateDataTests(TestCase):
+    def generate(self, *args):
+        call_command('generate_data', '--products', '12', '--orders', '300', '--batch-size', '100', *args,
+                     stderr=StringIO())
+
+    def snapshot(self):
+        return (list(Product.objects.order_by('id').values_list('name', 'category__name', 'price', 'sold_items_count')),
+                list(Order.objects.order_by('id').values_list('customer_name', 'total_amount', 'order_date')),
+                list(OrderItem.objects.order_by('id').values_list('order_id', 'product_id', 'quantity', 'unit_price')))
+
+    def test_generated_data_is_consistent(self):
+        self.generate()
+        self.assertEqual(Order.objects.count(), 300)
+        for order in Order.objects.prefetch_related('items'):
+            self.assertEqual(order.total_amount, sum(item.quantity * item.unit_price for item in order.items.all()))
+        for product in Product.objects.all():
+            sold = sum(OrderItem.objects.filter(product=product).values_list('quantity', flat=True))
+            self.assertEqual(product.sold_items_count, sold)
+
+        rows = list(DailySales.objects.order_by('order_date', 'product').values_list('product', 'quantity', 'revenue'))
+        rollups.rebuild()
+        self.assertEqual(rows, list(DailySales.objects.order_by('order_date', 'product')
+                                    .values_list('product', 'quantity', 'revenue')))
+
+        order = Order.objects.create(customer_name='After')
+        self.assertEqual(order.pk, 301)
+
+    def test_same_seed_same_data(self):
+        self.generate('--seed', '7')
+        first = self.snapshot()
+        archive.archive_orders(Order.objects.order_by('-order_date').values_list('order_date', flat=True)[0])
+        self.generate('--seed', '7', '--clear')
+        self.assertEqual(first, self.snapshot())
+        self.assertFalse(ArchivedOrder.objects.exists())
+        self.assertFalse(ArchivedOrderItem.objects.exists())
+
+        with self.assertRaises(CommandError):
+            self.generate()
+
+
+class BenchmarkTests(TestCase):
+    def test_benchmark_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'results.json')
+            call_command('benchmark', '--in-place', '--sizes', '40', '--iterations', '3', '--warmup', '1',
+                         '--samples', '2', '--products', '8', '--bulk-size', '5', '--output', path,
+                         stdout=StringIO(), stderr=StringIO())
+            with open(path) as source:
+                report = json.load(source)
+
+        results = report['results']['40']
+        self.assertEqual(list(results), list(benchmark.SCENARIOS))
+        for result in results.values():
+            self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+            self.assertGreater(result['queries'], 0)
+        self.assertEqual(Order.objects.count(), 40 - 6 + 6 + 6 * 5)
+        self.assertTrue(order_cache.enabled)
+        self.assertTrue(all(result['cache_hit_ratio'] is None for result in results.values()))
+
+    def test_cache_hit_ratio(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'results.json')
+            call_command('benchmark', '--in-place', '--cache', '--sizes', '20', '--scenarios', 'list',
+                         'list_with_writes', '--iterations', str(2 * (benchmark.LIST_WRITE_EVERY + 1)),
+                         '--warmup', '1', '--samples', '1', '--products', '5', '--output', path,
+                         stdout=StringIO(), stderr=StringIO())
+            with open(path) as source:
+                results = json.load(source)['results']['20']
+
+        self.assertEqual(results['list']['cache_hit_ratio'], 1.0)
+        # Each write misses the next list read.
+        reads = 2 * benchmark.LIST_WRITE_EVERY
+        self.assertEqual(results['list_with_writes']['cache_hit_ratio'], round((reads - 2) / reads, 3))
+
+    def test_compare(self):
+        baseline = {'results': {'40': {'detail': {'p95_ms': 2.0, 'queries': 3, 'peak_memory_kib': 10.0}}}}
+        report = {'results': {'40': {'detail': {'p95_ms': 2.3, 'queries': 3, 'peak_memory_kib': 10.0},
+                                     'list': {'p95_ms': 9.0, 'queries': 9, 'peak_memory_kib': 99.0}}}}
+        self.assertEqual(benchmark.compare(baseline, report, threshold=0.2), [])
+
+        report['results']['40']['detail'].update(p95_ms=2.5, queries=4)
+        self.assertEqual(benchmark.compare(baseline, report, threshold=0.2),
+                         ['detail@40: p95_ms 2.0 -> 2.5', 'detail@40: queries 3 -> 4'])
+
+
+class BenchmarkAsgiTests(TransactionTestCase):
+    # The ASGI handler runs every request in a thread of its own, which cannot see the data of an open TestCase
+    # transaction.
+    def test_benchmark_asgi(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'results.json')
+            call_command('benchmark', '--in-place', '--asgi', '--sizes', '20', '--scenarios', 'list', 'detail',
+                         '--iterations', '6', '--concurrency', '3', '--client-delay', '0', '--products', '5',
+                         '--output', path, stdout=StringIO(), stderr=StringIO())
+            with open(path) as source:
+                report = json.load(source)
+
+        results = report['results']['20']
+        self.assertEqual(list(results), ['list:sync', 'list:async', 'detail:sync', 'detail:async'])
+        for result in results.values():
+            self.assertEqual(result['concurrency'], 3)
+            self.assertLessEqual(result['p50_ms'], result['p95_ms'])
+            self.assertGreaterEqual(result['peak_threads'], 1)
+
+
+@override_settings(ORDERS_FAST_READS=True)
+class RequestMetricsTests(APITestCase):
+    def setUp(self):
+        endpoint_stats.reset()
+        category = Category.objects.create(name='Test Category')
+        product = Product.objects.create(name='Product 1', category=category, price=10.00)
+        self.order = Order.objects.create(customer_name='A')
+        self.order.products.add(product)
+        self.url = f'/api/v1/orders/{self.order.id}/'
+
+    def test_server_timing_header(self):
+        with self.assertNumQueries(3):
+            self.assertNotIn('Server-Timing', self.client.get(self.url))
+        with override_settings(DEBUG=True):
+            self.assertTrue(shows_server_timing(RequestFactory().get(self.url)))
+
+        self.client.force_login(User.objects.create_user('staff', is_staff=True))
+        with CaptureQueriesContext(connection) as captured:
+            response = self.client.get(self.url)
+        timing = response['Server-Timing']
+        self.assertIn(f'desc="{len(captured)} queries"', timing)
+        for metric in ['db;dur=', 'serialize;dur=', 'render;dur=', 'total;dur=']:
+            self.assertIn(metric, timing)
+        self.assertGreater(endpoint_stats.stats()['order_edit']['GET']['avg_serialize_ms'], 0)
+
+        with override_settings(REQUEST_METRICS_SERVER_TIMING=False):
+            self.assertNotIn('Server-Timing', self.client.get(self.url))
+        self.client.force_login(User.objects.create_user('customer'))
+        self.assertNotIn('Server-Timing', self.client.get(self.url))
+
+    def test_stats_per_url_name_and_method(self):
+        self.client.get(self.url)
+        self.client.get(self.url)
+        self.client.put(self.url, {'products': ['Product 1']}, format='json')
+        self.client.get('/api/v1/missing/')
+
+        admin = User.objects.create_superuser('admin', 'admin@example.com', 'password')
+        self.client.force_login(admin)
+        endpoints = self.client.get(reverse('metrics')).json()['endpoints']
+        self.assertEqual(set(endpoints['order_edit']), {'GET', 'PUT'})
+        self.assertEqual(endpoints['order_edit']['GET']['requests'], 2)
+        self.assertEqual(endpoints['order_edit']['GET']['budget'], 6)
+        self.assertEqual(endpoints['order_edit']['GET']['over_budget'], 0)
+        self.assertNotIn('metrics', endpoints)
+
+    @override_settings(QUERY_BUDGETS={'order_edit:GET': 0, 'order_edit': 100}, QUERY_BUDGET_RAISE=False)
+    def test_over_budget_is_logged(self):
+        with self.assertLogs('shop.instrumentation', 'WARNING') as logs:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIn('GET order_edit ran 3 queries, over its budget of 0.', logs.output[0])
+        self.assertEqual(endpoint_stats.stats()['order_edit']['GET']['over_budget'], 1)
+
+        with override_settings(QUERY_BUDGET_RAISE=True):
+            with self.assertRaises(QueryBudgetExceeded):
+                self.client.get(self.url)
+            self.client.delete(self.url)
+
+
+class AsyncOrderViewTests(TestCase):
+    def setUp(self):
+        cloth = Category.objects.create(name='cloth')
+        shoes = Category.objects.create(name='shoes')
+        for i in range(4):
+            Product.objects.create(name=f'Product {i}', category=[cloth, shoes][i % 2], price=f'{i}.5')
+        self.orders = []
+        for i in range(4):
+            response = self.client.post('/api/v1/orders/', {'customer_name': f'Customer {i}', 'products': [
+                'Product 0', {'name': f'Product {i}', 'quantity': 2}]}, content_type='application/json')
+            self.orders.append(response.json()['id'])
+
+    def request(self, asynchronous, method, path, data=None, **extra):
+        """Send the request to the sync or the async views, with an empty response cache."""
+        order_cache.cache.clear()
+        with override_settings(ROOT_URLCONF=api_urlconf(asynchronous)):
+            if asynchronous:
+                async def send():
+                    return await getattr(self.async_client, method)(path, data, content_type='application/json',
+                                                                    **extra)
+                return async_to_sync(send)()
+            return getattr(self.client, method)(path, data, content_type='application/json', **extra)
+
+    def assertSameResponse(self, method, path, data=None, ignore=(), **extra):
+        sync = self.request(False, method, path, data, **extra)
+        asynchronous = self.request(True, method, path, data, **extra)
+        self.assertEqual(asynchronous.status_code, sync.status_code)
+        for header in ['Content-Type', 'Allow', 'Vary', 'ETag', 'Idempotent-Replayed']:
+            self.assertEqual(asynchronous.get(header), sync.get(header), header)
+        if sync.content and sync['Content-Type'] == 'application/json':
+            expected, actual = sync.json(), asynchronous.json()
+            for field in ignore:
+                expected.pop(field), actual.pop(field)
+            self.assertEqual(actual, expected)
+        return asynchronous
+
+    def test_reads_match(self):
+        self.assertSameResponse('get', '/api/v1/orders/')
+        response = self.assertSameResponse('get', '/api/v1/orders/', {'page_size': 2})
+        self.assertSameResponse('get', response.json()['next'])
+        self.assertSameResponse('get', '/api/v1/orders/', {'cursor': 'bogus'})
+        self.assertSameResponse('get', f'/api/v1/orders/{self.orders[1]}/')
+        self.assertSameResponse('get', '/api/v1/orders/999999/')
+
+        etag = self.request(False, 'get', f'/api/v1/orders/{self.orders[1]}/')['ETag']
+        response = self.assertSameResponse('get', f'/api/v1/orders/{self.orders[1]}/', headers={'If-None-Match': etag})
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+        with override_settings(ORDERS_FAST_READS=False):
+            self.assertSameResponse('get', f'/api/v1/orders/{self.orders[1]}/')
+        response = self.request(True, 'get', '/api/v1/orders/', headers={'Accept': 'text/html'})
+        self.assertEqual(response['Content-Type'], 'text/html; charset=utf-8')
+
+    def test_writes_match(self):
+        body = {'customer_name': 'New', 'products': ['Product 1', {'name': 'Product 2', 'quantity': 3}]}
+        self.assertSameResponse('post', '/api/v1/orders/', body, ignore=['id'])
+        self.assertSameResponse('post', '/api/v1/orders/', {'customer_name': 'New', 'products': ['Missing']})
+        self.assertSameResponse('post', '/api/v1/orders/', {'customer_name': 'New'})
+
+        created = self.request(True, 'post', '/api/v1/orders/', body, headers={'Idempotency-Key': 'k'})
+        for asynchronous in [True, False]:
+            replay = self.request(asynchronous, 'post', '/api/v1/orders/', body, headers={'Idempotency-Key': 'k'})
+            self.assertEqual(replay.json(), created.json())
+            self.assertEqual(replay['Idempotent-Replayed'], 'true')
+
+        first, second = self.orders[2], self.orders[3]
+        self.client.put(f'/api/v1/orders/{second}/', {'products': ['Product 0', {'name': 'Product 2', 'quantity': 2}]},
+                        content_type='application/json')
+        sync = self.request(False, 'put', f'/api/v1/orders/{first}/', {'products': ['Product 3']}).json()
+        asynchronous = self.request(True, 'put', f'/api/v1/orders/{second}/', {'products': ['Product 3']}).json()
+        self.assertEqual({**asynchronous, 'id': first, 'customer_name': sync['customer_name']}, sync)
+
+        sync = self.request(False, 'patch', f'/api/v1/orders/{first}/', {'add': ['Product 1']}).json()
+        asynchronous = self.request(True, 'patch', f'/api/v1/orders/{second}/', {'add': ['Product 1']}).json()
+        self.assertEqual(asynchronous['total_amount'], sync['total_amount'])
+        self.assertSameResponse('patch', f'/api/v1/orders/{first}/', {'add': 'Product 1'})
+        self.assertSameResponse('put', '/api/v1/orders/999999/', {'products': ['Product 1']})
+
+        self.assertEqual(self.request(True, 'delete', f'/api/v1/orders/{second}/').status_code,
+                         status.HTTP_204_NO_CONTENT)
+        self.assertSameResponse('delete', f'/api/v1/orders/{second}/')
+        self.assertEqual(Product.objects.get(name='Product 3').sold_items_count, 1)
+
+    def test_permissions_and_throttles_match(self):
+        class Throttled(BaseThrottle):
+            def allow_request(self, request, view):
+                return False
+
+            def wait(self):
+                return 60
+
+        class OwnOrdersOnly(permissions.BasePermission):
+            def has_object_permission(self, request, view, obj):
+                return False
+
+        pk = self.orders[0]
+        requests = [('get', '/api/v1/orders/'), ('post', '/api/v1/orders/', {'customer_name': 'X', 'products': []}),
+                    ('get', f'/api/v1/orders/{pk}/'), ('patch', f'/api/v1/orders/{pk}/', {'add': ['Product 1']}),
+                    ('delete', f'/api/v1/orders/{pk}/')]
+        with patch.object(views.OrderListCreateView, 'permission_classes', [permissions.IsAuthenticated]), \
+                patch.object(views.OrderRetrieveUpdateDeleteView, 'permission_classes', [permissions.IsAuthenticated]):
+            for request in requests:
+                self.assertEqual(self.assertSameResponse(*request).status_code, status.HTTP_403_FORBIDDEN, request)
+
+        user = User.objects.create_user('user')
+        self.client.force_login(user)
+        self.async_client.force_login(user)
+        with patch.object(views.OrderListCreateView, 'throttle_classes', [Throttled]):
+            response = self.assertSameResponse('get', '/api/v1/orders/')
+            self.assertEqual(response.status_code, status.HTTP_429_TOO_MANY_REQUESTS)
+            self.assertEqual(response['Retry-After'], '60')
+        with patch.object(views.OrderRetrieveUpdateDeleteView, 'permission_classes', [OwnOrdersOnly]):
+            for request in requests[3:]:
+                self.assertEqual(self.assertSameResponse(*request).status_code, status.HTTP_403_FORBIDDEN, request)
+        self.assertEqual(self.request(True, 'get', f'/api/v1/orders/{pk}/').status_code, status.HTTP_200_OK)
+        self.assertTrue(Order.objects.filter(pk=pk).exists())
+
+    @override_settings(ORDERS_FAST_READS=True)
+    def test_async_queries_are_instrumented(self):
+        endpoint_stats.reset()
+        self.request(True, 'get', f'/api/v1/orders/{self.orders[0]}/')
+        self.assertEqual(endpoint_stats.stats()['order_edit']['GET']['max_queries'], 3)
+
+        endpoint_stats.reset()
+        self.async_client.force_login(User.objects.create_user('staff', is_staff=True))
+        response = self.request(True, 'get', f'/api/v1/orders/{self.orders[0]}/')
+        queries = endpoint_stats.stats()['order_edit']['GET']['max_queries']
+        self.assertIn(f'desc="{queries} queries"', response['Server-Timing'])
+
+
+class DebugToolbarSwitchTests(TestCase):
+    def urlpatterns(self, debug_toolbar):
+        import Straus.urls
+        try:
+            with override_settings(DEBUG_TOOLBAR=debug_toolbar):
+                return [str(pattern.pattern) for pattern in importlib.reload(Straus.urls).urlpatterns]
+        finally:
+            importlib.reload(Straus.urls)
+
+    def test_debug_toolbar_urls_follow_setting(self):
+        self.assertIn('__debug__/', self.urlpatterns(True))
+        self.assertNotIn('__debug__/', self.urlpatterns(False))
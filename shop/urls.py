@@ -1,7 +1,45 @@
-from django.urls import path
-from .views import OrderListCreateView, OrderRetrieveUpdateDeleteView
+import functools
+import types
 
-urlpatterns = [
-    path('orders/', OrderListCreateView.as_view(), name='order_list'),
-    path('orders/<int:pk>/', OrderRetrieveUpdateDeleteView().as_view(), name='order_edit')
+from django.conf import settings
+from django.urls import include, path
+from . import async_views
+from .views import OrderListCreateView, OrderBulkCreateView, OrderRetrieveUpdateDeleteView, OrderExportView, \
+    OrderPurgeView, MetricsView, TopProductsView, DailySalesView
+
+
+def order_patterns(asynchronous=False):
+    """The order list and detail routes, served by the DRF views or by their async versions."""
+    if asynchronous:
+        return [
+            path('orders/', async_views.order_list, name='order_list'),
+            path('orders/<int:pk>/', async_views.order_edit, name='order_edit'),
+        ]
+    return [
+        path('orders/', OrderListCreateView.as_view(), name='order_list'),
+        path('orders/<int:pk>/', OrderRetrieveUpdateDeleteView().as_view(), name='order_edit'),
+    ]
+
+
+shop_patterns = [
+    path('orders/bulk/', OrderBulkCreateView.as_view(), name='order_bulk'),
+    path('orders/purge/', OrderPurgeView.as_view(), name='order_purge'),
+    path('orders/export/', OrderExportView.as_view(), name='order_export'),
+    path('stats/top-products/', TopProductsView.as_view(), name='stats_top_products'),
+    path('stats/daily/', DailySalesView.as_view(), name='stats_daily'),
+    path('metrics/', MetricsView.as_view(), name='metrics'),
 ]
+
+urlpatterns = order_patterns(getattr(settings, 'ORDERS_ASYNC_VIEWS', False)) + shop_patterns
+
+
+@functools.lru_cache(maxsize=None)
+def api_urlconf(asynchronous):
+    """
+    A root URLconf with the API under /api/v1/ and the order routes served
+    by the sync or async views whatever ORDERS_ASYNC_VIEWS says, for
+    ROOT_URLCONF overrides that compare the two.
+    """
+    urlconf = types.ModuleType(f'{__name__}.{"async" if asynchronous else "sync"}')
+    urlconf.urlpatterns = [path('api/v1/', include(order_patterns(asynchronous) + shop_patterns))]
+    return urlconf
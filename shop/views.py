@@ -1,50 +1,349 @@
-from django.db import transaction, IntegrityError
-from rest_framework import generics, status
+from collections import Counter
+from datetime import date
+
+from django.conf import settings
+from django.db import IntegrityError
+from django.db.models import Q
+from django.http import Http404, StreamingHttpResponse
+from rest_framework import generics, permissions, status
 from rest_framework.response import Response
-from .models import Order, Product
-from .serializers import OrderSerializer, OrderListSerializer, OrderCreateUpdateSerializer
+from rest_framework.views import APIView
+from . import archive, conditional, counters, export, fieldsets, idempotency, outbox, projections, rollups, routers
+from .caching import order_cache
+from .instrumentation import endpoint_stats, serializing
+from .models import Order, OrderItem, Product
+from .pagination import OrderCursorPagination
+from .resolvers import product_resolver
+from .serializers import OrderSerializer, OrderListSerializer, OrderCreateUpdateSerializer, TopProductSerializer, \
+    DailySalesSerializer
+
+
+def parse_quantities(items):
+    """
+    Turn a ``products`` list into {name: quantity}. Items are either product
+    names, each counting as one piece, or ``{"name": ..., "quantity": n}``
+    objects; repeated names add up. Returns None if the list is malformed or
+    a product adds up to more than ORDERS_MAX_QUANTITY pieces.
+    """
+    if not isinstance(items, list):
+        return None
+
+    quantities = Counter()
+    for item in items:
+        if isinstance(item, str):
+            quantities[item] += 1
+        elif isinstance(item, dict) and isinstance(item.get('name'), str) \
+                and type(item.get('quantity', 1)) is int and item.get('quantity', 1) > 0:
+            quantities[item['name']] += item.get('quantity', 1)
+        else:
+            return None
+    if any(quantity > getattr(settings, 'ORDERS_MAX_QUANTITY', 10000) for quantity in quantities.values()):
+        return None
+    return quantities
+
+
+def by_product_id(quantities, product_ids):
+    return {product_ids[name]: quantity for name, quantity in quantities.items()}
+
+
+def create_order(data):
+    """Create the order described by a POST /api/v1/orders/ body; shared with the async views."""
+    customer_name = data.get('customer_name', None)
+    quantities = parse_quantities(data.get('products', []))
+
+    if customer_name is None or not quantities:
+        return Response(
+            {"error": "Both customer_name and products are required and should be in the correct format."},
+            status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        product_ids = product_resolver.resolve(quantities)
+
+        missing = set(quantities) - product_ids.keys()
+        if missing:
+            raise Product.DoesNotExist(f"Products with names {missing} do not exist.")
+
+        order = counters.create_orders([Order(customer_name=customer_name)],
+                                       [by_product_id(quantities, product_ids)])[0]
+
+    except (Product.DoesNotExist, counters.OrderTooLarge) as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    except IntegrityError as e:
+        return Response({"error": "An error occurred while creating the order. Please try again."},
+                        status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+    except Exception as e:
+        return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+    with serializing():
+        data = OrderCreateUpdateSerializer(order).data
+    return Response(data, status=status.HTTP_201_CREATED)
+
+
+def update_order(instance, data, partial=False):
+    """
+    PUT (or PATCH with ``products``) replaces the lines of the order. PATCH
+    with ``add`` and/or ``remove`` lists raises or lowers the quantities of
+    individual products. Either way only the lines that actually change
+    are written. Shared with the async views.
+    """
+    if partial and 'products' not in data and ('add' in data or 'remove' in data):
+        return change_order_products(instance, data)
+
+    quantities = parse_quantities(data.get('products', None))
+
+    if quantities is None:
+        return Response({"error": "The request should contain a list of products."},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    product_ids = product_resolver.resolve(quantities)
+
+    missing = set(quantities) - product_ids.keys()
+    if missing:
+        return Response({"error": f"Products {missing} do not exist."},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        counters.set_order_products(instance, by_product_id(quantities, product_ids))
+    except counters.OrderTooLarge as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    with serializing():
+        data = OrderCreateUpdateSerializer(instance).data
+
+    return Response(data, status=status.HTTP_200_OK)
+
+
+def change_order_products(instance, data):
+    add = parse_quantities(data.get('add', []))
+    remove = parse_quantities(data.get('remove', []))
+
+    if add is None or remove is None:
+        return Response({"error": "add and remove should be lists of products."},
+                        status=status.HTTP_400_BAD_REQUEST)
+    if add.keys() & remove.keys():
+        return Response({"error": f"Products {add.keys() & remove.keys()} are both added and removed."},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    product_ids = product_resolver.resolve(add.keys() | remove.keys())
+
+    missing = (add.keys() | remove.keys()) - product_ids.keys()
+    if missing:
+        return Response({"error": f"Products {missing} do not exist."},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    try:
+        counters.change_order_products(instance, add=by_product_id(add, product_ids),
+                                       remove=by_product_id(remove, product_ids))
+    except counters.OrderTooLarge as e:
+        return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+    with serializing():
+        data = OrderCreateUpdateSerializer(instance).data
+
+    return Response(data, status=status.HTTP_200_OK)
+
+
+def order_filters(params):
+    """
+    The order list filters of a request as a Q; raises ValueError if
+    malformed. Every one of them, and every combination, is served by an
+    index (see migrations 0011 and 0014). The customer name prefix is
+    case-insensitive on every backend, though SQLite only folds the case of
+    ASCII letters.
+    """
+    filters = Q()
+    if 'customer_name' in params:
+        filters &= Q(customer_name=params['customer_name'])
+    if params.get('customer_name_prefix'):
+        filters &= Q(customer_name__istartswith=params['customer_name_prefix'])
+    try:
+        if 'from' in params:
+            filters &= Q(order_date__gte=date.fromisoformat(params['from']))
+        if 'to' in params:
+            filters &= Q(order_date__lte=date.fromisoformat(params['to']))
+        if 'product' in params:
+            filters &= Q(pk__in=OrderItem.objects.filter(product_id=int(params['product'])).values('order_id'))
+        if 'category' in params:
+            filters &= Q(pk__in=OrderItem.objects.filter(product__category_id=int(params['category']))
+                         .values('order_id'))
+    except ValueError:
+        raise ValueError('from and to should be dates in YYYY-MM-DD format, product and category ids.')
+    return filters
 
 
 class OrderListCreateView(generics.ListCreateAPIView):
-    queryset = Order.objects.prefetch_related('products__category').all()
     serializer_class = OrderListSerializer
+    pagination_class = OrderCursorPagination
+    fieldset = fieldsets.LIST
+    filters = Q()
 
-    def create(self, request, *args, **kwargs):
-        customer_name = request.data.get('customer_name', None)
-        product_names = request.data.get('products', [])
+    def get_queryset(self):
+        return fieldsets.order_queryset(self.fieldset, required=['id', 'order_date'])
+
+    def filter_queryset(self, queryset):
+        return super().filter_queryset(queryset).filter(self.filters)
 
-        if customer_name is None or not isinstance(product_names, list) or not product_names:
-            return Response(
-                {"error": "Both customer_name and products are required and should be in the correct format."},
-                status=status.HTTP_400_BAD_REQUEST)
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), 'fieldset': self.fieldset}
 
+    def list(self, request, *args, **kwargs):
         try:
-            with transaction.atomic():
-                products = Product.objects.select_related('category').filter(name__in=product_names)
+            self.fieldset = fieldsets.parse(request.query_params, fieldsets.LIST)
+            self.filters = order_filters(request.query_params)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if getattr(settings, 'ORDERS_FAST_READS', False):
+            def build():
+                with serializing():
+                    orders = self.filter_queryset(Order.objects.values(*projections.list_columns(self.fieldset)))
+                    page = self.paginate_queryset(orders)
+                    return self.get_paginated_response(projections.order_list(page, self.fieldset)).data
+        else:
+            def build():
+                with serializing():
+                    return super(OrderListCreateView, self).list(request, *args, **kwargs).data
+
+        def respond():
+            return Response(order_cache.list_page(request, build))
+
+        with routers.read_replica(request):
+            page = self.paginator.get_page_queryset(self.filter_queryset(self.get_queryset()), request)
+            return conditional.conditional_response(request, page, respond, self.fieldset)
+
+    def create(self, request, *args, **kwargs):
+        """Create one order; a retry sent with the same Idempotency-Key replays the first response."""
+        return idempotency.idempotent(request, lambda: create_order(request.data))
+
 
-                if len(product_names) != len(products):
-                    missing = set(product_names) - {product.name for product in products}
-                    raise Product.DoesNotExist(f"Products with names {missing} do not exist.")
+class OrderBulkCreateView(generics.GenericAPIView):
+    """
+    Create many orders in one request and one transaction.
 
-                order = Order.objects.create(customer_name=customer_name)
-                OrderProduct = Order.products.through
-                order_products = [OrderProduct(order=order, product=product) for product in products]
+    The body is a list of ``{"customer_name": ..., "products": [...]}``
+    objects, with ``products`` in the same format as for a single order.
+    All product names are resolved with one query and the orders, their
+    lines and the counters are written with a fixed number of statements.
+    By default any invalid item rejects the whole batch; with
+    ``?partial=true`` the valid items are created and the rest reported.
+    """
+    queryset = Order.objects.all()
+    serializer_class = OrderCreateUpdateSerializer
 
-                OrderProduct.objects.bulk_create(order_products)
+    def post(self, request, *args, **kwargs):
+        items = request.data
+        max_items = getattr(settings, 'ORDERS_BULK_MAX_ITEMS', 1000)
 
+        if not isinstance(items, list) or not items:
+            return Response({"error": "The request should contain a non-empty list of orders."},
+                            status=status.HTTP_400_BAD_REQUEST)
+        if len(items) > max_items:
+            return Response({"error": f"At most {max_items} orders can be created per request."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        partial = request.query_params.get('partial', '').lower() in ['1', 'true', 'yes']
+        results = [None] * len(items)
+        valid = []
+
+        for index, item in enumerate(items):
+            customer_name = item.get('customer_name') if isinstance(item, dict) else None
+            quantities = parse_quantities(item.get('products')) if isinstance(item, dict) else None
+            if customer_name is None or not quantities:
+                results[index] = {"index": index, "status": status.HTTP_400_BAD_REQUEST,
+                                  "error": "Both customer_name and products are required and should be in the "
+                                           "correct format."}
+            else:
+                valid.append((index, customer_name, quantities))
+
+        names = {name for _, _, quantities in valid for name in quantities}
+        product_ids = product_resolver.resolve(names)
+
+        pending = []
+        for index, customer_name, quantities in valid:
+            missing = set(quantities) - product_ids.keys()
+            if missing:
+                results[index] = {"index": index, "status": status.HTTP_400_BAD_REQUEST,
+                                  "error": f"Products with names {missing} do not exist."}
+            else:
+                pending.append((index, Order(customer_name=customer_name), by_product_id(quantities, product_ids)))
+
+        try:
+            prices, too_large = counters.price_orders([order for _, order, _ in pending],
+                                                      [quantities for _, _, quantities in pending])
         except Product.DoesNotExist as e:
             return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
-        except IntegrityError as e:
-            return Response({"error": "An error occurred while creating the order. Please try again."},
-                            status=status.HTTP_500_INTERNAL_SERVER_ERROR)
-        except Exception as e:
-            return Response({"error": str(e)}, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        for (index, _, _), error in zip(pending, too_large):
+            if error:
+                results[index] = {"index": index, "status": status.HTTP_400_BAD_REQUEST, "error": str(error)}
+        pending = [entry for entry, error in zip(pending, too_large) if not error]
+
+        if len(pending) != len(items) and not partial:
+            errors = [result for result in results if result is not None]
+            return Response({"errors": errors}, status=status.HTTP_400_BAD_REQUEST)
+
+        if pending:
+            try:
+                orders = counters.create_orders([order for _, order, _ in pending],
+                                                [quantities for _, _, quantities in pending], prices)
+            except (Product.DoesNotExist, counters.OrderTooLarge) as e:
+                return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+            except IntegrityError:
+                return Response({"error": "An error occurred while creating the orders. Please try again."},
+                                status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+
+            with serializing():
+                for (index, _, _), order in zip(pending, orders):
+                    results[index] = {"index": index, "status": status.HTTP_201_CREATED,
+                                      "order": self.get_serializer(order).data}
 
-        order_serializer = OrderCreateUpdateSerializer(order)
-        return Response(order_serializer.data, status=status.HTTP_201_CREATED)
+        response_status = status.HTTP_201_CREATED if len(pending) == len(items) else status.HTTP_207_MULTI_STATUS
+        return Response({"results": results}, status=response_status)
+
+
+class OrderPurgeView(APIView):
+    """
+    Delete many orders at once: ``{"ids": [...]}`` (at most
+    ORDERS_BULK_MAX_ITEMS) or ``{"from": ..., "to": ...}`` (an inclusive
+    ``order_date`` range, at least one bound). Sold counters and rollups are
+    taken back with set-based queries and the orders deleted in chunks of
+    ORDERS_PURGE_CHUNK_SIZE, see counters.purge_orders(). Admins only.
+    """
+    permission_classes = [permissions.IsAdminUser]
+
+    def post(self, request, *args, **kwargs):
+        data = request.data
+        max_items = getattr(settings, 'ORDERS_BULK_MAX_ITEMS', 1000)
+        if not isinstance(data, dict):
+            return Response({"error": "The request should contain ids or a from/to date range."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        if 'ids' in data:
+            ids = data['ids']
+            if not isinstance(ids, list) or not ids or not all(type(pk) is int for pk in ids) \
+                    or 'from' in data or 'to' in data:
+                return Response({"error": "ids should be a non-empty list of order ids, without from and to."},
+                                status=status.HTTP_400_BAD_REQUEST)
+            if len(ids) > max_items:
+                return Response({"error": f"At most {max_items} orders can be deleted by id per request."},
+                                status=status.HTTP_400_BAD_REQUEST)
+            filters = {'ids': ids}
+        else:
+            try:
+                date_from, date_to = [date.fromisoformat(data[name]) if data.get(name) is not None else None
+                                      for name in ['from', 'to']]
+            except (TypeError, ValueError):
+                date_from = date_to = None
+            if date_from is None and date_to is None:
+                return Response({"error": "from and to should be dates in YYYY-MM-DD format, at least one given."},
+                                status=status.HTTP_400_BAD_REQUEST)
+            filters = {'date_from': date_from, 'date_to': date_to}
+
+        deleted = counters.purge_orders(**filters, chunk_size=getattr(settings, 'ORDERS_PURGE_CHUNK_SIZE', 1000))
+        return Response({"deleted": deleted})
 
 
 class OrderRetrieveUpdateDeleteView(generics.RetrieveUpdateDestroyAPIView):
+    fieldset = fieldsets.DETAIL
 
     def get_serializer_class(self):
         if self.request.method in ['PUT', 'PATCH']:
@@ -53,35 +352,157 @@ class OrderRetrieveUpdateDeleteView(generics.RetrieveUpdateDestroyAPIView):
             return OrderSerializer
 
     def get_queryset(self):
-        if self.request.method == 'DELETE':
-            return Order.objects.prefetch_related('products').all()
-        elif self.request.method in ['PUT', 'PATCH']:
+        if self.request.method in ['PUT', 'PATCH', 'DELETE']:
             return Order.objects.all()
         else:
-            return Order.objects.prefetch_related('products__category').all()
+            return fieldsets.order_queryset(self.fieldset)
+
+    def get_serializer_context(self):
+        return {**super().get_serializer_context(), 'fieldset': self.fieldset}
+
+    def get_object(self):
+        try:
+            return super().get_object()
+        except Http404:
+            if self.request.method in ['PUT', 'PATCH', 'DELETE'] and archive.is_archived(self.kwargs['pk']):
+                raise archive.OrderArchived
+            raise
+
+    def retrieve(self, request, *args, **kwargs):
+        try:
+            self.fieldset = fieldsets.parse(request.query_params, fieldsets.DETAIL)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        def build():
+            with serializing():
+                if getattr(settings, 'ORDERS_FAST_READS', False):
+                    return projections.order_detail(self.kwargs['pk'], self.fieldset)
+                try:
+                    instance = self.get_object()
+                except Http404:
+                    # Archived orders have no model instance to serialize; the projection reads them.
+                    return projections.order_detail(self.kwargs['pk'], self.fieldset)
+                products = []
+                if 'products' in self.fieldset:
+                    categories = fieldsets.is_expanded(self.fieldset['products'] or {}, 'category')
+                    products = [(product.pk, product.category_id if categories else None)
+                                for product in instance.products.all()]
+                return self.get_serializer(instance).data, products
+
+        variant = fieldsets.variant(request.query_params)
+        with routers.read_replica(request):
+            return conditional.conditional_response(
+                request, Order.objects.filter(pk=self.kwargs['pk']),
+                lambda: Response(order_cache.detail(self.kwargs['pk'], build, variant)), self.fieldset)
 
     def update(self, request, *args, **kwargs):
-        instance = self.get_object()
-        products_names = request.data.get('products', None)
+        return update_order(self.get_object(), request.data, partial=kwargs.get('partial', False))
+
+    def perform_destroy(self, instance):
+        counters.delete_orders([instance.pk])
+
+
+class OrderExportView(APIView):
+    """
+    Stream the orders of an ``order_date`` range as NDJSON (default) or CSV;
+    admin only.
+
+    Query parameters: ``from`` and ``to`` (inclusive ISO dates, both
+    optional) and ``output`` (``ndjson`` or ``csv``).
+    """
+    permission_classes = [permissions.IsAdminUser]
+    content_types = {'ndjson': 'application/x-ndjson', 'csv': 'text/csv'}
+
+    def get(self, request, *args, **kwargs):
+        export_format = request.query_params.get('output', 'ndjson')
+        if export_format not in export.EXPORT_FORMATS:
+            return Response({"error": f"output should be one of {export.EXPORT_FORMATS}."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        try:
+            date_from, date_to = [date.fromisoformat(request.query_params[name]) if name in request.query_params
+                                  else None for name in ['from', 'to']]
+        except ValueError:
+            return Response({"error": "from and to should be dates in YYYY-MM-DD format."},
+                            status=status.HTTP_400_BAD_REQUEST)
+
+        lines = export.export_lines(export_format, date_from, date_to,
+                                    chunk_size=getattr(settings, 'ORDERS_EXPORT_CHUNK_SIZE', 2000))
+        response = StreamingHttpResponse(lines, content_type=self.content_types[export_format])
+        response['Content-Disposition'] = f'attachment; filename="orders.{export_format}"'
+        return response
+
+
+def stats_filters(params):
+    """Date range, category and product filters of a stats request; raises ValueError if malformed."""
+    filters = {}
+    for name, key in [('from', 'date_from'), ('to', 'date_to')]:
+        if name in params:
+            filters[key] = date.fromisoformat(params[name])
+    for name in ['category', 'product']:
+        if name in params:
+            filters[name] = int(params[name])
+    return filters
+
 
-        if not isinstance(products_names, list):
-            return Response({"error": "The request should contain a list of products."},
+class TopProductsView(APIView):
+    """
+    Best-selling products of an ``order_date`` range, read from the daily
+    rollups. Query parameters: ``from``, ``to``, ``category``, ``by``
+    (``quantity`` or ``revenue``) and ``limit`` (at most 100).
+    """
+
+    def get(self, request, *args, **kwargs):
+        by = request.query_params.get('by', 'quantity')
+        try:
+            filters = stats_filters(request.query_params)
+            limit = int(request.query_params.get('limit', 10))
+        except ValueError:
+            return Response({"error": "from and to should be dates in YYYY-MM-DD format, category, product and "
+                                      "limit should be integers."}, status=status.HTTP_400_BAD_REQUEST)
+        if by not in rollups.SORT_FIELDS or not 1 <= limit <= 100:
+            return Response({"error": f"by should be one of {list(rollups.SORT_FIELDS)} and limit between 1 and 100."},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        existing_products = Product.objects.filter(name__in=products_names)
+        rows = rollups.top_products(by=by, limit=limit, **filters)
+        with serializing():
+            data = TopProductSerializer(rows, many=True).data
+        return Response({"results": data})
+
 
-        if len(existing_products) != len(products_names):
-            missing = set(products_names) - {product.name for product in existing_products}
-            return Response({"error": f"Products {missing} do not exist."},
+class DailySalesView(APIView):
+    """
+    Quantity and revenue per ``order_date``, read from the daily rollups.
+    Query parameters: ``from``, ``to``, ``category``, ``product`` and
+    ``group`` (``total``, ``category`` or ``product``).
+    """
+
+    def get(self, request, *args, **kwargs):
+        group = request.query_params.get('group', 'total')
+        try:
+            filters = stats_filters(request.query_params)
+        except ValueError:
+            return Response({"error": "from and to should be dates in YYYY-MM-DD format, category and product "
+                                      "should be integers."}, status=status.HTTP_400_BAD_REQUEST)
+        if group not in rollups.DAILY_GROUPS:
+            return Response({"error": f"group should be one of {list(rollups.DAILY_GROUPS)}."},
                             status=status.HTTP_400_BAD_REQUEST)
 
-        with transaction.atomic():
-            Order.products.through.objects.filter(order_id=instance.id).delete()
-            new_order_products = [Order.products.through(order_id=instance.id, product_id=product.id) for product in
-                                  existing_products]
+        rows = rollups.daily(group=group, **filters)
+        with serializing():
+            data = DailySalesSerializer(rows, many=True).data
+        return Response({"results": data})
 
-            Order.products.through.objects.bulk_create(new_order_products)
 
-        serializer = self.get_serializer(instance)
+class MetricsView(APIView):
+    """In-process counters of this worker, for checking caches in production."""
+    permission_classes = [permissions.IsAdminUser]
 
-        return Response(serializer.data, status=status.HTTP_200_OK)
+    def get(self, request, *args, **kwargs):
+        return Response({
+            'product_resolver': product_resolver.stats(),
+            'order_cache': order_cache.stats(),
+            'sold_items_outbox': outbox.stats(),
+            'endpoints': endpoint_stats.stats(),
+        })